@@ -0,0 +1,152 @@
+"""Бенчмарк пересылки прокси: строк/сек на одно ядро, write-вызовов на строку и задержка пересылки.
+
+Запуск из корня проекта:
+    python scripts/bench_forward.py --lines 500000 --authorize-every 1000
+    python scripts/bench_forward.py --socket --bursts 2000 --burst-size 20
+
+Без --socket строки майнера прогоняются через forward_to_pool в памяти (только CPU).
+С --socket пул -> майнер пересылается через настоящие TCP-сокеты на localhost пачками
+строк (как всплеск mining.notify): печатаются p50/p99 задержки и write-вызовы на строку
+(каждый write ≈ один системный вызов send; точнее — strace -c -e trace=sendto,write).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.stratum_proxy.forwarding import FORWARD_STATS, forward_to_miner, forward_to_pool  # noqa: E402
+
+ALIAS_MAP = {"alice": "DWalletAliceXXXXXXXXXXXXXXXXXXXXXX"}
+SUBMIT = b'{"id": 4, "method": "mining.submit", "params": ["alice.rig01", "6a3f", "00000000", "5f5e1000", "1d00ffff"]}\n'
+AUTHORIZE = b'{"id": 2, "method": "mining.authorize", "params": ["alice.rig01", "x"]}\n'
+
+class NullTransport:
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+class NullWriter:
+    """Писатель-заглушка: считает байты и write-вызовы, ничего не отправляет."""
+    def __init__(self):
+        self.bytes = 0
+        self.writes = 0
+        self.transport = NullTransport()
+
+    def write(self, data):
+        self.bytes += len(data)
+        self.writes += 1
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+def build_payload(lines, authorize_every):
+    chunks = []
+    for i in range(lines):
+        chunks.append(AUTHORIZE if authorize_every and i % authorize_every == 0 else SUBMIT)
+    return b"".join(chunks)
+
+async def run_once(payload, fast_path, buffered):
+    reader = asyncio.StreamReader(limit=2 ** 20)
+    reader.feed_data(payload)
+    reader.feed_eof()
+    writer = NullWriter()
+    started = time.perf_counter()
+    await forward_to_pool(reader, writer, ALIAS_MAP, ("bench", 0), fast_path=fast_path, buffered=buffered)
+    return time.perf_counter() - started, writer.writes
+
+def bench_cpu(args):
+    payload = build_payload(args.lines, args.authorize_every)
+    variants = (
+        ("json.loads на каждую строку", False, False),
+        ("быстрый путь (байты)", True, False),
+        ("быстрый путь + пачки", True, True),
+    )
+    baseline = None
+    for label, fast_path, buffered in variants:
+        runs = [asyncio.run(run_once(payload, fast_path, buffered)) for _ in range(args.repeat)]
+        best, writes = min(runs)
+        rate = args.lines / best
+        baseline = baseline or rate
+        print(f"{label:32s} {rate:>12,.0f} строк/сек  x{rate / baseline:.2f}  write/строку {writes / args.lines:.3f}")
+
+async def run_socket(args, buffered):
+    """Источник -> forward_to_miner -> приёмник; в каждой строке время отправки в нс."""
+    for counters in FORWARD_STATS.values():
+        for key in counters:
+            counters[key] = 0
+    latencies = []
+    done = asyncio.Event()
+    relay_done = asyncio.Event()
+    expected = args.bursts * args.burst_size
+
+    async def sink(reader, writer):
+        while len(latencies) < expected:
+            line = await reader.readline()
+            if not line:
+                break
+            latencies.append(time.perf_counter_ns() - int(line.split(b" ", 1)[0]))
+        done.set()
+
+    async def relay(reader, writer):
+        sink_reader, sink_writer = await asyncio.open_connection("127.0.0.1", sink_port)
+        await forward_to_miner(reader, sink_writer, ("bench", 0), buffered=buffered)
+        relay_done.set()
+
+    sink_server = await asyncio.start_server(sink, "127.0.0.1", 0)
+    sink_port = sink_server.sockets[0].getsockname()[1]
+    relay_server = await asyncio.start_server(relay, "127.0.0.1", 0)
+    relay_port = relay_server.sockets[0].getsockname()[1]
+    _, source = await asyncio.open_connection("127.0.0.1", relay_port)
+    padding = b"x" * 200  # размер типичного mining.notify
+    for _ in range(args.bursts):
+        for _ in range(args.burst_size):
+            source.write(b"%d %s\n" % (time.perf_counter_ns(), padding))
+        await source.drain()
+        await asyncio.sleep(0)
+    await asyncio.wait_for(done.wait(), 60)
+    source.close()
+    await asyncio.wait_for(relay_done.wait(), 10)
+    sink_server.close()
+    relay_server.close()
+    latencies.sort()
+    stats = FORWARD_STATS["to_miner"]
+    p50 = latencies[len(latencies) // 2] / 1000
+    p99 = latencies[int(len(latencies) * 0.99)] / 1000
+    return p50, p99, stats["writes"] / max(1, stats["lines"])
+
+def bench_socket(args):
+    for label, buffered in (("построчно (drain на каждую)", False), ("пачками (отметки буфера)", True)):
+        p50, p99, writes_per_line = asyncio.run(run_socket(args, buffered))
+        print(f"{label:32s} p50 {p50:8.1f} мкс  p99 {p99:8.1f} мкс  write/строку {writes_per_line:.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=300_000)
+    parser.add_argument("--authorize-every", type=int, default=1000, help="каждая N-я строка — mining.authorize (0 — ни одной)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--socket", action="store_true", help="замер задержки и write-вызовов через TCP")
+    parser.add_argument("--bursts", type=int, default=2000)
+    parser.add_argument("--burst-size", type=int, default=20)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)  # логи authorize не должны влиять на замер
+
+    if args.socket:
+        bench_socket(args)
+    else:
+        bench_cpu(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Бенчмарк разбора mcpool.log ботом: строк/сек прежней цепочки re.search, match_line и чтения через LogTail.
+
+Запуск из корня проекта:
+    python scripts/bench_log_parser.py --size-mb 300
+    python scripts/bench_log_parser.py --log /home/simple1/bot/mcpool.log
+
+Без --log генерируется синтетический лог MiningCore заданного размера: в основном Share accepted,
+немного строк других пулов, StatsRecorder, Authorized worker и служебных строк, изредка найденные
+блоки. Лог читается построчно с диска: текстовым файлом и через LogTail, как у бота (двоичные куски,
+mmap для большого отставания). Печатаются строки/сек, МБ/сек, пик RSS и число событий каждого
+типа — оно у всех прогонов должно совпасть. Последний прогон — разбор истории при запуске бота:
+лог делится на куски по --backfill-chunk байт и разбирается в --processes процессах; число блоков
+пула должно совпасть с остальными прогонами.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.telegram_bot.log_backfill import backfill, plan  # noqa: E402
+from src.telegram_bot.log_lines import match_line  # noqa: E402
+from src.telegram_bot.log_tail import LogTail  # noqa: E402
+
+POOL_ID = "alpha-sha256-1"
+WORKERS = [(f"{i:016X}", f"DWallet{i % 7}.rig{i:03d}") for i in range(200)]
+
+def synthetic_line(rng, stamp):
+    roll = rng.random()
+    pool = POOL_ID if rng.random() < 0.9 else "beta-sha256-1"
+    worker_id, worker_name = rng.choice(WORKERS)
+    if roll < 0.6:
+        return f"[{stamp}] [I] [{pool}] [{worker_id}] Share accepted: D={rng.randint(1, 4096)}.000\n"
+    if roll < 0.85:
+        return f"[{stamp}] [D] [{pool}] [{worker_id}] Submitting share {rng.getrandbits(32):08x}, nonce {rng.getrandbits(32):08x}\n"
+    if roll < 0.95:
+        return f"[{stamp}] [I] [StatsRecorder] [{pool}] Worker {worker_name}: {rng.uniform(1, 900):.2f} TH/s, {rng.random():.2f} shares/sec\n"
+    if roll < 0.9999:
+        return f"[{stamp}] [I] [{pool}] [{worker_id}] Authorized worker {worker_name}\n"
+    return f"[{stamp}] [I] [{pool}] Daemon accepted block {rng.randint(800000, 900000)} [{rng.getrandbits(128):032x}] submitted by {worker_name}\n"
+
+def generate(path, size_mb, seed):
+    rng = random.Random(seed)
+    target = size_mb * 2 ** 20
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1700000000 + written // 4096)) + f".{rng.randint(0, 9999):04d}"
+            chunk = "".join(synthetic_line(rng, stamp) for _ in range(1000))
+            f.write(chunk)
+            written += len(chunk)
+
+def legacy_match(line):
+    """Прежний parse_log: до четырёх некомпилированных re.search на строку и мёртвая ветка StatsRecorder."""
+    if "[StatsRecorder]" in line and not re.search(r"Worker \S+: [\d.]+ [TPG]H/s", line):
+        pass
+    if re.search(r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{1,6})\] \[I\] \[(\S+?)\] \[([A-Z0-9]+)\] Authorized worker (\S+)", line):
+        return "authorize"
+    if re.search(r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{1,6})\] \[I\] \[StatsRecorder\] \[(\S+?)\] Worker (\S+): ([\d.]+) ([TPG])H/s, ([\d.]+) shares/sec", line):
+        return "stats"
+    if re.search(r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{1,6})\] \[I\] \[(\S+?)\] \[([A-Z0-9]+)\] Share accepted: D=([\d.]+)", line):
+        return "share"
+    if re.search(
+        r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d{1,6})?)\] \[I\] \[(\S+?)\] Daemon accepted block (\d+) \[([0-9a-f]+)\] submitted by (\S+)",
+        line,
+    ):
+        return "block"
+    return None
+
+def compiled_match(line):
+    event = match_line(line)
+    return event[0] if event else None
+
+def text_lines(path, args):
+    with open(path, "r", encoding="utf-8") as f:
+        yield from f
+
+def tail_lines(path, args):
+    tail = LogTail(path, chunk_size=args.chunk_size, use_mmap=args.mmap)
+    try:
+        yield from tail.lines()
+    finally:
+        tail.close()
+
+def run(path, reader, matcher, args):
+    """Тот же цикл, что у бота: фильтр по [pool_id], затем разбор строки."""
+    counts = {}
+    pool_tag = f"[{args.pool_id}]"
+    lines = 0
+    started = time.perf_counter()
+    for line in reader(path, args):
+        lines += 1
+        if pool_tag not in line:
+            continue
+        kind = matcher(line)
+        if kind is not None:
+            counts[kind] = counts.get(kind, 0) + 1
+    return lines, time.perf_counter() - started, counts
+
+def peak_rss_mb():
+    """Пик RSS процесса: при чтении потоком он не растёт с размером лога."""
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=300, help="размер синтетического лога")
+    parser.add_argument("--log", help="готовый лог вместо синтетического (тогда --pool-id)")
+    parser.add_argument("--pool-id", default=POOL_ID)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=1 << 20, help="кусок чтения LogTail, байт")
+    parser.add_argument("--no-mmap", dest="mmap", action="store_false", help="LogTail без mmap")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="процессов разбора истории")
+    parser.add_argument("--backfill-chunk", type=int, default=32 << 20, help="кусок разбора истории, байт")
+    args = parser.parse_args()
+    path = args.log
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="bench-log-"), "mcpool.log")
+        started = time.perf_counter()
+        generate(path, args.size_mb, args.seed)
+        print(f"Синтетический лог {path}: {os.path.getsize(path) / 2 ** 20:.0f} МБ за {time.perf_counter() - started:.1f} с")
+    size = os.path.getsize(path) / 2 ** 20
+    results = {}
+    try:
+        for name, reader, matcher in (
+            ("re.search по очереди", text_lines, legacy_match),
+            ("match_line", text_lines, compiled_match),
+            ("LogTail + match_line", tail_lines, compiled_match),
+        ):
+            lines, elapsed, counts = run(path, reader, matcher, args)
+            results[name] = counts
+            print(
+                f"{name:>22}: {lines / elapsed:>11,.0f} строк/с, {size / elapsed:6.1f} МБ/с, {elapsed:6.1f} с, "
+                f"пик RSS {peak_rss_mb():.0f} МБ; события {dict(sorted(counts.items()))}"
+            )
+        for processes in sorted({1, args.processes}):
+            started = time.perf_counter()
+            tasks, _, _ = plan(path, args.backfill_chunk)
+            merged = backfill(tasks, processes)
+            elapsed = time.perf_counter() - started
+            blocks = sum(1 for groups in merged["blocks"] if groups[1] == args.pool_id)
+            print(
+                f"{f'история, {processes} проц.':>22}: {merged['lines'] / elapsed:>11,.0f} строк/с, {size / elapsed:6.1f} МБ/с, "
+                f"{elapsed:6.1f} с, кусков {len(tasks)}; блоков {blocks}"
+            )
+            if blocks != results["match_line"].get("block", 0):
+                print("ОШИБКА: разбор истории нашёл другое число блоков")
+                sys.exit(1)
+    finally:
+        if args.log is None:
+            os.unlink(path)
+    if len({tuple(sorted(counts.items())) for counts in results.values()}) != 1:
+        print("ОШИБКА: разборщики нашли разные события")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
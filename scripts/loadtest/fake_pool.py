@@ -0,0 +1,129 @@
+"""Поддельный stratum-эндпоинт MiningCore для нагрузочного стенда: работает локально, без сети и демонов."""
+import asyncio
+import json
+import time
+
+class FakePool:
+    """Минимальный stratum V1 сервер: subscribe, authorize, set_difficulty, notify, submit.
+
+    Submit принимается, если job_id есть среди активных заданий (после clean_jobs старые задания
+    удаляются) и шара не повторяет уже принятую; иначе отвечает стандартными ошибками 21/22.
+    """
+
+    def __init__(self, name, notify_interval=30.0, clean_every=4, difficulty=65536, extranonce2_size=4, jobs_kept=4):
+        self.name = name
+        self.notify_interval = notify_interval
+        self.clean_every = clean_every
+        self.difficulty = difficulty
+        self.extranonce2_size = extranonce2_size
+        self.jobs_kept = jobs_kept
+        self.port = None
+        self.sessions = set()
+        self.jobs = []
+        self.job_counter = 0
+        self.seen_shares = set()
+        self.connections = 0
+        self.authorized_users = {}
+        self.submits = 0
+        self.accepted = 0
+        self.rejected = {"stale": 0, "duplicate": 0}
+        self.connect_times = []  # monotonic() каждого входящего соединения
+        self._server = None
+        self._notify_task = None
+        self._extranonce_counter = 0
+        self._new_job(clean=True)
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port, limit=2 ** 16, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.notify_interval:
+            self._notify_task = asyncio.create_task(self._notify_loop())
+        return self
+
+    async def stop(self):
+        if self._notify_task:
+            self._notify_task.cancel()
+        self._server.close()
+        for writer in list(self.sessions):
+            writer.close()
+
+    def _new_job(self, clean):
+        self.job_counter += 1
+        job_id = f"{self.job_counter:x}"
+        if clean:
+            self.jobs = []
+            self.seen_shares.clear()
+        self.jobs.append(job_id)
+        del self.jobs[:-self.jobs_kept]
+        message = {
+            "id": None,
+            "method": "mining.notify",
+            "params": [job_id, "00" * 32, "01000000", "ffffffff", [], "20000000", "1d00ffff", f"{int(time.time()):08x}", clean],
+        }
+        self.notify_line = (json.dumps(message) + "\n").encode()
+        return job_id
+
+    def broadcast_job(self, clean=False):
+        """Новое задание всем авторизованным сессиям одним заранее закодированным буфером."""
+        self._new_job(clean)
+        for writer in list(self.sessions):
+            writer.write(self.notify_line)
+
+    async def _notify_loop(self):
+        while True:
+            await asyncio.sleep(self.notify_interval)
+            # Раз в clean_every заданий — «новый блок»: clean_jobs и сброс активных заданий
+            self.broadcast_job(clean=bool(self.clean_every) and self.job_counter % self.clean_every == 0)
+
+    def _reply(self, writer, msg_id, result, error=None):
+        writer.write((json.dumps({"id": msg_id, "result": result, "error": error}) + "\n").encode())
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self.connect_times.append(time.monotonic())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                method = msg.get("method")
+                params = msg.get("params") or []
+                if method == "mining.subscribe":
+                    self._extranonce_counter += 1
+                    self._reply(writer, msg.get("id"), [
+                        [["mining.set_difficulty", "1"], ["mining.notify", "1"]],
+                        f"{self._extranonce_counter:08x}", self.extranonce2_size,
+                    ])
+                elif method == "mining.authorize":
+                    user = params[0] if params else ""
+                    self.authorized_users[user] = self.authorized_users.get(user, 0) + 1
+                    self._reply(writer, msg.get("id"), True)
+                    writer.write((json.dumps({"id": None, "method": "mining.set_difficulty", "params": [self.difficulty]}) + "\n").encode())
+                    writer.write(self.notify_line)
+                    self.sessions.add(writer)
+                elif method == "mining.submit":
+                    self.submits += 1
+                    job_id = params[1] if len(params) > 1 else None
+                    share = tuple(params[1:5])
+                    if job_id not in self.jobs:
+                        self.rejected["stale"] += 1
+                        self._reply(writer, msg.get("id"), None, [21, "Job not found", None])
+                    elif share in self.seen_shares:
+                        self.rejected["duplicate"] += 1
+                        self._reply(writer, msg.get("id"), None, [22, "Duplicate share", None])
+                    else:
+                        self.seen_shares.add(share)
+                        self.accepted += 1
+                        self._reply(writer, msg.get("id"), True)
+                else:
+                    self._reply(writer, msg.get("id"), None, [20, f"Unsupported method {method}", None])
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.sessions.discard(writer)
+            writer.close()
@@ -0,0 +1,189 @@
+"""Память прокси на соединение: RSS при 1k/10k/50k простаивающих и активных майнерах.
+
+Запуск из корня проекта:
+    python scripts/loadtest/memory.py --counts 1000,10000,50000
+    python scripts/loadtest/memory.py --counts 10000 --mode active --share-interval 5 --proxy-setting aggregate=true
+
+Для каждого числа майнеров поднимается поддельный пул и свежий процесс прокси; майнеры —
+лёгкие asyncio.Protocol (subscribe + authorize, в режиме active ещё submit раз в share-interval
+секунд). Замеряется RSS прокси до подключений и после того, как все майнеры авторизованы на
+пуле; в отчёте — байт на соединение. Подключения идут с адресов 127.0.0.1..127.0.0.254, чтобы
+хватило локальных портов.
+
+На N майнеров нужно около 2N дескрипторов в этом процессе и 2N в прокси: для 50k поднимите
+ulimit -n (например, до 200000). Прокси подключается к одному адресу пула, так что без
+aggregate=true больше ~28k соединений упрётся в net.ipv4.ip_local_port_range — расширьте его
+до "1024 65535". Числа, на которые не хватает дескрипторов, пропускаются с пометкой в отчёте.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_pool import FakePool  # noqa: E402
+from run import free_port, parse_setting, process_tree_rss, raise_fd_limit, wait_for_port  # noqa: E402
+from src.mode_state import ModeState  # noqa: E402
+
+SUBSCRIBE = b'{"id": 1, "method": "mining.subscribe", "params": ["memory-bench/1.0"]}\n'
+
+class BenchMiner(asyncio.Protocol):
+    """Майнер без StreamReader: помнит только последнее задание."""
+    __slots__ = ("index", "transport", "job_id", "nonce", "bench", "tail")
+
+    def __init__(self, index, bench):
+        self.index = index
+        self.bench = bench
+        self.transport = None
+        self.job_id = None
+        self.nonce = 0
+        self.tail = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(SUBSCRIBE + json.dumps({"id": 2, "method": "mining.authorize", "params": [f"bench.m{self.index}", "x"]}).encode() + b"\n")
+
+    def data_received(self, data):
+        lines = (self.tail + data).split(b"\n")
+        self.tail = lines.pop()
+        for line in lines:
+            if b'"method": "mining.notify"' in line:
+                self.job_id = json.loads(line)["params"][0]
+
+    def connection_lost(self, exc):
+        self.bench["closed"] += 1
+        self.transport = None
+
+    def submit(self):
+        if self.transport is None or self.job_id is None:
+            return
+        self.nonce += 1
+        self.transport.write(json.dumps({
+            "id": 5, "method": "mining.submit",
+            "params": [f"bench.m{self.index}", self.job_id, f"{self.index:08x}", f"{int(time.time()):08x}", f"{self.nonce:08x}"],
+        }).encode() + b"\n")
+
+async def submit_loop(miners, interval):
+    """Раз в interval секунд каждый майнер отправляет шару; отправки равномерно размазаны по интервалу."""
+    slices = 20
+    while True:
+        for part in range(slices):
+            for miner in miners[part::slices]:
+                miner.submit()
+            await asyncio.sleep(interval / slices)
+
+async def measure(count, mode, args):
+    tmpdir = tempfile.mkdtemp(prefix="stratum-memory-")
+    pool = await FakePool("bench", notify_interval=args.notify_interval).start()
+    port = free_port()
+    settings = {"port": port, "metrics_port": None, "hashrate_publish_interval": 0, "upstream_pool_size": 0}
+    settings.update(dict(parse_setting(raw) for raw in args.proxy_setting))
+    config = {"modes": {"bench": {"host": "127.0.0.1", "port": pool.port, "alias": {"bench": "DBenchWallet"}}}, "proxy": settings}
+    paths = {
+        "STRATUM_PROXY_CONFIG": os.path.join(tmpdir, "config.json"),
+        "STRATUM_PROXY_MODE_FILE": os.path.join(tmpdir, "current_mode.txt"),
+        "STRATUM_PROXY_MODE_SOCKET": os.path.join(tmpdir, "mode.sock"),
+        "STRATUM_PROXY_WORKER_SOCKET": os.path.join(tmpdir, "workers.sock"),
+    }
+    with open(paths["STRATUM_PROXY_CONFIG"], "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    ModeState(paths["STRATUM_PROXY_MODE_FILE"]).set("bench")
+    log_file = open(os.path.join(tmpdir, "proxy.log"), "wb")
+    proxy = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "src.stratum_proxy.proxy",
+        env={**os.environ, **paths}, stdout=log_file, stderr=log_file, cwd=ROOT,
+    )
+    bench = {"closed": 0}
+    miners = []
+    submitter = None
+    try:
+        if not await wait_for_port(port, 15):
+            raise RuntimeError("прокси не запустился")
+        await asyncio.sleep(1.0)
+        baseline = process_tree_rss(proxy.pid)
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        for start in range(0, count, args.batch):
+            batch = []
+            for index in range(start, min(count, start + args.batch)):
+                source = f"127.0.0.{index % 254 + 1}"
+                miner = BenchMiner(index, bench)
+                batch.append(loop.create_connection(lambda m=miner: m, "127.0.0.1", port, local_addr=(source, 0)))
+                miners.append(miner)
+            results = await asyncio.gather(*batch, return_exceptions=True)
+            failed = [r for r in results if isinstance(r, BaseException)]
+            if failed:
+                raise RuntimeError(f"{len(failed)} подключений не удалось: {failed[0]}")
+        while len(pool.sessions) < count and time.monotonic() - started < args.timeout:
+            await asyncio.sleep(0.2)
+        connected = time.monotonic() - started
+        if mode == "active":
+            submitter = asyncio.create_task(submit_loop(miners, args.share_interval))
+        await asyncio.sleep(args.settle)
+        rss = process_tree_rss(proxy.pid)
+        return {
+            "miners": count,
+            "mode": mode,
+            "authorized": len(pool.sessions),
+            "pool_connections": pool.connections,
+            "connect_seconds": round(connected, 2),
+            "rss_baseline_mb": round(baseline / 2 ** 20, 1),
+            "rss_mb": round(rss / 2 ** 20, 1),
+            "bytes_per_connection": round((rss - baseline) / count),
+            "accepted": pool.accepted,
+            "closed": bench["closed"],
+        }
+    finally:
+        if submitter is not None:
+            submitter.cancel()
+        for miner in miners:
+            if miner.transport is not None:
+                miner.transport.abort()
+        proxy.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proxy.wait(), 15)
+        except asyncio.TimeoutError:
+            proxy.kill()
+        await pool.stop()
+        log_file.close()
+
+async def main(args):
+    fd_limit = raise_fd_limit()
+    results = []
+    for count in (int(value) for value in args.counts.split(",")):
+        for mode in (("idle", "active") if args.mode == "both" else (args.mode,)):
+            if fd_limit is not None and 2 * count + 1000 > fd_limit:
+                print(f"{count} майнеров ({mode}): пропущено, нужно ~{2 * count + 1000} дескрипторов, лимит {fd_limit}")
+                results.append({"miners": count, "mode": mode, "skipped": f"ulimit -n {fd_limit}"})
+                continue
+            result = await measure(count, mode, args)
+            results.append(result)
+            print(
+                f"{count} майнеров ({mode}): авторизовано {result['authorized']} за {result['connect_seconds']} с, "
+                f"RSS {result['rss_baseline_mb']} -> {result['rss_mb']} МБ, "
+                f"{result['bytes_per_connection'] / 1024:.1f} КБ на соединение"
+                + (f", принято шар {result['accepted']}" if mode == "active" else "")
+            )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", default="1000,10000,50000", help="числа майнеров через запятую")
+    parser.add_argument("--mode", choices=("idle", "active", "both"), default="both")
+    parser.add_argument("--share-interval", type=float, default=5.0, help="секунд между шарами майнера в режиме active")
+    parser.add_argument("--notify-interval", type=float, default=30.0)
+    parser.add_argument("--batch", type=int, default=500, help="подключений за раз")
+    parser.add_argument("--settle", type=float, default=5.0, help="секунд работы перед замером RSS")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--proxy-setting", action="append", default=[], help="key=value в секцию proxy (значение — JSON)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    asyncio.run(main(parser.parse_args()))
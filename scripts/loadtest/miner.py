@@ -0,0 +1,118 @@
+"""Симулятор майнера для нагрузочного стенда: subscribe, authorize, поток mining.submit, client.reconnect."""
+import asyncio
+import json
+import random
+import time
+
+class LoadStats:
+    """Общие счётчики всех симулированных майнеров."""
+
+    def __init__(self):
+        self.connects = 0
+        self.connect_failures = 0
+        self.authorized = 0
+        self.reconnects = 0
+        self.submitted = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.lost = 0  # submit без ответа на момент разрыва соединения
+        self.notifies = 0
+        self.latencies_ns = []
+        self.connect_latencies_ns = []
+        self.accepted_per_second = {}  # целая секунда monotonic() -> принятые шары
+
+    def record_result(self, sent_ns, ok):
+        now_ns = time.perf_counter_ns()
+        self.latencies_ns.append(now_ns - sent_ns)
+        if ok:
+            self.accepted += 1
+            second = int(time.monotonic())
+            self.accepted_per_second[second] = self.accepted_per_second.get(second, 0) + 1
+        else:
+            self.rejected += 1
+
+class SimulatedMiner:
+    def __init__(self, index, host, port, user, stats, share_interval=5.0, reconnect_delay=0.5):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.user = user
+        self.stats = stats
+        self.share_interval = share_interval
+        self.reconnect_delay = reconnect_delay
+        self.job_id = None
+        self.authorized = asyncio.Event()
+        self._next_id = 10
+        self._nonce = random.getrandbits(32)
+
+    async def run(self, stop):
+        """Работает до stop (или отмены задачи), переподключаясь после разрывов и client.reconnect."""
+        while not stop.is_set():
+            started = time.perf_counter_ns()
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port, limit=2 ** 16)
+            except OSError:
+                self.stats.connect_failures += 1
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            self.stats.connects += 1
+            self.stats.connect_latencies_ns.append(time.perf_counter_ns() - started)
+            pending = {}
+            reconnect = await self._session(reader, writer, pending, stop)
+            self.stats.lost += len(pending)
+            writer.close()
+            if stop.is_set():
+                break
+            self.stats.reconnects += 1
+            if not reconnect:
+                await asyncio.sleep(self.reconnect_delay * (1 + random.random()))
+
+    async def _session(self, reader, writer, pending, stop):
+        """Одна TCP-сессия. Возвращает True, если пул/прокси попросил client.reconnect."""
+        self.job_id = None
+        writer.write(
+            b'{"id": 1, "method": "mining.subscribe", "params": ["loadtest/1.0"]}\n'
+            + json.dumps({"id": 2, "method": "mining.authorize", "params": [self.user, "x"]}).encode() + b"\n"
+        )
+        submitter = asyncio.create_task(self._submit_loop(writer, pending))
+        try:
+            while not stop.is_set():
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    return False
+                if not line:
+                    return False
+                msg = json.loads(line)
+                method = msg.get("method")
+                if method == "mining.notify":
+                    self.stats.notifies += 1
+                    self.job_id = msg["params"][0]
+                elif method == "client.reconnect":
+                    return True
+                elif msg.get("id") == 2:
+                    if msg.get("result") and not self.authorized.is_set():
+                        self.stats.authorized += 1
+                        self.authorized.set()
+                elif msg.get("id") in pending:
+                    self.stats.record_result(pending.pop(msg["id"]), msg.get("result") is True)
+            return False
+        finally:
+            submitter.cancel()
+
+    async def _submit_loop(self, writer, pending):
+        await asyncio.sleep(random.random() * self.share_interval)
+        while True:
+            if self.job_id is not None:
+                self._next_id += 1
+                self._nonce = (self._nonce + 1) & 0xFFFFFFFF
+                msg_id = self._next_id
+                line = json.dumps({
+                    "id": msg_id,
+                    "method": "mining.submit",
+                    "params": [self.user, self.job_id, f"{self.index:08x}", f"{int(time.time()):08x}", f"{self._nonce:08x}"],
+                }).encode() + b"\n"
+                pending[msg_id] = time.perf_counter_ns()
+                writer.write(line)
+                self.stats.submitted += 1
+            await asyncio.sleep(self.share_interval * (0.5 + random.random()))
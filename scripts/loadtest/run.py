@@ -0,0 +1,303 @@
+"""Нагрузочный стенд Stratum-прокси: поддельные пулы MiningCore + тысячи симулированных майнеров, полностью офлайн.
+
+Запуск из корня проекта:
+    python scripts/loadtest/run.py --miners 2000 --share-interval 2 --duration 30
+    python scripts/loadtest/run.py --miners 5000 --workers 4 --proxy-setting upstream_pool_size=16
+
+Стенд поднимает два поддельных пула (режимы alpha и beta), пишет временный config.json и
+запускает прокси отдельным процессом (python -m src.stratum_proxy.proxy) через переменные
+STRATUM_PROXY_CONFIG / STRATUM_PROXY_MODE_FILE / STRATUM_PROXY_MODE_SOCKET / STRATUM_PROXY_WORKER_SOCKET.
+Отчёт: соединений/сек, шар/сек, перцентили задержки submit -> result, хэшрейт воркеров, посчитанный
+прокси, против ожидаемого, память прокси на соединение и поведение при переключении режима alpha -> beta.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_pool import FakePool  # noqa: E402
+from miner import LoadStats, SimulatedMiner  # noqa: E402
+from src.mode_state import ModeState  # noqa: E402
+from src.worker_feed import WorkerFeed  # noqa: E402
+
+ALIASES = {"alice": "DAliceWallet1111111111111111111111", "bob": "DBobWallet22222222222222222222222"}
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ImportError, ValueError, OSError):
+        return None
+
+def free_port():
+    # Прокси слушает 0.0.0.0: порт должен быть свободен на всех адресах, а не только на 127.0.0.1
+    with socket.socket() as sock:
+        sock.bind(("0.0.0.0", 0))
+        return sock.getsockname()[1]
+
+def process_tree_rss(pid):
+    """RSS процесса и всех его потомков (воркеры супервизора) в байтах, по /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+        stack.extend(children.get(current, []))
+    return total
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+def latency_summary(latencies_ns):
+    values = sorted(latencies_ns)
+    return {f"p{label}": percentile(values, q) / 1e6 for label, q in (("50", 0.5), ("90", 0.9), ("99", 0.99), ("999", 0.999))}
+
+def parse_setting(raw):
+    key, _, value = raw.partition("=")
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+async def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.1)
+    return False
+
+async def run(args):
+    report = {"miners": args.miners, "workers": args.workers}
+    tmpdir = tempfile.mkdtemp(prefix="stratum-loadtest-")
+    pools = {
+        "alpha": await FakePool("alpha", notify_interval=args.notify_interval).start(),
+        "beta": await FakePool("beta", notify_interval=args.notify_interval).start(),
+    }
+    proxy_port = free_port()
+    proxy_settings = {
+        "port": proxy_port, "workers": args.workers, "switch_drain_timeout": args.switch_timeout,
+        "hashrate_publish_interval": 2, "worker_stats_interval": 1,
+    }
+    proxy_settings.update(dict(parse_setting(raw) for raw in args.proxy_setting))
+    config = {
+        "modes": {
+            name: {"host": "127.0.0.1", "port": pool.port, "alias": ALIASES, "coin": name, "algorithm": "sha256d", "pool_id": f"{name}-sha256-1"}
+            for name, pool in pools.items()
+        },
+        "proxy": proxy_settings,
+    }
+    config["modes"]["сон"] = {"port": None, "alias": {}}
+    paths = {
+        "STRATUM_PROXY_CONFIG": os.path.join(tmpdir, "config.json"),
+        "STRATUM_PROXY_MODE_FILE": os.path.join(tmpdir, "current_mode.txt"),
+        "STRATUM_PROXY_MODE_SOCKET": os.path.join(tmpdir, "mode.sock"),
+        "STRATUM_PROXY_WORKER_SOCKET": os.path.join(tmpdir, "workers.sock"),
+    }
+    with open(paths["STRATUM_PROXY_CONFIG"], "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False)
+    mode_state = ModeState(paths["STRATUM_PROXY_MODE_FILE"], paths["STRATUM_PROXY_MODE_SOCKET"])
+    mode_state.set("alpha")
+    # Слушаем то же, что слушал бы бот: хэшрейт воркеров от прокси
+    feed = WorkerFeed(paths["STRATUM_PROXY_WORKER_SOCKET"])
+    feed_workers = {}
+    feed.subscribe(lambda entries: feed_workers.update({(mode, worker): stats for mode, worker, stats in entries}))
+    feed_task = asyncio.create_task(feed.listen())
+
+    log_path = os.path.join(tmpdir, "proxy.log")
+    log_file = open(log_path, "wb")
+    proxy = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "src.stratum_proxy.proxy",
+        cwd=ROOT, env={**os.environ, **paths}, stdout=log_file, stderr=log_file,
+    )
+    print(f"Прокси pid {proxy.pid} на порту {proxy_port}, лог: {log_path}")
+    stop = asyncio.Event()
+    tasks = []
+    try:
+        if not await wait_for_port(proxy_port, 15):
+            raise RuntimeError(f"Прокси не открыл порт {proxy_port}, см. {log_path}")
+        await asyncio.sleep(1)  # прогрев резерва соединений к пулу
+        rss_idle = process_tree_rss(proxy.pid)
+
+        # 1. Разгон: все майнеры подключаются и авторизуются
+        stats = LoadStats()
+        aliases = list(ALIASES)
+        miners = [
+            SimulatedMiner(i, "127.0.0.1", proxy_port, f"{aliases[i % len(aliases)]}.rig{i:05d}", stats, share_interval=args.share_interval)
+            for i in range(args.miners)
+        ]
+        started = time.monotonic()
+        for i, miner in enumerate(miners):
+            tasks.append(asyncio.create_task(miner.run(stop)))
+            if args.ramp_rate and i % max(1, args.ramp_rate // 10) == 0:
+                await asyncio.sleep(0.1)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(m.authorized.wait() for m in miners)), args.ramp_timeout)
+        except asyncio.TimeoutError:
+            print(f"Авторизовались только {stats.authorized}/{args.miners} майнеров за {args.ramp_timeout} с")
+        ramp_elapsed = time.monotonic() - started
+        report["connect"] = {
+            "authorized": stats.authorized,
+            "seconds": round(ramp_elapsed, 3),
+            "connections_per_sec": round(stats.authorized / ramp_elapsed, 1),
+            "connect_latency_ms": latency_summary(stats.connect_latencies_ns),
+            "connect_failures": stats.connect_failures,
+        }
+        rewritten = sum(count for user, count in pools["alpha"].authorized_users.items() if user.split(".")[0] in ALIASES.values())
+        report["alias_rewrite"] = {"rewritten": rewritten, "total": sum(pools["alpha"].authorized_users.values())}
+
+        # 2. Установившийся режим: поток submit
+        await asyncio.sleep(args.share_interval)
+        stats.latencies_ns.clear()
+        accepted_before, submitted_before = stats.accepted, stats.submitted
+        steady_started = time.monotonic()
+        await asyncio.sleep(args.duration)
+        steady_elapsed = time.monotonic() - steady_started
+        rss_active = process_tree_rss(proxy.pid)
+        report["steady"] = {
+            "seconds": round(steady_elapsed, 1),
+            "submitted_per_sec": round((stats.submitted - submitted_before) / steady_elapsed, 1),
+            "shares_per_sec": round((stats.accepted - accepted_before) / steady_elapsed, 1),
+            "rejected": stats.rejected,
+            "notifies": stats.notifies,
+            "latency_ms": latency_summary(stats.latencies_ns),
+        }
+        await asyncio.sleep(proxy_settings["hashrate_publish_interval"] + proxy_settings["worker_stats_interval"])
+        reported = {key: value for key, value in feed_workers.items() if key[0] == "alpha"}
+        report["hashrate"] = {
+            "workers": len(reported),
+            "reported": sum(entry["windows"][min(entry["windows"], key=int)] for entry in reported.values()),
+            "expected": report["steady"]["shares_per_sec"] * pools["alpha"].difficulty * 2 ** 32,
+        }
+        report["memory"] = {
+            "rss_idle_mb": round(rss_idle / 2 ** 20, 1),
+            "rss_active_mb": round(rss_active / 2 ** 20, 1),
+            "bytes_per_connection": round((rss_active - rss_idle) / max(1, stats.authorized)),
+        }
+
+        # 3. Переключение режима alpha -> beta
+        if not args.no_switch:
+            lost_before, reconnects_before = stats.lost, stats.reconnects
+            switch_at = time.monotonic()
+            mode_state.set("beta")
+            migrated_at = None
+            while time.monotonic() - switch_at < args.switch_timeout + 10:
+                if len(pools["beta"].sessions) >= args.miners:
+                    migrated_at = time.monotonic()
+                    break
+                await asyncio.sleep(0.1)
+            await asyncio.sleep(args.share_interval * 2)
+            baseline = report["steady"]["shares_per_sec"]
+            timeline = [
+                stats.accepted_per_second.get(second, 0)
+                for second in range(int(switch_at), int(time.monotonic()))
+            ]
+            beta_connects = [t for t in pools["beta"].connect_times if t >= switch_at]
+            peak_rate = max((sum(1 for t in beta_connects if int(t) == second) for second in {int(t) for t in beta_connects}), default=0)
+            report["switch"] = {
+                "migrated": len(pools["beta"].sessions),
+                "seconds_to_migrate": round(migrated_at - switch_at, 2) if migrated_at else None,
+                "reconnects": stats.reconnects - reconnects_before,
+                "lost_shares": stats.lost - lost_before,
+                "min_shares_per_sec": min(timeline, default=0),
+                "baseline_shares_per_sec": baseline,
+                "peak_upstream_connects_per_sec": peak_rate,
+                "accepted_per_second": timeline,
+            }
+    finally:
+        stop.set()
+        feed_task.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if proxy.returncode is None:
+            proxy.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(proxy.wait(), 15)
+            except asyncio.TimeoutError:
+                proxy.kill()
+        log_file.close()
+        for pool in pools.values():
+            await pool.stop()
+    return report
+
+def print_report(report):
+    connect = report["connect"]
+    print(f"\nМайнеров: {report['miners']}, воркеров прокси: {report['workers']}")
+    print(f"Подключение: {connect['authorized']} авторизаций за {connect['seconds']} с "
+          f"({connect['connections_per_sec']} соед/с), p99 connect {connect['connect_latency_ms']['p99']:.2f} мс")
+    print(f"Замена alias -> кошелёк: {report['alias_rewrite']['rewritten']}/{report['alias_rewrite']['total']}")
+    steady = report["steady"]
+    lat = steady["latency_ms"]
+    print(f"Шары: {steady['shares_per_sec']}/с принято ({steady['submitted_per_sec']}/с отправлено), отклонено {steady['rejected']}")
+    print(f"Задержка submit -> result: p50 {lat['p50']:.2f} мс, p90 {lat['p90']:.2f} мс, p99 {lat['p99']:.2f} мс, p99.9 {lat['p999']:.2f} мс")
+    hashrate = report["hashrate"]
+    print(f"Хэшрейт по данным прокси: {hashrate['workers']} воркеров, {hashrate['reported'] / 1e12:.2f} TH/s "
+          f"(ожидалось {hashrate['expected'] / 1e12:.2f} TH/s по принятым шарам)")
+    memory = report["memory"]
+    print(f"Память прокси: {memory['rss_idle_mb']} МБ без майнеров, {memory['rss_active_mb']} МБ под нагрузкой, "
+          f"~{memory['bytes_per_connection']} байт на соединение")
+    switch = report.get("switch")
+    if switch:
+        print(f"Переключение режима: {switch['migrated']}/{report['miners']} сессий в beta за {switch['seconds_to_migrate']} с, "
+              f"переподключений {switch['reconnects']}, потеряно шар {switch['lost_shares']}, "
+              f"провал до {switch['min_shares_per_sec']}/с при норме {switch['baseline_shares_per_sec']}/с, "
+              f"пик подключений к пулу {switch['peak_upstream_connects_per_sec']}/с")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--miners", type=int, default=1000)
+    parser.add_argument("--share-interval", type=float, default=2.0, help="средний интервал между submit одного майнера, с")
+    parser.add_argument("--ramp-rate", type=int, default=0, help="подключений в секунду при разгоне (0 — без ограничения)")
+    parser.add_argument("--ramp-timeout", type=float, default=120.0)
+    parser.add_argument("--duration", type=float, default=20.0, help="длительность установившегося режима, с")
+    parser.add_argument("--notify-interval", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--switch-timeout", type=float, default=30.0)
+    parser.add_argument("--no-switch", action="store_true", help="не проверять переключение режима")
+    parser.add_argument("--proxy-setting", action="append", default=[], metavar="KEY=JSON", help="переопределить ключ секции proxy")
+    parser.add_argument("--json", metavar="PATH", help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    if limit is not None and limit < args.miners * 3:
+        print(f"Внимание: лимит дескрипторов {limit} может не хватить на {args.miners} майнеров")
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
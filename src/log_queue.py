@@ -0,0 +1,128 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+
+# Счётчики очереди логов: queued — принято в очередь, dropped — потеряно при переполнении,
+# suppressed — отброшено ограничением повторов
+LOG_STATS = {"queued": 0, "dropped": 0, "suppressed": 0}
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+_listener = None
+_handlers = []  # обработчики корневого логгера, переехавшие за очередь
+
+class RepeatLimitFilter(logging.Filter):
+    """Не больше burst записей за interval секунд с одной строки кода (ниже ERROR).
+
+    Повтором считается вызов logger.* из того же места: сообщения собираются f-строками и по
+    тексту не совпадают (у каждого майнера свой адрес). Сколько записей подавлено, дописывается
+    к первой пропущенной записи из этого места в следующем окне.
+    """
+
+    def __init__(self, burst=20, interval=10.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.sites = {}  # (pathname, lineno) -> [начало окна, записей в окне, подавлено]
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or not self.burst:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        site = self.sites.get(key)
+        if site is None:
+            self.sites[key] = [now, 1, 0]
+            return True
+        if now - site[0] >= self.interval:
+            suppressed = site[2]
+            site[0], site[1], site[2] = now, 1, 0
+            if suppressed:
+                record.msg = f"{record.getMessage()} [ещё {suppressed} похожих записей подавлено за {self.interval:g} с]"
+                record.args = None
+            return True
+        site[1] += 1
+        if site[1] <= self.burst:
+            return True
+        site[2] += 1
+        LOG_STATS["suppressed"] += 1
+        return False
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler на ограниченной очереди: при переполнении запись теряется, а не блокирует цикл событий."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.unreported = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_STATS["dropped"] += 1
+            self.unreported += 1
+            return
+        LOG_STATS["queued"] += 1
+        if self.unreported:
+            # О потерях сообщаем, как только в очереди снова есть место
+            self.report_drops(block=False)
+
+    def report_drops(self, block):
+        notice = logging.LogRecord(
+            "log_queue", logging.WARNING, __file__, 0,
+            f"Очередь логов переполнена, потеряно записей: {self.unreported}", None, None,
+        )
+        try:
+            self.queue.put(notice, block=block)
+            self.unreported = 0
+        except queue.Full:
+            pass
+
+class QueueWriter(logging.handlers.QueueListener):
+    """Поток записи; при остановке ждёт места в очереди, чтобы дописать всё накопленное."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+def setup_queue_logging(level=logging.INFO, queue_size=10000, burst=20, interval=10.0):
+    """Переводит корневой логгер на очередь: запись в файл/журнал идёт в отдельном потоке.
+
+    Уже настроенные обработчики корневого логгера (например, из main.py) переезжают за очередь;
+    если их нет, пишем в stderr в привычном формате. Повторный вызов ничего не меняет.
+    """
+    global _listener, _handlers
+    root = logging.getLogger()
+    if _listener is not None:
+        return _listener
+    handlers = list(root.handlers)
+    if not handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers = [handler]
+    for handler in handlers:
+        root.removeHandler(handler)
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(RepeatLimitFilter(burst, interval))
+    root.addHandler(handler)
+    root.setLevel(level)
+    _handlers = handlers
+    _listener = QueueWriter(handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_queue_logging)
+    return _listener
+
+def stop_queue_logging():
+    """Дописывает остаток очереди, останавливает поток записи и возвращает обработчики корневому логгеру."""
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
+            if handler.unreported:
+                handler.report_drops(block=True)
+    _listener.stop()
+    _listener = None
+    for handler in _handlers:
+        root.addHandler(handler)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+# Режим, если current_mode.txt нет: безопасный для всех компонентов — пул не получает майнеров
+DEFAULT_MODE = "сон"
+
+class ModeState:
+    """Текущий режим с подписками на его смену.
+
+    Режим хранится в памяти и в current_mode.txt (файл остаётся источником истины между
+    перезапусками). Внутри одного процесса (main.py) set() сразу вызывает подписчиков.
+    Между процессами set() отправляет датаграмму в unix-сокет socket_path, который слушает
+    watch(listen=True) у прокси; редкий опрос mtime файла ловит ручные правки.
+    """
+
+    def __init__(self, path, socket_path=None):
+        self.path = path
+        self.socket_path = socket_path
+        self._mode = None
+        self._mtime = None
+        self._loaded = False
+        self._subscribers = []  # (loop, callback)
+        self._listener = None
+        self._polling = False
+
+    def _read_file(self):
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            self._mtime = None
+            return None
+
+    def get(self):
+        """Текущий режим из памяти; файл читается только при первом обращении.
+
+        Если файла нет, в него записывается DEFAULT_MODE: бот и прокси видят один и тот же режим.
+        """
+        if not self._loaded:
+            self._mode = self._read_file()
+            self._loaded = True
+            if self._mode is None:
+                self.set(DEFAULT_MODE)
+        return self._mode
+
+    def set(self, mode):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(mode)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self._loaded = True
+        self._update(mode)
+        self._send_notification(mode)
+
+    def apply(self, mode):
+        """Принимает режим, пришедший извне (сокет, супервизор), без записи в файл."""
+        self._loaded = True
+        self._update(mode)
+
+    def subscribe(self, callback):
+        """callback(mode) вызывается в цикле подписчика при каждой смене режима. Возвращает функцию отписки."""
+        entry = (asyncio.get_running_loop(), callback)
+        self._subscribers.append(entry)
+
+        def unsubscribe():
+            if entry in self._subscribers:
+                self._subscribers.remove(entry)
+        return unsubscribe
+
+    def _update(self, mode):
+        if mode == self._mode:
+            return
+        self._mode = mode
+        for loop, callback in list(self._subscribers):
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(callback, mode)
+
+    def _send_notification(self, mode):
+        if not self.socket_path or not hasattr(socket, "AF_UNIX"):
+            return
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+                sock.setblocking(False)
+                sock.sendto(mode.encode("utf-8"), self.socket_path)
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+            # Прокси не запущен отдельным процессом — он узнает режим из файла при старте
+            pass
+        except OSError as e:
+            logger.warning(f"Не удалось отправить уведомление о смене режима в {self.socket_path}: {e}")
+
+    async def _start_listener(self):
+        """Открывает сокет уведомлений; False, если он уже открыт или unix-сокеты недоступны."""
+        if self._listener is not None or not self.socket_path or not hasattr(socket, "AF_UNIX"):
+            return False
+        state = self
+
+        class _Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                mode = data.decode("utf-8", errors="replace").strip()
+                if mode:
+                    state.apply(mode)
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        loop = asyncio.get_running_loop()
+        self._listener, _ = await loop.create_datagram_endpoint(
+            _Protocol, local_addr=self.socket_path, family=socket.AF_UNIX
+        )
+        logger.info(f"Слушаем уведомления о смене режима на {self.socket_path}")
+        return True
+
+    def _close_listener(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def watch(self, listen=False, poll_interval=30.0):
+        """Держит режим в памяти актуальным: unix-сокет (если listen) плюс опрос mtime раз в poll_interval.
+
+        Опрос ведёт первый вызов, сокет — тот, кто его открыл; каждый закрывает своё при отмене.
+        Вызов, которому не досталось ни того, ни другого, сразу возвращается.
+        """
+        listening = False
+        if listen:
+            try:
+                listening = await self._start_listener()
+            except OSError as e:
+                logger.warning(f"Не удалось открыть сокет {self.socket_path}, остаётся только опрос файла: {e}")
+        if self._polling:
+            if not listening:
+                return
+            try:
+                # Опрос уже идёт в другом вызове (в main.py — у бота): этот держит только сокет
+                await asyncio.Future()
+            finally:
+                self._close_listener()
+        self._polling = True
+        try:
+            while True:
+                await asyncio.sleep(poll_interval)
+                try:
+                    mtime = os.stat(self.path).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                if mtime != self._mtime:
+                    mode = self._read_file()
+                    if mode:
+                        self.apply(mode)
+        finally:
+            self._polling = False
+            if listening:
+                self._close_listener()
+
+_states = {}
+
+def get_mode_state(path, socket_path=None):
+    """Один ModeState на файл режима, чтобы прокси и бот в одном процессе делили состояние."""
+    if path not in _states:
+        _states[path] = ModeState(path, socket_path)
+    return _states[path]
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+# Запрос длиннее этого не читается: команды короткие, а ответ может быть большим
+MAX_REQUEST = 64 * 1024
+
+async def serve_admin(socket_path, handle):
+    """Admin API прокси на unix-сокете: одна JSON-строка запроса, одна JSON-строка ответа.
+
+    handle(request) — корутина, возвращает словарь ответа; ошибка в ней отдаётся как {"error": "..."}.
+    Сокет доступен только владельцу (0600): через него можно рвать сессии майнеров.
+    """
+    if not socket_path or not hasattr(socket, "AF_UNIX"):
+        return None
+
+    async def on_connection(reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), 5)
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("запрос должен быть JSON-объектом")
+                response = await handle(request)
+            except ValueError as e:
+                response = {"error": str(e)}
+            writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка обработки запроса admin API: {e}")
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    # Права 0600 сокет получает уже при bind: между bind и chmod к нему успел бы подключиться кто угодно
+    umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server(on_connection, socket_path, limit=MAX_REQUEST)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    logger.info(f"Admin API прокси на {socket_path}")
+    return server
+
+async def admin_request(socket_path, request, timeout=5.0):
+    """Отправляет запрос в admin API прокси и возвращает ответ (словарь).
+
+    ConnectionError, если прокси не слушает сокет или не ответил за timeout.
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(socket_path, limit=2 ** 24), timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        raise ConnectionError(f"admin API прокси недоступен ({socket_path}): {e or type(e).__name__}") from e
+    try:
+        writer.write((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        line = await asyncio.wait_for(reader.readline(), timeout)
+    except (OSError, ValueError, asyncio.TimeoutError) as e:
+        raise ConnectionError(f"admin API прокси не ответил: {e or type(e).__name__}") from e
+    finally:
+        writer.close()
+    if not line:
+        raise ConnectionError("admin API прокси закрыл соединение без ответа")
+    return json.loads(line)
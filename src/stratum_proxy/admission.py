@@ -0,0 +1,145 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+# Сколько IP держим в памяти ограничителя; при переполнении забываем тех, у кого ведро уже полное
+MAX_TRACKED_IPS = 10000
+
+class AdmissionControl:
+    """Допуск новых сессий: лимит подключений с одного IP и очередь на рукопожатие с пулом.
+
+    Рукопожатие прямой сессии — подключение к пулу (слот берётся, когда майнер уже прислал первую
+    строку, и отпускается, как только соединение с пулом открыто); общей сессии — подключение
+    и ответы пула на subscribe/authorize. Одновременно его проходят не больше max_handshakes сессий, остальные ждут в очереди
+    (не длиннее max_queue и не дольше queue_timeout секунд). Дождавшаяся сессия стартует со
+    случайной задержкой до jitter секунд, чтобы после смены режима пул не получал подключения
+    пачками. Без очереди (обычная работа) задержки нет.
+    """
+
+    def __init__(self, max_handshakes=64, max_queue=5000, queue_timeout=30.0, jitter=0.05, ip_rate=0.0, ip_burst=0):
+        self.max_handshakes = max_handshakes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.jitter = jitter
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.in_progress = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_handshakes) if max_handshakes else None
+        self._buckets = {}  # IP -> [токены, monotonic() последнего пополнения]
+        self.counters = {"admitted": 0, "queued": 0, "queue_full": 0, "timeout": 0, "ip_rate": 0}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def allow_ip(self, ip):
+        """Токен-бакет на IP: ip_rate подключений в секунду, запас ip_burst. ip_rate=0 — без лимита."""
+        if not self.ip_rate:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(ip)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_IPS:
+                self._forget_full(now)
+            bucket = self._buckets[ip] = [float(self.ip_burst), now]
+        bucket[0] = min(float(self.ip_burst), bucket[0] + (now - bucket[1]) * self.ip_rate)
+        bucket[1] = now
+        if bucket[0] < 1.0:
+            self.counters["ip_rate"] += 1
+            return False
+        bucket[0] -= 1.0
+        return True
+
+    def _forget_full(self, now):
+        for ip, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) * self.ip_rate >= self.ip_burst:
+                del self._buckets[ip]
+        if len(self._buckets) >= MAX_TRACKED_IPS:
+            self._buckets.clear()
+
+    async def acquire(self):
+        """Ждёт слот на рукопожатие с пулом и возвращает release() (повторный вызов ничего не делает).
+
+        ConnectionError, если очередь полна или слот не освободился за queue_timeout.
+        """
+        if self._slots is None:
+            return lambda: None
+        queued = self._slots.locked()
+        if queued:
+            if self.waiting >= self.max_queue:
+                self.counters["queue_full"] += 1
+                raise ConnectionError(f"очередь подключений к пулу переполнена ({self.waiting})")
+            self.counters["queued"] += 1
+        started = time.monotonic()
+        self.waiting += 1
+        acquired = False
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await self._slots.acquire()
+                acquired = True
+        except asyncio.TimeoutError:
+            # Слот мог достаться в тот же момент, когда истёк таймаут: не теряем его
+            if acquired:
+                self._slots.release()
+            self.counters["timeout"] += 1
+            raise ConnectionError(f"нет свободного слота подключения к пулу за {self.queue_timeout} с") from None
+        except BaseException:
+            if acquired:
+                self._slots.release()
+            raise
+        finally:
+            self.waiting -= 1
+        self.in_progress += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.in_progress -= 1
+                self._slots.release()
+
+        try:
+            if queued and self.jitter:
+                await asyncio.sleep(random.uniform(0, self.jitter))
+        except BaseException:
+            release()
+            raise
+        waited = time.monotonic() - started
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.counters["admitted"] += 1
+        return release
+
+    @contextlib.asynccontextmanager
+    async def handshake(self):
+        release = await self.acquire()
+        try:
+            yield
+        finally:
+            release()
+
+    def snapshot(self):
+        return {
+            "waiting": self.waiting,
+            "in_progress": self.in_progress,
+            "counters": dict(self.counters),
+            "wait_total": self.wait_total,
+            "wait_max": self.wait_max,
+        }
+
+def merge_admission(snapshots):
+    """Складывает AdmissionControl.snapshot() воркер-процессов."""
+    total = {"waiting": 0, "in_progress": 0, "counters": {}, "wait_total": 0.0, "wait_max": 0.0}
+    for snapshot in snapshots:
+        if not snapshot:
+            continue
+        total["waiting"] += snapshot["waiting"]
+        total["in_progress"] += snapshot["in_progress"]
+        for key, value in snapshot["counters"].items():
+            total["counters"][key] = total["counters"].get(key, 0) + value
+        total["wait_total"] += snapshot["wait_total"]
+        total["wait_max"] = max(total["wait_max"], snapshot["wait_max"])
+    return total
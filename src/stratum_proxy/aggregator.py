@@ -0,0 +1,591 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from .difficulty import DIFFICULTY_TOLERANCE, Job, MinerDifficulty, supports
+from .forwarding import AUTHORIZE_MARKER, FORWARD_STATS, resolve_user
+from .metrics import metrics
+from .share_filter import ShareFilter
+
+logger = logging.getLogger(__name__)
+RECONNECT_MESSAGE = b'{"id": null, "method": "client.reconnect", "params": []}\n'
+NOTIFY_MARKER = b'"mining.notify"'
+# Маска version-rolling, которую прокси запрашивает у пула для всех майнеров сессии (AsicBoost)
+VERSION_ROLLING_MASK = "1fffe000"
+# Сколько IP помним (IP -> кошелёк); при переполнении память сбрасывается
+MAX_REMEMBERED_IPS = 100_000
+# Неотвеченных submit на одну сессию к пулу
+MAX_PENDING_SUBMITS = 65536
+# Сколько строк майнера peek_wallet читает в поисках mining.authorize
+PEEK_MAX_LINES = 8
+# Заданий с последнего clean_jobs, по которым проверяются шары; более старые уходят в пул как есть
+MAX_JOBS = 64
+# Кошелёк, которому пул отказал в авторизации, столько секунд получает отказ без нового подключения к пулу
+REJECTED_TTL = 60.0
+LOW_DIFFICULTY_ERROR = [23, "Low difficulty share", None]
+INVALID_PARAMS_ERROR = [20, "Invalid params", None]
+_HEX_RE = re.compile(r"[0-9a-fA-F]*")
+
+class AuthorizationError(ConnectionError):
+    """Пул отклонил mining.authorize общей сессии; error — его ответ, его же получает майнер."""
+
+    def __init__(self, message, error):
+        super().__init__(message)
+        self.error = error
+
+def _line(msg):
+    return (json.dumps(msg) + "\n").encode()
+
+def _difficulty_line(difficulty):
+    return _line({"id": None, "method": "mining.set_difficulty", "params": [difficulty]})
+
+class Downstream:
+    """Майнер, подключённый к общей сессии: свой слот в extranonce2 пула и, если шары проверяются здесь, своя сложность."""
+    __slots__ = ("writer", "addr", "slot", "prefix", "session", "authorized", "difficulty")
+
+    def __init__(self, writer, addr, session):
+        self.writer = writer
+        self.addr = addr
+        self.slot = None
+        self.prefix = ""
+        self.session = session
+        self.authorized = False
+        self.difficulty = None  # MinerDifficulty; None — майнер получает сложность пула
+
+    def send(self, data, lines=1):
+        if self.writer.is_closing():
+            return
+        stats = FORWARD_STATS["to_miner"]
+        self.writer.write(data)
+        stats["lines"] += lines
+        stats["writes"] += 1
+        stats["bytes"] += len(data)
+        if self.session is not None:
+            self.session.bytes_out += len(data)
+
+class UpstreamSession:
+    """Одна сессия к пулу, авторизованная как wallet.<aggregate_worker>, на много майнеров одного кошелька.
+
+    extranonce2 пула делится: первые prefix_bytes байт — номер слота майнера (он получает их как
+    хвост своего extranonce1), остальное — его собственный extranonce2. mining.notify рассылается
+    всем майнерам одним и тем же буфером; submit майнера переписывается (имя воркера, extranonce2, id)
+    и ответ пула возвращается ему с исходным id.
+
+    Для sha256d (check_shares) у каждого майнера своя сложность не выше сложности пула: прокси
+    считает сложность его шары сам, в пул уходят только шары не ниже сложности пула, остальные
+    принимаются или отклоняются здесь. Иначе всем майнерам рассылается set_difficulty пула.
+    """
+
+    def __init__(self, aggregator, mode, wallet):
+        self.aggregator = aggregator
+        self.mode = mode
+        self.wallet = wallet
+        self.user = f"{wallet}.{aggregator.worker_name}"
+        self.endpoint = None
+        self.reader = None
+        self.writer = None
+        self.extranonce1 = ""
+        self.extranonce2_size = 0
+        self.configure_result = None
+        self.difficulty_line = None
+        self.notify_line = None
+        self.members = {}  # slot -> Downstream
+        self.free_slots = []
+        self.pending = {}  # id в сторону пула -> (Downstream, исходный id)
+        # Одни задания на всех майнеров сессии; повторы различаются по слоту в extranonce2
+        self.share_filter = ShareFilter(mode, max_recent=MAX_PENDING_SUBMITS) if aggregator.share_filter else None
+        self.check_shares = aggregator.checks_shares(mode)
+        self.pool_difficulty = None
+        self.jobs = {}  # job_id -> Job: задания с последнего clean_jobs, по порядку
+        self.version_mask = 0
+        self.next_id = 100
+        self.closed = False
+        self._idle_handle = None
+        self._task = None
+
+    async def connect(self):
+        self.reader, self.writer, self.endpoint = await self.aggregator.open_upstream(self.mode)
+        self.writer.write(
+            _line({"id": 1, "method": "mining.configure", "params": [
+                ["version-rolling"], {"version-rolling.mask": VERSION_ROLLING_MASK, "version-rolling.min-bit-count": 2},
+            ]})
+            + _line({"id": 2, "method": "mining.subscribe", "params": ["stratum-proxy/aggregate"]})
+            + _line({"id": 3, "method": "mining.authorize", "params": [self.user, "x"]})
+        )
+        replies = {}
+        while 2 not in replies or 3 not in replies:
+            line = await asyncio.wait_for(self.reader.readline(), self.aggregator.connect_timeout)
+            if not line:
+                raise ConnectionError("пул закрыл соединение во время subscribe/authorize")
+            msg = json.loads(line)
+            if msg.get("id") in (1, 2, 3):
+                replies[msg["id"]] = msg
+            else:
+                self._remember(msg.get("method"), line)
+        if not replies[3].get("result"):
+            raise AuthorizationError(f"пул отклонил авторизацию {self.user}: {replies[3].get('error')}", replies[3].get("error"))
+        subscribe = replies[2].get("result") or []
+        self.extranonce1, self.extranonce2_size = subscribe[1], int(subscribe[2])
+        if 1 in replies and not replies[1].get("error"):
+            self.configure_result = replies[1].get("result")
+            if isinstance(self.configure_result, dict) and self.configure_result.get("version-rolling"):
+                self.version_mask = int(self.configure_result.get("version-rolling.mask", "0"), 16)
+        prefix_bytes = self.aggregator.prefix_bytes
+        if self.extranonce2_size - prefix_bytes < 2:
+            raise ValueError(f"extranonce2_size пула {self.extranonce2_size} слишком мал для деления на {prefix_bytes} байт")
+        capacity = min(2 ** (8 * prefix_bytes), self.aggregator.max_miners)
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self._task = asyncio.create_task(self._read_loop())
+        logger.info(
+            f"Общая сессия к пулу {self.endpoint[0]}:{self.endpoint[1]} для {self.user} открыта: "
+            f"extranonce1 {self.extranonce1}, до {capacity} майнеров"
+        )
+
+    def _remember(self, method, line):
+        if method == "mining.set_difficulty":
+            self._set_pool_difficulty(line)
+        elif method == "mining.notify":
+            self._add_job(line)
+
+    def _set_pool_difficulty(self, line):
+        self.difficulty_line = line
+        try:
+            self.pool_difficulty = float(json.loads(line)["params"][0])
+        except (ValueError, KeyError, IndexError, TypeError):
+            logger.debug(f"Не удалось разобрать mining.set_difficulty: {line[:200]!r}")
+
+    def _add_job(self, line):
+        self.notify_line = line
+        if not self.check_shares:
+            return
+        try:
+            params = json.loads(line)["params"]
+            job = Job(params)
+        except (ValueError, KeyError, IndexError, TypeError):
+            # Шары по заданию, которое не разобрали, проверит пул
+            logger.debug(f"Не удалось разобрать mining.notify: {line[:200]!r}")
+            return
+        if len(params) > 8 and params[8]:
+            self.jobs.clear()
+        self.jobs[params[0]] = job
+        if len(self.jobs) > MAX_JOBS:
+            del self.jobs[next(iter(self.jobs))]
+        for member in self.members.values():
+            if member.difficulty is not None:
+                member.difficulty.new_job()
+
+    @property
+    def full(self):
+        return not self.free_slots
+
+    def attach(self, member):
+        member.slot = self.free_slots.pop()
+        member.prefix = f"{member.slot:0{self.aggregator.prefix_bytes * 2}x}"
+        self.members[member.slot] = member
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+    def detach(self, member):
+        if self.members.get(member.slot) is not member:
+            return
+        del self.members[member.slot]
+        self.free_slots.append(member.slot)
+        for key in [key for key, (owner, _) in self.pending.items() if owner is member]:
+            del self.pending[key]
+        if not self.members and not self.closed:
+            self._idle_handle = asyncio.get_running_loop().call_later(self.aggregator.idle_timeout, self.close)
+
+    def subscribe_result(self, member):
+        return [
+            [["mining.set_difficulty", member.prefix], ["mining.notify", member.prefix]],
+            self.extranonce1 + member.prefix,
+            self.extranonce2_size - self.aggregator.prefix_bytes,
+        ]
+
+    def difficulty_line_for(self, member):
+        """set_difficulty для только что авторизованного майнера: его доля сложности пула или сама сложность пула."""
+        if not self.check_shares or self.pool_difficulty is None:
+            return self.difficulty_line
+        aggregator = self.aggregator
+        member.difficulty = MinerDifficulty(self.pool_difficulty, aggregator.share_interval, aggregator.min_difficulty, time.monotonic())
+        member.difficulty.current = member.difficulty.clamp(self.pool_difficulty / len(self.members), self.pool_difficulty)
+        return _difficulty_line(member.difficulty.current)
+
+    def _send_difficulty(self, member, line):
+        if member.session is not None:
+            member.session.match_responses(line)
+        member.send(line)
+
+    def _check_share(self, member, msg_id, params, worker):
+        """Ответ майнеру на шару ниже сложности пула; None — шару нужно отправить в пул."""
+        job = self.jobs.get(params[1])
+        if job is None or self.pool_difficulty is None:
+            return None
+        try:
+            version_bits = params[5] if len(params) > 5 else None
+            difficulty = job.share_difficulty(self.extranonce1, params[2], params[3], params[4], version_bits, self.version_mask)
+        except (ValueError, TypeError):
+            return None
+        state = member.difficulty
+        accepted = state.accepts(difficulty)
+        retarget = state.record(accepted, time.monotonic(), self.pool_difficulty)
+        if state.unreliable:
+            logger.error(f"Шары майнера {member.addr} в общей сессии {self.user} не проходят проверку прокси, дальше их проверяет пул")
+            member.difficulty = None
+            if self.difficulty_line is not None:
+                self._send_difficulty(member, self.difficulty_line)
+            return None
+        if retarget is not None:
+            state.set(retarget)
+            self._send_difficulty(member, _difficulty_line(retarget))
+        if difficulty >= self.pool_difficulty * DIFFICULTY_TOLERANCE:
+            return None
+        if not accepted:
+            metrics.observe_filtered(self.mode, worker, "low_difficulty")
+            return _line({"id": msg_id, "result": None, "error": LOW_DIFFICULTY_ERROR})
+        if member.session is not None:
+            member.session.accept_local()
+        return _line({"id": msg_id, "result": True, "error": None})
+
+    def submit(self, member, msg):
+        """Отправляет submit майнера в пул; False, если на него уже ответили здесь (ошибка в params, share_filter, сложность)."""
+        if self.closed or self.writer.is_closing():
+            raise ConnectionError("сессия к пулу закрыта")
+        params = msg.get("params") or []
+        # extranonce2 майнера — hex ровно его доли extranonce2 пула: кривая шара ушла бы в пул от имени всех майнеров сессии
+        extranonce2 = params[2] if len(params) >= 5 else None
+        size = (self.extranonce2_size - self.aggregator.prefix_bytes) * 2
+        if not isinstance(extranonce2, str) or len(extranonce2) != size or not _HEX_RE.fullmatch(extranonce2):
+            member.send(_line({"id": msg.get("id"), "result": None, "error": INVALID_PARAMS_ERROR}))
+            return False
+        worker = member.session.worker if member.session is not None else str(params[0])
+        params[0] = self.user
+        params[2] = member.prefix + params[2]
+        if self.share_filter is not None:
+            response = self.share_filter.reject(msg.get("id"), params, worker)
+            if response is not None:
+                member.send(response)
+                return False
+        if member.difficulty is not None:
+            response = self._check_share(member, msg.get("id"), params, worker)
+            if response is not None:
+                member.send(response)
+                return False
+        if len(self.pending) >= MAX_PENDING_SUBMITS:
+            self.pending.pop(next(iter(self.pending)))
+        self.next_id += 1
+        self.pending[self.next_id] = (member, msg.get("id"))
+        out = _line({"id": self.next_id, "method": "mining.submit", "params": params})
+        self.writer.write(out)
+        stats = FORWARD_STATS["to_pool"]
+        stats["lines"] += 1
+        stats["writes"] += 1
+        stats["bytes"] += len(out)
+        return True
+
+    def _fan_out(self, line):
+        limit = self.aggregator.max_buffered
+        for member in list(self.members.values()):
+            if not member.authorized:
+                continue
+            member.send(line)
+            transport = member.writer.transport
+            if transport is not None and transport.get_write_buffer_size() > limit:
+                logger.warning(f"Майнер {member.addr} не успевает читать задания (буфер больше {limit} байт), закрываем")
+                member.writer.close()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                if NOTIFY_MARKER in line:
+                    # Одно задание — один буфер на всех майнеров сессии, без повторного кодирования
+                    self._add_job(line)
+                    if self.share_filter is not None:
+                        self.share_filter.notify(line)
+                    self._fan_out(line)
+                    continue
+                try:
+                    msg = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                method = msg.get("method")
+                if method == "mining.set_difficulty":
+                    self._set_pool_difficulty(line)
+                    if not self.check_shares:
+                        for member in self.members.values():
+                            if member.session is not None:
+                                member.session.match_responses(line)
+                        self._fan_out(line)
+                        continue
+                    for member in list(self.members.values()):
+                        if not member.authorized:
+                            continue
+                        if member.difficulty is None:
+                            self._send_difficulty(member, line)
+                        elif self.pool_difficulty is not None and member.difficulty.current > self.pool_difficulty:
+                            # Сложность майнера не выше сложности пула: иначе его шары, годные для пула, отсеивались бы здесь
+                            member.difficulty.set(self.pool_difficulty)
+                            self._send_difficulty(member, _difficulty_line(self.pool_difficulty))
+                elif method in ("mining.set_extranonce", "client.reconnect"):
+                    logger.info(f"Пул прислал {method} общей сессии {self.user}, переподключаем её майнеров")
+                    break
+                elif method is None:
+                    entry = self.pending.pop(msg.get("id"), None)
+                    if entry is None:
+                        continue
+                    member, original_id = entry
+                    msg["id"] = original_id
+                    out = _line(msg)
+                    if member.session is not None:
+                        member.session.match_responses(out)
+                    member.send(out)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.warning(f"Ошибка общей сессии к пулу для {self.user}: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.aggregator.forget(self)
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+        if self.writer is not None:
+            self.writer.close()
+        if self.members:
+            logger.info(f"Общая сессия {self.user} закрыта, отправляем client.reconnect {len(self.members)} майнерам")
+        for member in list(self.members.values()):
+            try:
+                member.writer.write(RECONNECT_MESSAGE)
+            finally:
+                member.writer.close()
+        self.members.clear()
+        self.pending.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+class Aggregator:
+    """Общие сессии к пулу по (режим, кошелёк) и память IP -> кошелёк.
+
+    Кошелёк майнера становится известен только в mining.authorize, а extranonce1 нужно отдать
+    в ответ на mining.subscribe. Большинство прошивок шлют subscribe и authorize подряд, не дожидаясь
+    ответа, — тогда кошелёк виден сразу (peek_wallet). Для остальных кошелёк запоминается по IP:
+    первое подключение идёт напрямую, следующие с этого IP — в общую сессию. Если с одного IP
+    приходят разные кошельки, такие майнеры остаются на прямых сессиях.
+
+    share_interval — секунд на шару, к которым vardiff подводит сложность каждого майнера
+    (0 — всем сложность пула); algorithm(mode) — алгоритм режима, свои сложности только для sha256d.
+    """
+
+    def __init__(self, open_upstream, prefix_bytes=1, max_miners=256, worker_name="proxy",
+                 idle_timeout=60.0, connect_timeout=10.0, max_buffered=256 * 1024, admission=None, share_filter=False,
+                 share_interval=0, min_difficulty=1.0, algorithm=None):
+        self.open_upstream = open_upstream
+        self.admission = admission
+        self.share_filter = share_filter
+        self.share_interval = share_interval
+        self.min_difficulty = min_difficulty
+        self.algorithm = algorithm
+        self.prefix_bytes = prefix_bytes
+        self.max_miners = max_miners
+        self.worker_name = worker_name
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.max_buffered = max_buffered
+        self.sessions = {}  # (mode, wallet) -> [UpstreamSession]
+        self.wallets = {}  # IP -> кошелёк последней авторизации
+        self.mismatches = {}  # IP -> сколько раз кошелёк не совпал с ожидаемым
+        self.mixed = set()  # IP с несколькими кошельками: только прямые сессии
+        self.rejected = {}  # (mode, wallet) -> (loop.time() до которого помним, ответ пула на authorize)
+        self._connecting = {}  # (mode, wallet) -> Future новой сессии
+
+    def checks_shares(self, mode):
+        return bool(self.share_interval) and self.algorithm is not None and supports(self.algorithm(mode))
+
+    def wallet_for(self, ip):
+        if ip in self.mixed:
+            return None
+        return self.wallets.get(ip)
+
+    def learn(self, ip, wallet, expected=None):
+        if len(self.wallets) >= MAX_REMEMBERED_IPS:
+            self.wallets.clear()
+            self.mismatches.clear()
+            self.mixed.clear()
+        if expected is not None and wallet != expected:
+            self.mismatches[ip] = self.mismatches.get(ip, 0) + 1
+            if self.mismatches[ip] >= 2:
+                self.mixed.add(ip)
+                logger.info(f"С IP {ip} авторизуются разные кошельки, его майнеры пойдут напрямую")
+        self.wallets[ip] = wallet
+
+    def forget(self, upstream):
+        sessions = self.sessions.get((upstream.mode, upstream.wallet), [])
+        if upstream in sessions:
+            sessions.remove(upstream)
+
+    async def acquire(self, mode, wallet):
+        """Сессия с свободным слотом для (mode, wallet); новая открывается одна на ключ, остальные ждут её."""
+        key = (mode, wallet)
+        loop = asyncio.get_running_loop()
+        while True:
+            for upstream in self.sessions.get(key, []):
+                if not upstream.full and not upstream.closed:
+                    return upstream
+            pending = self._connecting.get(key)
+            if pending is not None:
+                await asyncio.shield(pending)
+                continue
+            rejected = self.rejected.get(key)
+            if rejected is not None:
+                if loop.time() < rejected[0]:
+                    raise AuthorizationError(f"пул недавно отклонил авторизацию кошелька {wallet}", rejected[1])
+                del self.rejected[key]
+            future = loop.create_future()
+            self._connecting[key] = future
+            upstream = None
+            try:
+                upstream = UpstreamSession(self, mode, wallet)
+                if self.admission is not None:
+                    async with self.admission.handshake():
+                        await upstream.connect()
+                else:
+                    await upstream.connect()
+                self.sessions.setdefault(key, []).append(upstream)
+                return upstream
+            except AuthorizationError as e:
+                if len(self.rejected) >= MAX_REMEMBERED_IPS:
+                    self.rejected.clear()
+                self.rejected[key] = (loop.time() + REJECTED_TTL, e.error)
+                upstream.writer.close()
+                raise
+            except BaseException:
+                if upstream is not None and upstream.writer is not None:
+                    upstream.writer.close()
+                raise
+            finally:
+                del self._connecting[key]
+                future.set_result(None)
+
+    def stats(self):
+        upstreams = [upstream for sessions in self.sessions.values() for upstream in sessions]
+        return {"upstreams": len(upstreams), "miners": sum(len(upstream.members) for upstream in upstreams)}
+
+    async def peek_wallet(self, miner_reader, alias_map, timeout):
+        """Читает первые строки майнера до mining.authorize (не дольше timeout). Возвращает (строки, кошелёк|None)."""
+        lines = []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(lines) < PEEK_MAX_LINES:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(miner_reader.readline(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+            lines.append(line)
+            if AUTHORIZE_MARKER in line:
+                try:
+                    params = json.loads(line).get("params") or [""]
+                except json.JSONDecodeError:
+                    break
+                _, _, wallet, new_user = resolve_user(params[0], alias_map)
+                return lines, wallet or new_user.split(".", 1)[0]
+        return lines, None
+
+    async def serve(self, miner_reader, miner_writer, addr, mode, wallet, alias_map, session, info, lines=()):
+        """Обслуживает майнера в общей сессии кошелька wallet до отключения одной из сторон.
+
+        lines — строки, уже прочитанные peek_wallet; они обрабатываются первыми.
+        info (ClientState) получает эндпоинт общей сессии, время последних данных от майнера и имя воркера.
+        """
+        try:
+            upstream = await self.acquire(mode, wallet)
+        except AuthorizationError as e:
+            # Как на прямой сессии: майнер получает отказ пула в ответ на свой mining.authorize
+            for line in lines:
+                if AUTHORIZE_MARKER in line:
+                    try:
+                        msg_id = json.loads(line).get("id")
+                    except json.JSONDecodeError:
+                        continue
+                    miner_writer.write(_line({"id": msg_id, "result": None, "error": e.error}))
+            raise
+        member = Downstream(miner_writer, addr, session)
+        upstream.attach(member)
+        info.upstream = upstream.endpoint
+        lines = list(lines)
+        try:
+            while not upstream.closed:
+                line = lines.pop(0) if lines else await miner_reader.readline()
+                if not line:
+                    break
+                info.touch()
+                if session is not None:
+                    session.bytes_in += len(line)
+                try:
+                    msg = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.warning(f"Неверный JSON от майнера {addr}: {e}")
+                    continue
+                method = msg.get("method")
+                msg_id = msg.get("id")
+                if method == "mining.submit":
+                    if upstream.submit(member, msg) and session is not None:
+                        session.track_submits(line)
+                elif method == "mining.subscribe":
+                    member.send(_line({"id": msg_id, "result": upstream.subscribe_result(member), "error": None}))
+                elif method == "mining.authorize":
+                    params = msg.get("params") or [""]
+                    alias, _, resolved, new_user = resolve_user(params[0], alias_map)
+                    actual = resolved or new_user.split(".", 1)[0]
+                    self.learn(addr[0], actual, expected=wallet)
+                    # Кошелёк сессии пул уже проверил при её authorize; другой (в том числе неизвестный alias)
+                    # проверит при новом подключении майнера, и отказ пула майнер получит сам
+                    if actual != wallet:
+                        logger.info(f"Майнер {addr} авторизовался кошельком {actual}, ожидали {wallet}; переподключаем")
+                        member.send(RECONNECT_MESSAGE)
+                        break
+                    if session is not None:
+                        session.worker = new_user
+                    info.authorize(alias, new_user)
+                    member.authorized = True
+                    member.send(_line({"id": msg_id, "result": True, "error": None}))
+                    logger.info(f"Майнер {addr} ({new_user}) в общей сессии {upstream.user}, слот {member.slot}")
+                    for cached in (upstream.difficulty_line_for(member), upstream.notify_line):
+                        if cached is not None:
+                            if session is not None:
+                                session.match_responses(cached)
+                            member.send(cached)
+                elif method == "mining.configure":
+                    if upstream.configure_result is not None:
+                        member.send(_line({"id": msg_id, "result": upstream.configure_result, "error": None}))
+                    else:
+                        member.send(_line({"id": msg_id, "result": None, "error": [20, "Not supported", None]}))
+                elif method in ("mining.extranonce.subscribe", "mining.suggest_difficulty", "mining.multi_version"):
+                    member.send(_line({"id": msg_id, "result": True, "error": None}))
+                elif msg_id is not None:
+                    member.send(_line({"id": msg_id, "result": None, "error": [20, f"Unsupported method {method}", None]}))
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.warning(f"Ошибка майнера {addr} в общей сессии: {e}")
+        finally:
+            upstream.detach(member)
+            miner_writer.close()
+            try:
+                await miner_writer.wait_closed()
+            except Exception:
+                pass
+
+    async def close(self):
+        for sessions in list(self.sessions.values()):
+            for upstream in list(sessions):
+                upstream.close()
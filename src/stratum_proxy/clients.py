@@ -0,0 +1,196 @@
+import socket
+import time
+
+def _endpoint(pair):
+    return f"{pair[0]}:{pair[1]}" if pair else None
+
+class ClientState:
+    """Сессия майнера в реестре: режим, адрес, writer майнера, эндпоинт пула и время последних данных от майнера.
+
+    worker и alias появляются на mining.authorize; session (SessionMetrics) — байты и ответы пула на шары.
+    """
+    __slots__ = (
+        "mode", "addr", "writer", "upstream", "opened", "last_read",
+        "id", "worker", "alias", "session", "aggregated", "registry",
+    )
+
+    def __init__(self, mode, addr, writer):
+        self.mode = mode
+        self.addr = addr
+        self.writer = writer
+        self.upstream = None
+        self.opened = time.monotonic()
+        self.last_read = None  # None — майнер ещё ничего не прислал
+        self.id = None
+        self.worker = None  # кошелёк.воркер после замены alias
+        self.alias = None
+        self.session = None
+        self.aggregated = False
+        self.registry = None
+
+    def touch(self):
+        self.last_read = time.monotonic()
+
+    def authorize(self, alias, worker):
+        if self.registry is not None:
+            self.registry.authorize(self, alias, worker)
+        else:
+            self.alias, self.worker = alias, worker
+
+    def describe(self, now=None):
+        """Словарь для admin API: только простые типы, годится для JSON."""
+        now = time.monotonic() if now is None else now
+        session = self.session
+        return {
+            "id": self.id,
+            "addr": _endpoint(self.addr),
+            "mode": self.mode,
+            "upstream": _endpoint(self.upstream),
+            "worker": self.worker,
+            "alias": self.alias,
+            "aggregated": self.aggregated,
+            "connected": round(now - self.opened, 1),
+            "idle": round(now - (self.last_read or self.opened), 1),
+            "bytes_in": session.bytes_in if session is not None else None,
+            "bytes_out": session.bytes_out if session is not None else None,
+            "accepted": session.accepted if session is not None else None,
+            "rejected": session.rejected if session is not None else None,
+            "unanswered": session.unanswered if session is not None else None,
+        }
+
+class ClientRegistry:
+    """Сессии майнеров процесса с индексами: задача, id, воркер (кошелёк.воркер) и alias.
+
+    Добавление, удаление и authorize — O(1); по задачам ведёт себя как словарь task -> ClientState,
+    так что перебор, len() и `task in` работают как с прежним active_clients.
+    """
+
+    def __init__(self):
+        self.tasks = {}  # task -> ClientState
+        self.by_id = {}  # id -> ClientState
+        self.by_worker = {}  # кошелёк.воркер -> {id: ClientState}
+        self.by_alias = {}  # alias -> {id: ClientState}
+        self.prefix = ""  # воркер-процесс ставит "<номер>-", чтобы id не пересекались между процессами
+        self._next_id = 0
+
+    def add(self, task, client):
+        self._next_id += 1
+        client.id = f"{self.prefix}{self._next_id}"
+        client.registry = self
+        self.tasks[task] = client
+        self.by_id[client.id] = client
+        return client
+
+    def remove(self, task):
+        client = self.tasks.pop(task, None)
+        if client is None:
+            return None
+        del self.by_id[client.id]
+        self._unindex(client)
+        client.registry = None
+        return client
+
+    def authorize(self, client, alias, worker):
+        """Майнер (пере)авторизовался: индексы по воркеру и alias переезжают на новые имена."""
+        self._unindex(client)
+        client.alias, client.worker = alias, worker
+        if worker is not None:
+            self.by_worker.setdefault(worker, {})[client.id] = client
+        if alias is not None:
+            self.by_alias.setdefault(alias, {})[client.id] = client
+
+    def _unindex(self, client):
+        for index, key in ((self.by_worker, client.worker), (self.by_alias, client.alias)):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(client.id, None)
+                if not bucket:
+                    del index[key]
+
+    def find(self, id=None, worker=None, alias=None, mode=None, upstream=None):
+        """Сессии, подходящие под все заданные фильтры; id, worker и alias ищутся по индексу.
+
+        worker без точки, которого нет в индексе, — кошелёк: найдутся все его воркеры.
+        """
+        if id is not None:
+            client = self.by_id.get(str(id))
+            candidates = [client] if client is not None else []
+        elif worker is not None:
+            if worker in self.by_worker:
+                candidates = list(self.by_worker[worker].values())
+            elif "." not in worker:
+                prefix = worker + "."
+                candidates = [
+                    client for name, bucket in self.by_worker.items() if name.startswith(prefix)
+                    for client in bucket.values()
+                ]
+            else:
+                candidates = []
+        elif alias is not None:
+            candidates = list(self.by_alias.get(alias, {}).values())
+        else:
+            candidates = list(self.tasks.values())
+        return [
+            client for client in candidates
+            if (worker is None or client.worker == worker or (client.worker or "").startswith(worker + "."))
+            and (alias is None or client.alias == alias)
+            and (mode is None or client.mode == mode)
+            and (upstream is None or _endpoint(client.upstream) == upstream)
+        ]
+
+    def clear(self):
+        for task in list(self.tasks):
+            self.remove(task)
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __iter__(self):
+        return iter(self.tasks)
+
+    def __contains__(self, task):
+        return task in self.tasks
+
+    def get(self, task, default=None):
+        return self.tasks.get(task, default)
+
+    def items(self):
+        return self.tasks.items()
+
+    def values(self):
+        return self.tasks.values()
+
+def expired_clients(clients, login_timeout, idle_timeout):
+    """Сессии (ClientState), которые пора закрыть, и их число по причинам.
+
+    login — майнер ничего не прислал за login_timeout после подключения (полуоткрытое соединение
+    или сканер портов); idle — молчит дольше idle_timeout. Нулевой таймаут отключает проверку.
+    """
+    now = time.monotonic()
+    expired = []
+    reasons = {"login": 0, "idle": 0}
+    for client in clients.values():
+        if client.last_read is None:
+            if login_timeout and now - client.opened > login_timeout:
+                expired.append(client)
+                reasons["login"] += 1
+        elif idle_timeout and now - client.last_read > idle_timeout:
+            expired.append(client)
+            reasons["idle"] += 1
+    return expired, reasons
+
+def set_keepalive(writer, settings):
+    """TCP keepalive на сокете майнера: ядро само найдёт пропавшего без FIN майнера.
+
+    settings — {"idle", "interval", "count"} в секундах и пробах; параметры, которых нет в этой ОС, пропускаются.
+    """
+    sock = writer.get_extra_info("socket")
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for key, option in (("idle", "TCP_KEEPIDLE"), ("interval", "TCP_KEEPINTVL"), ("count", "TCP_KEEPCNT")):
+            if key in settings and hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), int(settings[key]))
+    except OSError:
+        pass
@@ -1,10 +1,19 @@
+import asyncio
 import json
 import logging
 import os
+from ..mode_state import get_mode_state
+from ..worker_feed import get_worker_feed
 
 logger = logging.getLogger(__name__)
-CONFIG_PATH = "/home/simple1/bot/config/config.json"
-CURRENT_MODE_PATH = "/home/simple1/bot/data/current_mode.txt"
+# Пути можно переопределить переменными окружения (нагрузочный стенд запускает прокси со своим конфигом)
+CONFIG_PATH = os.environ.get("STRATUM_PROXY_CONFIG", "/home/simple1/bot/config/config.json")
+CURRENT_MODE_PATH = os.environ.get("STRATUM_PROXY_MODE_FILE", "/home/simple1/bot/data/current_mode.txt")
+MODE_SOCKET_PATH = os.environ.get("STRATUM_PROXY_MODE_SOCKET", "/home/simple1/bot/data/mode.sock")
+WORKER_SOCKET_PATH = os.environ.get("STRATUM_PROXY_WORKER_SOCKET", "/home/simple1/bot/data/workers.sock")
+ADMIN_SOCKET_PATH = os.environ.get("STRATUM_PROXY_ADMIN_SOCKET", "/home/simple1/bot/data/admin.sock")
+mode_state = get_mode_state(CURRENT_MODE_PATH, MODE_SOCKET_PATH)
+worker_feed = get_worker_feed(WORKER_SOCKET_PATH)
 
 def validate_config(config):
     required_fields = ["modes"]
@@ -12,8 +21,11 @@ def validate_config(config):
         if field not in config:
             raise ValueError(f"Отсутствует обязательное поле '{field}' в конфиге")
     for mode, info in config["modes"].items():
-        if "port" not in info or "alias" not in info:
-            raise ValueError(f"Режим '{mode}' должен содержать 'port' и 'alias'")
+        if ("port" not in info and "upstreams" not in info) or "alias" not in info:
+            raise ValueError(f"Режим '{mode}' должен содержать 'port' (или 'upstreams') и 'alias'")
+        for upstream in info.get("upstreams", []):
+            if "port" not in upstream:
+                raise ValueError(f"Каждый элемент 'upstreams' режима '{mode}' должен содержать 'port'")
 
 def load_config():
     try:
@@ -32,10 +44,55 @@ def load_config():
         logger.error(f"Ошибка валидации конфигурации: {e}")
         raise
 
+def config_signature():
+    """(inode, mtime, размер) config.json: меняется и при правке на месте, и при замене файла."""
+    try:
+        stat = os.stat(CONFIG_PATH)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def reload_config():
+    """Читает и проверяет config.json заново. None при ошибке — прокси остаётся на текущей конфигурации."""
+    try:
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        validate_config(config)
+        return config
+    except FileNotFoundError:
+        logger.error(f"Файл конфигурации {CONFIG_PATH} не найден, оставляем текущую конфигурацию")
+    except json.JSONDecodeError as e:
+        logger.error(f"Ошибка синтаксиса в {CONFIG_PATH}: {e}; оставляем текущую конфигурацию")
+    except ValueError as e:
+        logger.error(f"Ошибка валидации конфигурации: {e}; оставляем текущую конфигурацию")
+    return None
+
+async def watch_config(on_change, interval, reload_requested=None):
+    """Раз в interval секунд (или сразу по reload_requested) проверяет config.json; новую валидную версию отдаёт в on_change."""
+    signature = config_signature()
+    while True:
+        if reload_requested is not None:
+            try:
+                await asyncio.wait_for(reload_requested.wait(), interval)
+                logger.info("Запрошена перезагрузка конфигурации")
+            except asyncio.TimeoutError:
+                pass
+            forced = reload_requested.is_set()
+            reload_requested.clear()
+        else:
+            await asyncio.sleep(interval)
+            forced = False
+        current = config_signature()
+        if current == signature and not forced:
+            continue
+        signature = current
+        config = reload_config()
+        if config is None:
+            continue
+        try:
+            on_change(config)
+        except Exception as e:
+            logger.error(f"Ошибка применения новой конфигурации: {e}")
+
 def get_current_mode():
-    if not os.path.exists(CURRENT_MODE_PATH):
-        with open(CURRENT_MODE_PATH, 'w', encoding='utf-8') as f:
-            f.write("сон")
-        return "сон"
-    with open(CURRENT_MODE_PATH, 'r', encoding='utf-8') as f:
-        return f.read().strip()
\ No newline at end of file
+    return mode_state.get()
@@ -0,0 +1,113 @@
+import hashlib
+import struct
+
+# Цель сложности 1 (как в MiningCore): сложность шары = DIFF1 / хэш заголовка
+DIFF1 = 0xFFFF << 208
+# Алгоритмы режимов, шары которых прокси умеет проверять сам (double SHA-256 заголовка)
+SHA256D_ALGORITHMS = ("sha256", "sha256d")
+# MiningCore принимает шару, если её сложность не ниже 0.99 от назначенной
+DIFFICULTY_TOLERANCE = 0.99
+# Пересчёт сложности майнера: после стольких шар или стольких секунд с начала окна
+RETARGET_SHARES = 16
+RETARGET_SECONDS = 90.0
+# За один пересчёт сложность меняется не больше чем вчетверо; изменение меньше четверти не отправляется
+RETARGET_MAX_STEP = 4.0
+RETARGET_MIN_CHANGE = 0.25
+# Майнер, у которого больше половины из стольких проверенных шар ниже его сложности, проверяется пулом
+SELF_CHECK_SHARES = 32
+
+def supports(algorithm):
+    return str(algorithm or "").lower() in SHA256D_ALGORITHMS
+
+def _sha256d(data):
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+class Job:
+    """Задание из mining.notify, разобранное для сборки заголовка блока (sha256d).
+
+    ValueError, TypeError или IndexError — если параметры задания не разобрать.
+    """
+    __slots__ = ("prevhash", "coinb1", "coinb2", "branches", "version", "nbits")
+
+    def __init__(self, params):
+        prevhash = bytes.fromhex(params[1])
+        if len(prevhash) != 32:
+            raise ValueError(f"prevhash длиной {len(prevhash)} байт")
+        # В stratum prevhash идёт 4-байтными словами в обратном порядке
+        self.prevhash = b"".join(prevhash[i:i + 4][::-1] for i in range(0, 32, 4))
+        self.coinb1 = bytes.fromhex(params[2])
+        self.coinb2 = bytes.fromhex(params[3])
+        self.branches = [bytes.fromhex(branch) for branch in params[4]]
+        self.version = int(params[5], 16)
+        self.nbits = bytes.fromhex(params[6])[::-1]
+
+    def share_difficulty(self, extranonce1, extranonce2, ntime, nonce, version_bits=None, version_mask=0):
+        """Сложность шары: DIFF1 / sha256d(заголовок). ValueError — если поля submit не hex нужной длины."""
+        root = _sha256d(self.coinb1 + bytes.fromhex(extranonce1 + extranonce2) + self.coinb2)
+        for branch in self.branches:
+            root = _sha256d(root + branch)
+        version = self.version
+        if version_bits is not None:
+            version = (version & ~version_mask) | (int(version_bits, 16) & version_mask)
+        ntime, nonce = bytes.fromhex(ntime), bytes.fromhex(nonce)
+        if len(ntime) != 4 or len(nonce) != 4:
+            raise ValueError("ntime и nonce должны быть по 4 байта")
+        header = struct.pack("<I", version & 0xFFFFFFFF) + self.prevhash + root + ntime[::-1] + self.nbits + nonce[::-1]
+        value = int.from_bytes(_sha256d(header), "little")
+        return DIFF1 / value if value else float("inf")
+
+class MinerDifficulty:
+    """Своя сложность майнера в общей сессии: vardiff по его шарам к target_interval секунд на шару.
+
+    Сложность не выше сложности пула и не ниже min_difficulty (если сам пул не ниже). Предыдущая
+    сложность действует до следующего задания: майнер переходит на новую с нового mining.notify.
+    """
+    __slots__ = ("current", "previous", "target_interval", "min_difficulty", "window_start", "window_shares", "checked", "low")
+
+    def __init__(self, difficulty, target_interval, min_difficulty, now):
+        self.current = difficulty
+        self.previous = None
+        self.target_interval = target_interval
+        self.min_difficulty = min_difficulty
+        self.window_start = now
+        self.window_shares = 0
+        self.checked = 0
+        self.low = 0
+
+    def clamp(self, difficulty, pool_difficulty):
+        return min(pool_difficulty, max(self.min_difficulty, difficulty))
+
+    def set(self, difficulty):
+        self.previous = self.current if self.previous is None else min(self.previous, self.current)
+        self.current = difficulty
+
+    def new_job(self):
+        self.previous = None
+
+    def accepts(self, share_difficulty):
+        floor = self.current if self.previous is None else min(self.current, self.previous)
+        return share_difficulty >= floor * DIFFICULTY_TOLERANCE
+
+    def record(self, accepted, now, pool_difficulty):
+        """Учитывает проверенную шару; новая сложность, если её пора сменить, иначе None."""
+        self.checked += 1
+        if not accepted:
+            self.low += 1
+            return None
+        self.window_shares += 1
+        elapsed = now - self.window_start
+        if self.window_shares < RETARGET_SHARES and elapsed < RETARGET_SECONDS:
+            return None
+        wanted = self.current * self.target_interval * self.window_shares / max(elapsed, 1e-3)
+        wanted = min(self.current * RETARGET_MAX_STEP, max(self.current / RETARGET_MAX_STEP, wanted))
+        wanted = self.clamp(wanted, pool_difficulty)
+        self.window_start = now
+        self.window_shares = 0
+        if abs(wanted - self.current) < self.current * RETARGET_MIN_CHANGE:
+            return None
+        return wanted
+
+    @property
+    def unreliable(self):
+        """Большинство шар майнера не проходят проверку: считаем проверку неприменимой к нему."""
+        return self.checked >= SELF_CHECK_SHARES and self.low * 2 > self.checked
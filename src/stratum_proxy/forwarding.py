@@ -0,0 +1,274 @@
+import asyncio
+import json
+import logging
+from .metrics import SUBMIT_MARKER
+
+logger = logging.getLogger(__name__)
+
+# Единственное сообщение, которое прокси переписывает. Всё остальное (submit, subscribe,
+# extranonce и т.д.) можно отдавать пулу как есть, не разбирая JSON.
+AUTHORIZE_MARKER = b"mining.authorize"
+
+# Счётчики по направлениям: writes — число вызовов transport.write (≈ системных вызовов send),
+# drains — сколько раз упёрлись в верхнюю отметку буфера и ждали дренажа
+FORWARD_STATS = {
+    "to_pool": {"lines": 0, "writes": 0, "bytes": 0, "drains": 0},
+    "to_miner": {"lines": 0, "writes": 0, "bytes": 0, "drains": 0},
+}
+
+# Отметки буфера записи на направление, предел байт, которые соединение может держать в памяти,
+# и предел длины одной строки (он же limit StreamReader: readline длиннее — ошибка, буфер чтения ≤ 2×)
+DEFAULT_LIMITS = {
+    "high_water": 64 * 1024,
+    "low_water": 16 * 1024,
+    "max_buffered": 256 * 1024,
+    "drain_timeout": 30.0,
+    "read_chunk": 16 * 1024,
+    "max_line": 16 * 1024,
+}
+
+class PrefetchedReader:
+    """StreamReader майнера, который сначала отдаёт уже прочитанные из него строки (data), потом читает дальше.
+
+    Строки, прочитанные до подключения к пулу, так проходят через forward_to_pool наравне с остальными.
+    """
+    __slots__ = ("data", "reader")
+
+    def __init__(self, data, reader):
+        self.data = data
+        self.reader = reader
+
+    def at_eof(self):
+        return not self.data and self.reader.at_eof()
+
+    async def readline(self):
+        if not self.data:
+            return await self.reader.readline()
+        end = self.data.find(b"\n") + 1 or len(self.data)
+        line, self.data = self.data[:end], self.data[end:]
+        return line
+
+    async def read(self, n=-1):
+        if not self.data:
+            return await self.reader.read(n)
+        end = len(self.data) if n < 0 else n
+        chunk, self.data = self.data[:end], self.data[end:]
+        return chunk
+
+def apply_write_limits(writer, limits):
+    """Выставляет high/low отметки буфера записи: drain() блокирует только выше high_water."""
+    transport = getattr(writer, "transport", None)
+    if transport is not None:
+        transport.set_write_buffer_limits(high=limits["high_water"], low=limits["low_water"])
+
+async def write_batch(writer, data, lines, limits, stats):
+    """Один write на пачку строк; ждём дренажа только когда буфер перевалил за high_water."""
+    writer.write(data)
+    stats["lines"] += lines
+    stats["writes"] += 1
+    stats["bytes"] += len(data)
+    transport = getattr(writer, "transport", None)
+    buffered = transport.get_write_buffer_size() if transport is not None else 0
+    if buffered > limits["max_buffered"]:
+        raise BufferError(f"в буфере записи {buffered} байт, предел {limits['max_buffered']}")
+    if buffered > limits["high_water"]:
+        stats["drains"] += 1
+        await asyncio.wait_for(writer.drain(), limits["drain_timeout"])
+
+def resolve_user(user, alias_map):
+    """Разбирает 'alias.worker' и возвращает (alias, worker, wallet, new_user); wallet=None, если alias неизвестен."""
+    if "." in user:
+        alias, worker = user.split(".", 1)
+    else:
+        alias, worker = user, ""
+    wallet = alias_map.get(alias)
+    if not wallet:
+        return alias, worker, None, user
+    new_user = f"{wallet}.{worker}" if worker else wallet
+    return alias, worker, wallet, new_user
+
+def rewrite_miner_line(data, alias_map, addr, session=None, client=None):
+    """Полный разбор строки майнера. Возвращает байты для отправки в пул или None, если строку нужно пропустить.
+
+    Если передан session (SessionMetrics), в него записывается итоговое имя воркера из authorize;
+    client (ClientState) получает alias и это имя — по ним сессию находит admin API.
+    """
+    text = data.decode().strip()
+    if not text:
+        return None
+    try:
+        msg = json.loads(text)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Неверный JSON от майнера {addr}: {e}")
+        return data
+
+    if msg.get("method") == "mining.authorize":
+        params = msg.get("params", [])
+        if params:
+            alias, worker, wallet, new_user = resolve_user(params[0], alias_map)
+            if session is not None:
+                session.worker = new_user
+            if client is not None:
+                client.authorize(alias, new_user)
+            if wallet:
+                msg["params"][0] = new_user
+                logger.info(f"Заменен alias '{alias}' на кошелек '{wallet}' (воркер '{worker}')")
+                return (json.dumps(msg) + "\n").encode()
+            logger.info(f"Alias '{alias}' не найден в конфиге; отправляем без изменений")
+    return data
+
+async def _pipe_lines_to_pool(miner_reader, pool_writer, alias_map, addr, fast_path, stats, session, client, share_filter):
+    while not miner_reader.at_eof():
+        data = await miner_reader.readline()
+        if not data:
+            break
+        if client is not None:
+            client.touch()
+        if session is not None:
+            session.bytes_in += len(data)
+        if share_filter is not None and SUBMIT_MARKER in data:
+            data = share_filter.filter_submits(data, session.worker if session is not None else None)
+            if not data:
+                continue
+        if session is not None:
+            session.track_submits(data)
+        if fast_path and AUTHORIZE_MARKER not in data:
+            out = data
+        else:
+            out = rewrite_miner_line(data, alias_map, addr, session, client)
+            if out is None:
+                continue
+        pool_writer.write(out)
+        stats["lines"] += 1
+        stats["writes"] += 1
+        stats["bytes"] += len(out)
+        await pool_writer.drain()
+
+async def _pipe_batches_to_pool(miner_reader, pool_writer, alias_map, addr, fast_path, limits, stats, session, client, share_filter):
+    """Читает всё, что уже пришло от майнера, и отправляет полные строки одним write."""
+    apply_write_limits(pool_writer, limits)
+    pending = b""
+    while True:
+        chunk = await miner_reader.read(limits["read_chunk"])
+        if not chunk:
+            break
+        if client is not None:
+            client.touch()
+        data = pending + chunk if pending else chunk
+        end = data.rfind(b"\n") + 1
+        pending = data[end:]
+        if len(pending) > limits["max_line"]:
+            raise BufferError(f"строка от майнера длиннее {limits['max_line']} байт")
+        if not end:
+            continue
+        batch = data[:end] if pending else data
+        if session is not None:
+            session.bytes_in += len(batch)
+        if share_filter is not None and SUBMIT_MARKER in batch:
+            batch = share_filter.filter_submits(batch, session.worker if session is not None else None)
+            if not batch:
+                continue
+        lines = batch.count(b"\n")
+        if session is not None:
+            session.track_submits(batch)
+        if not fast_path or AUTHORIZE_MARKER in batch:
+            rewritten = (rewrite_miner_line(line, alias_map, addr, session, client) for line in batch.splitlines(keepends=True))
+            batch = b"".join(line for line in rewritten if line is not None)
+            if not batch:
+                continue
+        await write_batch(pool_writer, batch, lines, limits, stats)
+    if pending:
+        await write_batch(pool_writer, pending, 0, limits, stats)
+
+async def forward_to_pool(
+    miner_reader, pool_writer, alias_map, addr, fast_path=True, buffered=False, limits=None, session=None, client=None,
+    share_filter=None,
+):
+    """Майнер -> пул. В режиме fast_path строки без AUTHORIZE_MARKER уходят в пул байтами, без json.loads.
+
+    В режиме buffered готовые строки отправляются пачкой, с отметками буфера из limits.
+    session (SessionMetrics) запоминает id отправленных mining.submit и считает байты.
+    client (ClientState) получает время последних данных от майнера — по нему закрываются молчащие сессии —
+    и имя воркера из authorize.
+    share_filter (ShareFilter) отвечает майнеру на устаревшие и повторные submit, не отправляя их в пул.
+    """
+    stats = FORWARD_STATS["to_pool"]
+    limits = limits or DEFAULT_LIMITS
+    try:
+        if buffered:
+            await _pipe_batches_to_pool(
+                miner_reader, pool_writer, alias_map, addr, fast_path, limits, stats, session, client, share_filter,
+            )
+        else:
+            await _pipe_lines_to_pool(miner_reader, pool_writer, alias_map, addr, fast_path, stats, session, client, share_filter)
+    except asyncio.TimeoutError:
+        logger.warning(f"Пул не принимает данные от {addr} дольше {limits['drain_timeout']} с, закрываем")
+    except Exception as e:
+        logger.error(f"Ошибка перенаправления к пулу для {addr}: {e}")
+    finally:
+        pool_writer.close()
+        try:
+            await pool_writer.wait_closed()
+        except ConnectionResetError:
+            logger.warning(f"Pool connection reset by peer for {addr} (safe to ignore)")
+        except Exception as e:
+            logger.error(f"Error while closing pool_writer for {addr}: {e}")
+
+async def forward_to_miner(
+    pool_reader, miner_writer, addr, buffered=False, limits=None, session=None, on_pool_eof=None, share_filter=None,
+):
+    """Пул -> майнер: строки передаются без изменений; в режиме buffered — кусками по мере поступления.
+
+    session (SessionMetrics) сопоставляет ответы пула с отправленными submit.
+    share_filter (ShareFilter) узнаёт из mining.notify, какие задания пул отменил, и отдаёт ответы
+    на отсеянные шары, отложенные до конца строки пула.
+    on_pool_eof() вызывается, когда пул закрыл соединение, до закрытия соединения с майнером.
+    """
+    stats = FORWARD_STATS["to_miner"]
+    limits = limits or DEFAULT_LIMITS
+    try:
+        if buffered:
+            apply_write_limits(miner_writer, limits)
+            while True:
+                chunk = await pool_reader.read(limits["read_chunk"])
+                if not chunk:
+                    if on_pool_eof is not None:
+                        on_pool_eof()
+                    break
+                if session is not None:
+                    session.bytes_out += len(chunk)
+                    session.match_responses(chunk)
+                if share_filter is not None:
+                    share_filter.observe(chunk)
+                    # Ответы на отсеянные шары — только за полной строкой пула, иначе они разорвут её
+                    chunk += share_filter.pending_replies()
+                await write_batch(miner_writer, chunk, chunk.count(b"\n"), limits, stats)
+        else:
+            while not pool_reader.at_eof():
+                data = await pool_reader.readline()
+                if not data:
+                    if on_pool_eof is not None:
+                        on_pool_eof()
+                    break
+                if session is not None:
+                    session.bytes_out += len(data)
+                    session.match_responses(data)
+                if share_filter is not None:
+                    share_filter.observe(data)
+                miner_writer.write(data)
+                stats["lines"] += 1
+                stats["writes"] += 1
+                stats["bytes"] += len(data)
+                await miner_writer.drain()
+    except asyncio.TimeoutError:
+        logger.warning(f"Майнер {addr} не принимает данные дольше {limits['drain_timeout']} с, закрываем")
+    except Exception as e:
+        logger.error(f"Ошибка перенаправления к майнеру для {addr}: {e}")
+    finally:
+        miner_writer.close()
+        try:
+            await miner_writer.wait_closed()
+        except ConnectionResetError:
+            logger.warning(f"Miner connection reset by peer for {addr} (safe to ignore)")
+        except Exception as e:
+            logger.error(f"Error while closing miner_writer for {addr}: {e}")
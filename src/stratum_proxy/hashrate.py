@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+# Шары складываются в корзины по BUCKET_SECONDS: память на воркера ограничена длиной самого длинного окна
+BUCKET_SECONDS = 10
+# Хэшей на единицу сложности шары (sha256d); переопределяется ключом share_multiplier у режима
+DEFAULT_SHARE_MULTIPLIER = 2 ** 32
+
+class WorkerHashrate:
+    """Скользящие окна принятой сложности одного воркера (wallet.worker) в одном режиме."""
+    __slots__ = ("buckets", "shares", "first_seen", "last_share")
+
+    def __init__(self, now):
+        self.buckets = deque()  # [номер корзины, сумма сложности]
+        self.shares = 0
+        self.first_seen = now
+        self.last_share = now
+
+    def add(self, difficulty, now, max_buckets):
+        bucket = int(now // BUCKET_SECONDS)
+        if self.buckets and self.buckets[-1][0] == bucket:
+            self.buckets[-1][1] += difficulty
+        else:
+            self.buckets.append([bucket, difficulty])
+        while self.buckets[0][0] <= bucket - max_buckets:
+            self.buckets.popleft()
+        self.shares += 1
+        self.last_share = now
+
+    def rate(self, window, now, multiplier):
+        """Хэш/с за последние window секунд; у только что подключившегося делим на фактическое время."""
+        oldest = int((now - window) // BUCKET_SECONDS) + 1
+        total = 0.0
+        for bucket, difficulty in reversed(self.buckets):
+            if bucket < oldest:
+                break
+            total += difficulty
+        elapsed = max(min(window, now - self.first_seen), BUCKET_SECONDS)
+        return total * multiplier / elapsed
+
+class HashrateTracker:
+    """Хэшрейт воркеров по принятым шарам: сумма сложности за окно * multiplier / окно."""
+
+    def __init__(self, windows=(60, 600), multipliers=None):
+        self.workers = {}  # (mode, worker) -> WorkerHashrate
+        self.configure(windows, multipliers)
+
+    def configure(self, windows, multipliers=None):
+        self.windows = tuple(sorted(windows))
+        self.multipliers = multipliers or {}
+        self.max_buckets = -(-self.windows[-1] // BUCKET_SECONDS) + 1
+
+    def add_share(self, mode, worker, difficulty):
+        now = time.monotonic()
+        entry = self.workers.get((mode, worker))
+        if entry is None:
+            entry = self.workers[(mode, worker)] = WorkerHashrate(now)
+        entry.add(difficulty, now, self.max_buckets)
+
+    def snapshot(self):
+        """{(mode, worker): {"hashrate": {окно: H/s}, "shares", "last_share_age"}}; молчащих дольше окна забываем."""
+        now = time.monotonic()
+        result = {}
+        for key, entry in list(self.workers.items()):
+            age = now - entry.last_share
+            if age > self.windows[-1]:
+                del self.workers[key]
+                continue
+            multiplier = self.multipliers.get(key[0], DEFAULT_SHARE_MULTIPLIER)
+            result[key] = {
+                "hashrate": {window: entry.rate(window, now, multiplier) for window in self.windows},
+                "shares": entry.shares,
+                "last_share_age": age,
+            }
+        return result
+
+hashrate = HashrateTracker()
+
+def merge_hashrate(snapshots):
+    """Складывает HashrateTracker.snapshot() воркер-процессов: один wallet.worker может быть в нескольких."""
+    merged = {}
+    for snapshot in snapshots:
+        for key, stats in snapshot.items():
+            target = merged.get(key)
+            if target is None:
+                merged[key] = {"hashrate": dict(stats["hashrate"]), "shares": stats["shares"], "last_share_age": stats["last_share_age"]}
+                continue
+            for window, value in stats["hashrate"].items():
+                target["hashrate"][window] = target["hashrate"].get(window, 0.0) + value
+            target["shares"] += stats["shares"]
+            target["last_share_age"] = min(target["last_share_age"], stats["last_share_age"])
+    return merged
+
+async def publish_hashrate(feed, get_snapshot, interval):
+    """Раз в interval секунд отдаёт боту хэшрейт воркеров через WorkerFeed."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            snapshot = get_snapshot()
+            if snapshot:
+                feed.publish([
+                    (mode, worker, {
+                        "hashrate": stats["hashrate"][max(stats["hashrate"])],
+                        "windows": {str(window): value for window, value in stats["hashrate"].items()},
+                        "shares": stats["shares"],
+                        "last_share_age": stats["last_share_age"],
+                    })
+                    for (mode, worker), stats in snapshot.items()
+                ])
+        except Exception as e:
+            logger.error(f"Ошибка публикации хэшрейта воркеров: {e}")
@@ -0,0 +1,306 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from .hashrate import hashrate
+
+logger = logging.getLogger(__name__)
+
+SUBMIT_MARKER = b"mining.submit"
+SET_DIFFICULTY_MARKER = b"mining.set_difficulty"
+# id запроса и результат ответа достаём регуляркой по байтам, без json.loads на каждую шару
+_ID_RE = re.compile(rb'"id"\s*:\s*("(?:[^"\\]|\\.)*"|[^,}\s]+)')
+_RESULT_TRUE_RE = re.compile(rb'"result"\s*:\s*true')
+# Верхние границы корзин гистограммы задержки submit -> result, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Сколько неотвеченных submit держим на сессию: пул, который не отвечает, не должен раздувать память
+MAX_PENDING_SUBMITS = 1024
+# submit без ответа пула дольше этого снимаются с ожидания и считаются неотвеченными
+SUBMIT_TIMEOUT = 60.0
+# Неполная строка пула длиннее этого не копится (такую строку всё равно не разберём)
+MAX_TAIL = 64 * 1024
+# Метка воркеров сверх предела max_workers: имя воркера выбирает майнер, и каждое новое стало бы рядом навсегда
+OTHER_WORKER = "other"
+
+class ProxyMetrics:
+    """Счётчики шар, гистограммы задержки по режимам и байты по воркерам для /metrics.
+
+    Свою метку получают первые max_workers пар (режим, воркер); шары и байты остальных
+    складываются под меткой OTHER_WORKER, так что число рядов ограничено.
+    """
+
+    def __init__(self, max_workers=1000):
+        self.shares = {}  # (mode, worker, "accepted"|"rejected"|"unanswered"|"stale"|"duplicate"|"low_difficulty") -> count
+        self.latency = {}  # mode -> [count по корзинам..., +Inf, sum, count]
+        self.closed_bytes = {}  # (mode, worker, "in"|"out") -> байты закрытых сессий
+        self.sessions = set()
+        self.labels = set()  # (mode, worker) со своей меткой
+        self.max_workers = max_workers
+
+    def configure(self, max_workers):
+        self.max_workers = max_workers
+
+    def worker_label(self, mode, worker):
+        """Метка воркера: его имя, пока меток меньше max_workers, иначе OTHER_WORKER."""
+        key = (mode, worker)
+        if key in self.labels:
+            return worker
+        if len(self.labels) < self.max_workers:
+            self.labels.add(key)
+            return worker
+        return OTHER_WORKER
+
+    def observe_share(self, mode, worker, latency, accepted):
+        """latency None — шару принял сам прокси (общая сессия), в гистограмму задержки она не идёт."""
+        key = (mode, self.worker_label(mode, worker), "accepted" if accepted else "rejected")
+        self.shares[key] = self.shares.get(key, 0) + 1
+        if latency is None:
+            return
+        histogram = self.latency.get(mode)
+        if histogram is None:
+            histogram = self.latency[mode] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(LATENCY_BUCKETS)] += 1
+        histogram[-2] += latency
+        histogram[-1] += 1
+
+    def observe_filtered(self, mode, worker, reason):
+        """Шара, которую прокси отклонил сам: reason — "stale", "duplicate" (share_filter) или "low_difficulty" (общая сессия)."""
+        key = (mode, self.worker_label(mode, worker), reason)
+        self.shares[key] = self.shares.get(key, 0) + 1
+
+    def observe_unanswered(self, mode, worker, count):
+        """submit, на которые пул не ответил за SUBMIT_TIMEOUT."""
+        key = (mode, self.worker_label(mode, worker), "unanswered")
+        self.shares[key] = self.shares.get(key, 0) + count
+
+    def close_session(self, session):
+        self.sessions.discard(session)
+        worker = self.worker_label(session.mode, session.worker)
+        for direction, value in (("in", session.bytes_in), ("out", session.bytes_out)):
+            key = (session.mode, worker, direction)
+            self.closed_bytes[key] = self.closed_bytes.get(key, 0) + value
+
+    def snapshot(self):
+        worker_bytes = dict(self.closed_bytes)
+        for session in self.sessions:
+            worker = self.worker_label(session.mode, session.worker)
+            for direction, value in (("in", session.bytes_in), ("out", session.bytes_out)):
+                key = (session.mode, worker, direction)
+                worker_bytes[key] = worker_bytes.get(key, 0) + value
+        return {
+            "shares": dict(self.shares),
+            "latency": {mode: list(histogram) for mode, histogram in self.latency.items()},
+            "worker_bytes": worker_bytes,
+        }
+
+metrics = ProxyMetrics()
+
+class SessionMetrics:
+    """Состояние одной сессии для метрик: неотвеченные submit, текущая сложность и байты в обе стороны."""
+    __slots__ = ("mode", "worker", "difficulty", "pending", "bytes_in", "bytes_out", "accepted", "rejected", "unanswered", "_tail")
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.worker = "unknown"
+        self.difficulty = 1.0
+        self.pending = {}  # id запроса -> (perf_counter() отправки, сложность на момент отправки)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.unanswered = 0
+        self._tail = b""
+        metrics.sessions.add(self)
+
+    def track_submits(self, data):
+        """data — одна или несколько полных строк майнера."""
+        if SUBMIT_MARKER not in data:
+            return
+        now = time.perf_counter()
+        self._expire(now)
+        for line in data.split(b"\n"):
+            if SUBMIT_MARKER in line and len(self.pending) < MAX_PENDING_SUBMITS:
+                match = _ID_RE.search(line)
+                if match:
+                    self.pending[match.group(1)] = (now, self.difficulty)
+
+    def match_responses(self, chunk):
+        """chunk — данные пула в произвольных границах; неполная строка доживает до следующего куска."""
+        data = self._tail + chunk if self._tail else chunk
+        end = data.rfind(b"\n") + 1
+        self._tail = data[end:] if len(data) - end <= MAX_TAIL else b""
+        if not self.pending and SET_DIFFICULTY_MARKER not in data:
+            return
+        now = time.perf_counter()
+        self._expire(now)
+        for line in data[:end].split(b"\n"):
+            if SET_DIFFICULTY_MARKER in line:
+                self._set_difficulty(line)
+                continue
+            match = _ID_RE.search(line)
+            if match is None:
+                continue
+            sent = self.pending.pop(match.group(1), None)
+            if sent is None:
+                continue
+            accepted = _RESULT_TRUE_RE.search(line) is not None
+            metrics.observe_share(self.mode, self.worker, now - sent[0], accepted)
+            if accepted:
+                self.accepted += 1
+                hashrate.add_share(self.mode, self.worker, sent[1])
+            else:
+                self.rejected += 1
+
+    def _expire(self, now):
+        """Снимает с ожидания submit старше SUBMIT_TIMEOUT и считает их неотвеченными.
+
+        Иначе пул, не ответивший на MAX_PENDING_SUBMITS шар, навсегда выключил бы учёт шар сессии.
+        pending идёт в порядке отправки: старые — в начале словаря.
+        """
+        expired = 0
+        while self.pending:
+            key, (sent, _) = next(iter(self.pending.items()))
+            if now - sent < SUBMIT_TIMEOUT:
+                break
+            del self.pending[key]
+            expired += 1
+        if expired:
+            self.unanswered += expired
+            metrics.observe_unanswered(self.mode, self.worker, expired)
+
+    def accept_local(self):
+        """Шара ниже сложности пула, но не ниже сложности майнера: её принял прокси, в пул она не уходила."""
+        metrics.observe_share(self.mode, self.worker, None, True)
+        self.accepted += 1
+        hashrate.add_share(self.mode, self.worker, self.difficulty)
+
+    def _set_difficulty(self, line):
+        # set_difficulty приходит редко (vardiff), здесь можно позволить json.loads
+        try:
+            self.difficulty = float(json.loads(line)["params"][0])
+        except (ValueError, KeyError, IndexError, TypeError):
+            logger.debug(f"Не удалось разобрать mining.set_difficulty: {line[:200]!r}")
+
+    def close(self):
+        metrics.close_session(self)
+
+def merge_metrics(snapshots):
+    """Складывает ProxyMetrics.snapshot() нескольких процессов (воркеров супервизора)."""
+    merged = {"shares": {}, "latency": {}, "worker_bytes": {}}
+    for snapshot in snapshots:
+        for section in ("shares", "worker_bytes"):
+            for key, value in snapshot.get(section, {}).items():
+                merged[section][key] = merged[section].get(key, 0) + value
+        for mode, histogram in snapshot.get("latency", {}).items():
+            target = merged["latency"].get(mode)
+            if target is None:
+                merged["latency"][mode] = list(histogram)
+            else:
+                merged["latency"][mode] = [a + b for a, b in zip(target, histogram)]
+    return merged
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_prometheus(stats):
+    """Текстовый формат Prometheus из proxy.stats_snapshot() или supervisor.combined_stats()."""
+    lines = [
+        "# TYPE stratum_proxy_connections gauge",
+        f"stratum_proxy_connections {stats['connections']}",
+    ]
+    if "workers" in stats:
+        lines += ["# TYPE stratum_proxy_workers gauge", f"stratum_proxy_workers {stats['workers']}"]
+    for name in ("lines", "writes", "bytes", "drains"):
+        lines.append(f"# TYPE stratum_proxy_forward_{name}_total counter")
+        for direction, counters in stats["forward"].items():
+            lines.append(f'stratum_proxy_forward_{name}_total{{direction="{direction}"}} {counters.get(name, 0)}')
+    lines.append("# TYPE stratum_proxy_upstream_pool_total counter")
+    for result, value in stats["upstream_pool"].items():
+        lines.append(f'stratum_proxy_upstream_pool_total{{result="{result}"}} {value}')
+    lines.append("# TYPE stratum_proxy_log_records_total counter")
+    for result, value in stats.get("logging", {}).items():
+        lines.append(f'stratum_proxy_log_records_total{{result="{result}"}} {value}')
+    lines.append("# TYPE stratum_proxy_connections_closed_total counter")
+    for reason, value in stats.get("clients", {}).items():
+        lines.append(f'stratum_proxy_connections_closed_total{{reason="{reason}"}} {value}')
+    admission = stats.get("admission")
+    if admission:
+        lines.append("# TYPE stratum_proxy_admission_queue_depth gauge")
+        lines.append(f"stratum_proxy_admission_queue_depth {admission['waiting']}")
+        lines.append("# TYPE stratum_proxy_admission_handshakes gauge")
+        lines.append(f"stratum_proxy_admission_handshakes {admission['in_progress']}")
+        lines.append("# TYPE stratum_proxy_admission_total counter")
+        for result, value in admission["counters"].items():
+            lines.append(f'stratum_proxy_admission_total{{result="{result}"}} {value}')
+        lines.append("# TYPE stratum_proxy_admission_wait_seconds summary")
+        lines.append(f"stratum_proxy_admission_wait_seconds_sum {admission['wait_total']:.6f}")
+        lines.append(f"stratum_proxy_admission_wait_seconds_count {admission['counters'].get('admitted', 0)}")
+        lines.append("# TYPE stratum_proxy_admission_wait_seconds_max gauge")
+        lines.append(f"stratum_proxy_admission_wait_seconds_max {admission['wait_max']:.6f}")
+    aggregate = stats.get("aggregate", {})
+    lines.append("# TYPE stratum_proxy_aggregate_upstreams gauge")
+    lines.append(f"stratum_proxy_aggregate_upstreams {aggregate.get('upstreams', 0)}")
+    lines.append("# TYPE stratum_proxy_aggregate_miners gauge")
+    lines.append(f"stratum_proxy_aggregate_miners {aggregate.get('miners', 0)}")
+    upstreams = sorted(stats.get("upstreams", {}).items())
+    lines.append("# TYPE stratum_proxy_upstream_up gauge")
+    for endpoint, state in upstreams:
+        lines.append(f'stratum_proxy_upstream_up{{mode="{_label(state["mode"])}",endpoint="{endpoint}"}} {int(state["alive"])}')
+    lines.append("# TYPE stratum_proxy_upstream_probe_seconds gauge")
+    for endpoint, state in upstreams:
+        if state["latency"] is not None:
+            lines.append(f'stratum_proxy_upstream_probe_seconds{{mode="{_label(state["mode"])}",endpoint="{endpoint}"}} {state["latency"]:.6f}')
+
+    share_metrics = stats.get("metrics", {})
+    lines.append("# TYPE stratum_proxy_shares_total counter")
+    for (mode, worker, result), value in sorted(share_metrics.get("shares", {}).items()):
+        lines.append(f'stratum_proxy_shares_total{{mode="{_label(mode)}",worker="{_label(worker)}",result="{result}"}} {value}')
+    lines.append("# TYPE stratum_proxy_share_latency_seconds histogram")
+    for mode, histogram in sorted(share_metrics.get("latency", {}).items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram):
+            cumulative += count
+            lines.append(f'stratum_proxy_share_latency_seconds_bucket{{mode="{_label(mode)}",le="{bound}"}} {cumulative}')
+        lines.append(f'stratum_proxy_share_latency_seconds_sum{{mode="{_label(mode)}"}} {histogram[-2]:.6f}')
+        lines.append(f'stratum_proxy_share_latency_seconds_count{{mode="{_label(mode)}"}} {histogram[-1]}')
+    lines.append("# TYPE stratum_proxy_worker_bytes_total counter")
+    for (mode, worker, direction), value in sorted(share_metrics.get("worker_bytes", {}).items()):
+        lines.append(f'stratum_proxy_worker_bytes_total{{mode="{_label(mode)}",worker="{_label(worker)}",direction="{direction}"}} {value}')
+    lines.append("# TYPE stratum_proxy_worker_hashrate gauge")
+    for (mode, worker), entry in sorted(stats.get("hashrate", {}).items()):
+        for window, value in sorted(entry["hashrate"].items()):
+            lines.append(f'stratum_proxy_worker_hashrate{{mode="{_label(mode)}",worker="{_label(worker)}",window="{window}"}} {value:.0f}')
+    return "\n".join(lines) + "\n"
+
+async def serve_metrics(host, port, get_stats):
+    """Минимальный HTTP-сервер: GET /metrics отдаёт render_prometheus(get_stats())."""
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", render_prometheus(get_stats()).encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка обработки запроса метрик: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Метрики Prometheus: http://{host}:{port}/metrics")
+    return server
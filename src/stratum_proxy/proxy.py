@@ -1,159 +1,593 @@
 import asyncio
-import json
 import logging
+import os
 import signal
-from .config import load_config, get_current_mode
+import time
+from ..log_queue import LOG_STATS
+from ..proxy_admin import serve_admin
+from .admission import AdmissionControl
+from .aggregator import Aggregator
+from .clients import ClientRegistry, ClientState, expired_clients, set_keepalive
+from .config import ADMIN_SOCKET_PATH, load_config, get_current_mode, mode_state, watch_config, worker_feed
+from .forwarding import DEFAULT_LIMITS, FORWARD_STATS, PrefetchedReader, forward_to_pool, forward_to_miner
+from .hashrate import hashrate, publish_hashrate
+from .metrics import SessionMetrics, metrics, serve_metrics
+from .routing import LiveAliases, compile_routes, diff_routes
+from .share_filter import ShareFilter
+from .upstream_health import UpstreamHealth
+from .upstream_pool import UpstreamPool
 from .utils import setup_logging
 
 logger = logging.getLogger(__name__)
 CONFIG = load_config()
-active_clients = set()
-conport = 3310
+# Скомпилированные режимы; при перезагрузке config.json заменяется целиком одним присваиванием
+routes = compile_routes(CONFIG)
+# task -> ClientState с индексами по id, воркеру и alias: режим сессии, writer майнера, эндпоинт пула
+active_clients = ClientRegistry()
+# Сессии, закрытые прокси: rejected — сверх max_connections, login/idle — по таймаутам молчания
+CLIENT_STATS = {"rejected": 0, "login": 0, "idle": 0}
+PROXY_SETTINGS = CONFIG.get("proxy", {})
+conport = PROXY_SETTINGS.get("port", 3310)
+# Быстрый путь: в пул без разбора JSON уходят все строки, кроме mining.authorize
+FAST_PATH = PROXY_SETTINGS.get("fast_path", True)
+# Буферизованная пересылка: готовые строки уходят одним write, отметки буфера по направлениям
+BUFFERED_FORWARDING = PROXY_SETTINGS.get("buffered_forwarding", True)
+TO_POOL_LIMITS = {**DEFAULT_LIMITS, **PROXY_SETTINGS.get("to_pool_limits", {})}
+TO_MINER_LIMITS = {**DEFAULT_LIMITS, **PROXY_SETTINGS.get("to_miner_limits", {})}
+# Предел соединений майнеров на процесс: сверх него новое подключение сразу закрывается
+MAX_CONNECTIONS = PROXY_SETTINGS.get("max_connections", 20000)
+# Закрываем майнера, который ничего не прислал за login_timeout после подключения или молчит дольше idle_timeout
+LOGIN_TIMEOUT = PROXY_SETTINGS.get("login_timeout", 30.0)
+IDLE_TIMEOUT = PROXY_SETTINGS.get("idle_timeout", 900.0)
+CLIENT_SWEEP_INTERVAL = 5.0
+# TCP keepalive на сокетах майнеров (секунды до первой пробы, между пробами, число проб); null — выключен
+TCP_KEEPALIVE = PROXY_SETTINGS.get("tcp_keepalive", {"idle": 60, "interval": 15, "count": 4})
+# Резерв заранее открытых соединений к пулу активного режима (0 — отключить)
+UPSTREAM_POOL_SIZE = PROXY_SETTINGS.get("upstream_pool_size", 4)
+UPSTREAM_POOL_MAX_IDLE = PROXY_SETTINGS.get("upstream_pool_max_idle", 30)
+upstream_pool = None
+# Пробы пулов активного режима (TCP-подключение) и переключение на следующий из upstreams
+UPSTREAM_PROBE_INTERVAL = PROXY_SETTINGS.get("upstream_probe_interval", 10.0)
+UPSTREAM_PROBE_TIMEOUT = PROXY_SETTINGS.get("upstream_probe_timeout", 3.0)
+UPSTREAM_FAIL_THRESHOLD = PROXY_SETTINGS.get("upstream_fail_threshold", 2)
+UPSTREAM_CONNECT_TIMEOUT = PROXY_SETTINGS.get("upstream_connect_timeout", 5.0)
+upstream_health = None
+# Переводы сессий при смене состояния пулов: ссылки держат задачи до конца, замок не даёт двум идти одновременно
+upstream_change_tasks = set()
+upstream_change_lock = asyncio.Lock()
+# Допуск новых сессий: не больше ADMISSION_MAX_HANDSHAKES одновременных рукопожатий с пулом, остальные в очереди
+ADMISSION_MAX_HANDSHAKES = PROXY_SETTINGS.get("admission_max_handshakes", 64)
+ADMISSION_QUEUE_SIZE = PROXY_SETTINGS.get("admission_queue_size", 5000)
+ADMISSION_QUEUE_TIMEOUT = PROXY_SETTINGS.get("admission_queue_timeout", 30.0)
+ADMISSION_JITTER = PROXY_SETTINGS.get("admission_jitter", 0.05)
+# Лимит подключений с одного IP в секунду (0 — без лимита) и запас на всплеск
+ADMISSION_IP_RATE = PROXY_SETTINGS.get("admission_ip_rate", 0)
+ADMISSION_IP_BURST = PROXY_SETTINGS.get("admission_ip_burst", 20)
+admission = AdmissionControl(
+    max_handshakes=ADMISSION_MAX_HANDSHAKES, max_queue=ADMISSION_QUEUE_SIZE, queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    jitter=ADMISSION_JITTER, ip_rate=ADMISSION_IP_RATE, ip_burst=ADMISSION_IP_BURST,
+)
+# Плавное переключение режима: слушатель остаётся на conport, старые сессии переводятся пачками
+GRACEFUL_SWITCH = PROXY_SETTINGS.get("graceful_switch", True)
+SWITCH_BATCH_SIZE = PROXY_SETTINGS.get("switch_batch_size", 50)
+SWITCH_BATCH_INTERVAL = PROXY_SETTINGS.get("switch_batch_interval", 1.0)
+SWITCH_DRAIN_TIMEOUT = PROXY_SETTINGS.get("switch_drain_timeout", 30.0)
+RECONNECT_MESSAGE = b'{"id": null, "method": "client.reconnect", "params": []}\n'
+migration_task = None
+# Смена режима приходит событием (in-memory или через unix-сокет); опрос файла — только страховка
+MODE_POLL_INTERVAL = PROXY_SETTINGS.get("mode_poll_interval", 30.0)
+# >1 — супервизор с воркер-процессами, каждый слушает conport через SO_REUSEPORT
+WORKERS = PROXY_SETTINGS.get("workers", 1)
+# Задержка submit -> result и шары по воркерам; /metrics на METRICS_HOST:METRICS_PORT (null — выключено)
+SHARE_METRICS = PROXY_SETTINGS.get("share_metrics", True)
+# Отвечать майнеру самим на submit по заданиям, отменённым clean_jobs, и на повторные submit (ошибки 21/22)
+SHARE_FILTER = PROXY_SETTINGS.get("share_filter", True)
+METRICS_HOST = PROXY_SETTINGS.get("metrics_host", "127.0.0.1")
+METRICS_PORT = PROXY_SETTINGS.get("metrics_port", 9310)
+# Сколько воркеров получают свою метку в /metrics; остальные считаются под меткой "other"
+METRICS_MAX_WORKERS = PROXY_SETTINGS.get("metrics_max_workers", 1000)
+metrics.configure(METRICS_MAX_WORKERS)
+# Хэшрейт воркеров по принятым шарам (нужен share_metrics); боту уходит раз в HASHRATE_PUBLISH_INTERVAL
+HASHRATE_WINDOWS = PROXY_SETTINGS.get("hashrate_windows", [60, 600])
+HASHRATE_PUBLISH_INTERVAL = PROXY_SETTINGS.get("hashrate_publish_interval", 30)
+# Admin API на unix-сокете ADMIN_SOCKET_PATH: список сессий, отключение и client.reconnect по фильтру
+ADMIN_API = PROXY_SETTINGS.get("admin_api", True)
+ADMIN_LIST_LIMIT = PROXY_SETTINGS.get("admin_list_limit", 1000)
+ADMIN_FILTERS = ("id", "worker", "alias", "mode", "upstream")
+# Как часто проверять config.json (0 — не следить); SIGHUP перечитывает сразу
+CONFIG_RELOAD_INTERVAL = PROXY_SETTINGS.get("config_reload_interval", 5.0)
+config_reload_requested = asyncio.Event()
+# Перестройка пулов после перезагрузки: одна задача за раз, следующая ждёт предыдущую
+reroute_task = None
+
+def share_multipliers(table):
+    return {mode: route.share_multiplier for mode, route in table.modes.items() if route.share_multiplier is not None}
+
+hashrate.configure(HASHRATE_WINDOWS, share_multipliers(routes))
+# Логи через ограниченную очередь и поток записи; с одной строки кода не больше LOG_REPEAT_BURST за LOG_REPEAT_INTERVAL
+LOG_QUEUE_SIZE = PROXY_SETTINGS.get("log_queue_size", 10000)
+LOG_REPEAT_BURST = PROXY_SETTINGS.get("log_repeat_burst", 20)
+LOG_REPEAT_INTERVAL = PROXY_SETTINGS.get("log_repeat_interval", 10.0)
+# Общие сессии к пулу: майнеры одного кошелька делят одно соединение, extranonce2 делится на слоты.
+# Пул видит один воркер на кошелёк, статистика ригов есть только у прокси: без share_metrics и сводки
+# боту (hashrate_publish_interval) общие сессии не включаются
+AGGREGATE_REQUESTED = PROXY_SETTINGS.get("aggregate", False)
+AGGREGATE = bool(AGGREGATE_REQUESTED and SHARE_METRICS and HASHRATE_PUBLISH_INTERVAL)
+AGGREGATE_PREFIX_BYTES = PROXY_SETTINGS.get("aggregate_prefix_bytes", 1)
+AGGREGATE_MAX_MINERS = PROXY_SETTINGS.get("aggregate_max_miners", 256)
+AGGREGATE_WORKER = PROXY_SETTINGS.get("aggregate_worker", "proxy")
+AGGREGATE_IDLE = PROXY_SETTINGS.get("aggregate_idle", 60.0)
+AGGREGATE_PEEK_TIMEOUT = PROXY_SETTINGS.get("aggregate_peek_timeout", 0.5)
+# Своя сложность каждого майнера общей сессии (sha256d): секунд на шару для vardiff (0 — всем сложность пула) и нижний предел
+AGGREGATE_SHARE_INTERVAL = PROXY_SETTINGS.get("aggregate_share_interval", 10.0)
+AGGREGATE_MIN_DIFFICULTY = PROXY_SETTINGS.get("aggregate_min_difficulty", 1.0)
+aggregator = None
+
+async def rebuild_upstream_pool(mode):
+    """Перезапускает пробы пулов и резерв соединений под режим mode."""
+    global upstream_health
+    if upstream_health is not None:
+        await upstream_health.close()
+        upstream_health = None
+    route = routes.get(mode)
+    endpoints = list(route.endpoints) if route else []
+    if endpoints and mode != "сон" and UPSTREAM_PROBE_INTERVAL:
+        upstream_health = UpstreamHealth(
+            mode, endpoints, interval=UPSTREAM_PROBE_INTERVAL, timeout=UPSTREAM_PROBE_TIMEOUT,
+            fail_threshold=UPSTREAM_FAIL_THRESHOLD, on_change=on_upstream_change,
+        ).start()
+    await restart_upstream_pool(mode, upstream_endpoints(mode)[:1])
+
+async def restart_upstream_pool(mode, endpoints):
+    """Закрывает резерв соединений и прогревает новый к первому из endpoints."""
+    global upstream_pool
+    if upstream_pool is not None:
+        await upstream_pool.close()
+        upstream_pool = None
+    if not endpoints or UPSTREAM_POOL_SIZE <= 0:
+        return
+    host, port = endpoints[0]
+    upstream_pool = UpstreamPool(
+        mode, host, port, size=UPSTREAM_POOL_SIZE, max_idle=UPSTREAM_POOL_MAX_IDLE, limit=TO_MINER_LIMITS["max_line"],
+    ).start()
+    logger.info(f"Прогреваем {UPSTREAM_POOL_SIZE} соединений к пулу {host}:{port} для режима '{mode}'")
+
+async def connect_upstream(mode, addr):
+    """Соединение к пулу режима mode: эндпоинты по порядку, не подключились к одному — сразу следующий.
+
+    Возвращает (reader, writer, (host, port)); ConnectionError, если не ответил ни один.
+    """
+    health = upstream_health if upstream_health is not None and upstream_health.mode == mode else None
+    for host, port in upstream_endpoints(mode):
+        try:
+            if upstream_pool is not None and upstream_pool.mode == mode and (upstream_pool.host, upstream_pool.port) == (host, port):
+                reader, writer = await asyncio.wait_for(upstream_pool.acquire(), UPSTREAM_CONNECT_TIMEOUT)
+            else:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port, limit=TO_MINER_LIMITS["max_line"]), UPSTREAM_CONNECT_TIMEOUT,
+                )
+            logger.info("Подключился к пулу %s:%s для %s", host, port, addr)
+            return reader, writer, (host, port)
+        except Exception as e:
+            logger.error(f"Не удалось подключиться к пулу {host}:{port} для {addr}: {e or type(e).__name__}")
+            if health is not None:
+                for endpoint in health.endpoints:
+                    if endpoint.key == (host, port):
+                        health.mark_failure(endpoint, e, immediate=True)
+    raise ConnectionError(f"ни один пул режима '{mode}' не доступен")
+
+def get_aggregator():
+    global aggregator
+    if aggregator is None:
+        aggregator = Aggregator(
+            lambda mode: connect_upstream(mode, "общей сессии"),
+            prefix_bytes=AGGREGATE_PREFIX_BYTES, max_miners=AGGREGATE_MAX_MINERS, worker_name=AGGREGATE_WORKER,
+            idle_timeout=AGGREGATE_IDLE, connect_timeout=UPSTREAM_CONNECT_TIMEOUT, max_buffered=TO_MINER_LIMITS["max_buffered"],
+            admission=admission, share_filter=SHARE_FILTER, share_interval=AGGREGATE_SHARE_INTERVAL,
+            min_difficulty=AGGREGATE_MIN_DIFFICULTY, algorithm=mode_algorithm,
+        )
+    return aggregator
+
+def upstream_endpoints(mode):
+    """(host, port) режима в порядке попыток подключения: по здоровью, если пробы идут, иначе по конфигу."""
+    if upstream_health is not None and upstream_health.mode == mode:
+        return [endpoint.key for endpoint in upstream_health.candidates()]
+    route = routes.get(mode)
+    return list(route.endpoints) if route else []
+
+def current_routes():
+    return routes
+
+def mode_algorithm(mode):
+    route = routes.get(mode)
+    return route.algorithm if route else None
+
+def apply_config(config):
+    """Подменяет таблицу маршрутов новой конфигурацией без перезапуска слушателя.
+
+    Новые alias действуют со следующего mining.authorize, в том числе в уже открытых сессиях.
+    Если у активного режима сменились эндпоинты, пробы и резерв соединений перестраиваются,
+    а сессии на убранных эндпоинтах переводятся через client.reconnect.
+    """
+    global CONFIG, routes, reroute_task
+    new_routes = compile_routes(config, routes.version + 1)
+    added, removed, changed = diff_routes(routes, new_routes)
+    old_routes = routes
+    CONFIG, routes = config, new_routes
+    hashrate.configure(HASHRATE_WINDOWS, share_multipliers(routes))
+    logger.info(
+        f"Конфигурация перезагружена (версия {routes.version}): "
+        f"добавлены {added or '-'}, удалены {removed or '-'}, изменены {changed or '-'}"
+    )
+    if config.get("proxy", {}) != PROXY_SETTINGS:
+        logger.warning("Изменения секции 'proxy' вступят в силу после перезапуска прокси")
+    mode = get_current_mode()
+    old_route, new_route = old_routes.get(mode), routes.get(mode)
+    if (old_route.endpoints if old_route else ()) != (new_route.endpoints if new_route else ()):
+        reroute_task = asyncio.get_running_loop().create_task(reroute_mode(mode, reroute_task))
+
+async def reroute_mode(mode, previous=None):
+    """Эндпоинты активного режима изменились: новый резерв соединений и перевод сессий с убранных.
+
+    previous — перестройка после предыдущей перезагрузки: сначала она доходит до конца.
+    """
+    if previous is not None:
+        await asyncio.gather(previous, return_exceptions=True)
+    await rebuild_upstream_pool(mode)
+    endpoints = set(upstream_endpoints(mode))
+    stale = [task for task, client in active_clients.items() if client.mode == mode and client.upstream not in endpoints]
+    if stale:
+        await migrate_sessions(stale, mode_accepts_connections(mode), f"эндпоинты режима '{mode}' изменились")
+
+def on_upstream_change(endpoint):
+    task = asyncio.create_task(handle_upstream_change(upstream_health, endpoint))
+    upstream_change_tasks.add(task)
+    task.add_done_callback(upstream_change_tasks.discard)
+
+async def handle_upstream_change(health, endpoint):
+    """Пул стал (не)доступен: резерв соединений — к лучшему эндпоинту, сессии с мёртвого — на живые."""
+    async with upstream_change_lock:
+        if health is not upstream_health:
+            return  # режим уже сменился
+        # Лучший эндпоинт — на момент перевода: пока ждали замок, состояние могло смениться ещё раз
+        preferred = health.preferred()
+        if UPSTREAM_POOL_SIZE > 0 and (upstream_pool is None or (upstream_pool.host, upstream_pool.port) != preferred.key):
+            await restart_upstream_pool(health.mode, [preferred.key])
+        if not preferred.alive:
+            return  # переводить некуда, сессии остаются на месте
+        # Сессии на мёртвых эндпоинтах: и этого, и тех, что умерли, пока живых не было вовсе
+        dead = {e.key for e in health.endpoints if not e.alive}
+        stranded = [
+            task for task, client in active_clients.items()
+            if client.mode == health.mode and client.upstream in dead
+        ]
+        if stranded:
+            await migrate_sessions(stranded, True, f"пул недоступен, переводим на {preferred.host}:{preferred.port}")
+
+def mode_accepts_connections(mode):
+    route = routes.get(mode)
+    return mode != "сон" and route is not None and bool(route.endpoints)
+
+async def migrate_clients(new_mode):
+    """Переводит сессии старых режимов в new_mode пачками по SWITCH_BATCH_SIZE.
+
+    Если новый режим принимает подключения, майнеру отправляется client.reconnect и он сам
+    переподключается к прокси (уже в новый режим); иначе сессия закрывается. Сессии, не ушедшие
+    за SWITCH_DRAIN_TIMEOUT после последней пачки, закрываются принудительно.
+    """
+    reconnect = mode_accepts_connections(new_mode)
+    stale = [task for task, client in active_clients.items() if client.mode != new_mode]
+    if stale:
+        await migrate_sessions(stale, reconnect, f"переводим в режим '{new_mode}'")
+
+async def migrate_sessions(stale, reconnect, reason):
+    """client.reconnect (или закрытие) сессиям stale пачками; не ушедшие за SWITCH_DRAIN_TIMEOUT закрываются."""
+    logger.info(
+        f"{len(stale)} сессий: {reason}, пачками по {SWITCH_BATCH_SIZE} "
+        f"({'client.reconnect' if reconnect else 'закрытие'})"
+    )
+    for i in range(0, len(stale), SWITCH_BATCH_SIZE):
+        for task in stale[i:i + SWITCH_BATCH_SIZE]:
+            client = active_clients.get(task)
+            if client is None:
+                continue
+            if reconnect:
+                try:
+                    client.writer.write(RECONNECT_MESSAGE)
+                except Exception as e:
+                    logger.warning(f"Не удалось отправить client.reconnect майнеру {client.addr}: {e}")
+                    task.cancel()
+            else:
+                task.cancel()
+        await asyncio.sleep(SWITCH_BATCH_INTERVAL)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SWITCH_DRAIN_TIMEOUT
+    while loop.time() < deadline:
+        if not any(task in active_clients for task in stale):
+            logger.info(f"Все {len(stale)} сессий переведены: {reason}")
+            return
+        await asyncio.sleep(min(1.0, max(0.0, deadline - loop.time())))
+    remaining = [task for task in stale if task in active_clients]
+    if remaining:
+        logger.info(f"Закрываем {len(remaining)} сессий, не переподключившихся за {SWITCH_DRAIN_TIMEOUT} с")
+        for task in remaining:
+            task.cancel()
+
+def stats_snapshot():
+    """Счётчики этого процесса; супервизор складывает их по всем воркерам."""
+    return {
+        "pid": os.getpid(),
+        "connections": len(active_clients),
+        "clients": dict(CLIENT_STATS),
+        "forward": {direction: dict(counters) for direction, counters in FORWARD_STATS.items()},
+        "upstream_pool": {
+            "hits": upstream_pool.hits if upstream_pool else 0,
+            "misses": upstream_pool.misses if upstream_pool else 0,
+        },
+        "metrics": metrics.snapshot(),
+        "hashrate": hashrate.snapshot(),
+        "upstreams": upstream_health.snapshot() if upstream_health else {},
+        "aggregate": aggregator.stats() if aggregator else {"upstreams": 0, "miners": 0},
+        "logging": dict(LOG_STATS),
+        "admission": admission.snapshot(),
+    }
+
+def admin_limit(request):
+    """limit из запроса admin API: целое не меньше 0, без него (или null) — ADMIN_LIST_LIMIT. ValueError — если не такое."""
+    raw = request.get("limit")
+    if raw is None:
+        return ADMIN_LIST_LIMIT
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"limit должен быть целым числом, а не {raw!r}") from None
+    if limit < 0:
+        raise ValueError("limit не может быть отрицательным")
+    return limit
+
+def admin_command(request):
+    """Команда admin API по сессиям этого процесса.
+
+    sessions — список сессий под фильтры (ADMIN_FILTERS) не длиннее limit и их общее число;
+    disconnect — закрыть сессии, reconnect — отправить им client.reconnect. Для disconnect и
+    reconnect нужен хотя бы один фильтр или "all": true.
+    """
+    command = request.get("command", "sessions")
+    filters = {key: request[key] for key in ADMIN_FILTERS if request.get(key) is not None}
+    found = active_clients.find(**filters)
+    if command == "sessions":
+        limit = admin_limit(request)
+        now = time.monotonic()
+        return {"total": len(found), "sessions": [client.describe(now) for client in found[:limit]]}
+    if command not in ("disconnect", "reconnect"):
+        raise ValueError(f"неизвестная команда '{command}'")
+    if not filters and not request.get("all"):
+        raise ValueError(f"для {command} нужен фильтр ({', '.join(ADMIN_FILTERS)}) или \"all\": true")
+    for client in found:
+        if command == "reconnect" and not client.writer.is_closing():
+            client.writer.write(RECONNECT_MESSAGE)
+        else:
+            # Как при закрытии по таймауту: сессия завершается обычным путём, как при уходе майнера
+            client.writer.transport.abort()
+    if found:
+        logger.info(f"Admin API: {command} для {len(found)} сессий ({filters or 'все'})")
+    return {"matched": len(found)}
+
+async def handle_admin(request):
+    return admin_command(request)
+
+async def start_listener(current_mode, reuse_port=False):
+    server = await asyncio.start_server(
+        lambda r, w: handle_client(r, w, current_mode[0]), '0.0.0.0', conport, reuse_port=reuse_port,
+        limit=TO_POOL_LIMITS["max_line"],
+    )
+    addr = server.sockets[0].getsockname()
+    logger.info(f"Слушаем на {addr} в режиме '{current_mode[0]}'")
+    return asyncio.create_task(server.serve_forever())
 
 async def handle_client(miner_reader, miner_writer, current_mode):
     addr = miner_writer.get_extra_info('peername')
+    if len(active_clients) >= MAX_CONNECTIONS:
+        # Сверх предела не заводим сессию вовсе: ни записи в active_clients, ни соединения к пулу
+        CLIENT_STATS["rejected"] += 1
+        logger.warning("Достигнут предел %s соединений, закрываю %s", MAX_CONNECTIONS, addr)
+        miner_writer.transport.abort()
+        return
     client_task = asyncio.current_task()
-    active_clients.add(client_task)
-    logger.info(f"Подключен майнер: {addr}, режим={current_mode}")
+    client = active_clients.add(client_task, ClientState(current_mode, addr, miner_writer))
+    logger.info("Подключен майнер: %s, режим=%s", addr, current_mode)
 
-    modes = CONFIG.get("modes", {})
-    mode_info = modes.get(current_mode)
-
-    if not mode_info:
+    if not admission.allow_ip(addr[0]):
+        logger.warning("Слишком частые подключения с %s, закрываю %s", addr[0], addr)
+        miner_writer.close()
+        active_clients.remove(client_task)
+        return
+    if routes.get(current_mode) is None:
         logger.warning(f"Режим '{current_mode}' не найден в конфигурации. Закрываю.")
         miner_writer.close()
         await miner_writer.wait_closed()
-        active_clients.discard(client_task)
+        active_clients.remove(client_task)
         return
-    if mode_info.get("port") is None:
+    if not upstream_endpoints(current_mode):
         logger.warning(f"Режим '{current_mode}' не принимает подключения (port is None). Закрываю.")
         miner_writer.close()
         await miner_writer.wait_closed()
-        active_clients.discard(client_task)
+        active_clients.remove(client_task)
         return
+    if TCP_KEEPALIVE:
+        set_keepalive(miner_writer, TCP_KEEPALIVE)
 
-    host = mode_info.get("host", "127.0.0.1")
-    port = mode_info["port"]
-    logger.info(f"Режим '{current_mode}' использует {host}:{port}")
+    # alias берутся из текущей таблицы маршрутов на каждом authorize: перезагрузка конфига видна и этой сессии
+    alias_map = LiveAliases(current_mode, current_routes)
+    # Кошелёк виден в первых строках или известен по IP — майнер идёт в общую сессию кошелька
+    wallet, lines = None, []
+    if AGGREGATE:
+        try:
+            lines, wallet = await get_aggregator().peek_wallet(miner_reader, alias_map, AGGREGATE_PEEK_TIMEOUT)
+        except ValueError as e:
+            logger.warning("Строка от майнера %s длиннее предела: %s", addr, e)
+            miner_writer.close()
+            active_clients.remove(client_task)
+            return
+        if lines:
+            client.touch()
+        if wallet is None:
+            wallet = aggregator.wallet_for(addr[0])
+    if wallet is not None:
+        session = client.session = SessionMetrics(current_mode) if SHARE_METRICS else None
+        client.aggregated = True
+        try:
+            await aggregator.serve(
+                miner_reader, miner_writer, addr, current_mode, wallet, alias_map, session, client, lines=lines,
+            )
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            logger.error(f"Нет общей сессии к пулу для {addr}: {e or type(e).__name__}")
+            miner_writer.close()
+        finally:
+            logger.info("Соединение закрыто для %s", addr)
+            active_clients.remove(client_task)
+            if session is not None:
+                session.close()
+        return
 
+    if not lines:
+        # Слот рукопожатия берём, когда майнер уже что-то прислал: молчащее подключение его не занимает
+        try:
+            first_line = await miner_reader.readline()
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Не удалось прочитать первую строку майнера %s: %s", addr, e)
+            first_line = b""
+        if not first_line:
+            miner_writer.close()
+            active_clients.remove(client_task)
+            return
+        client.touch()
+        lines = [first_line]
     try:
-        pool_reader, pool_writer = await asyncio.open_connection(host, port)
-        logger.info(f"Подключился к пулу {host}:{port} для {addr}")
-    except Exception as e:
-        logger.error(f"Не удалось подключиться к пулу {host}:{port} для {addr}: {e}")
+        release_slot = await admission.acquire()
+    except ConnectionError as e:
+        logger.warning("Майнер %s не допущен: %s", addr, e)
+        miner_writer.close()
+        active_clients.remove(client_task)
+        return
+    try:
+        pool_reader, pool_writer, (host, port) = await connect_upstream(current_mode, addr)
+    except ConnectionError:
         miner_writer.close()
         await miner_writer.wait_closed()
-        active_clients.discard(client_task)
+        active_clients.remove(client_task)
         return
+    finally:
+        # Рукопожатие — подключение к пулу: прочитанные строки майнера уйдут в пул первыми, сразу за ним
+        release_slot()
+    client.upstream = (host, port)
+    # Строки, прочитанные до подключения, проходят через forward_to_pool вместе с остальными (alias, share_filter)
+    miner_reader = PrefetchedReader(b"".join(lines), miner_reader)
 
-    async def forward_to_pool():
-        try:
-            while not miner_reader.at_eof():
-                data = await miner_reader.readline()
-                if not data:
-                    break
-                text = data.decode().strip()
-                if not text:
-                    continue
-                try:
-                    msg = json.loads(text)
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Неверный JSON от майнера {addr}: {e}")
-                    pool_writer.write(data)
-                    await pool_writer.drain()
-                    continue
-
-                if msg.get("method") == "mining.authorize":
-                    params = msg.get("params", [])
-                    if params:
-                        user = params[0]
-                        if "." in user:
-                            alias, worker = user.split(".", 1)
-                        else:
-                            alias, worker = user, ""
-                        wallet = mode_info["alias"].get(alias)
-                        if wallet:
-                            new_user = f"{wallet}.{worker}" if worker else wallet
-                            msg["params"][0] = new_user
-                            new_data = (json.dumps(msg) + "\n").encode()
-                            pool_writer.write(new_data)
-                            logger.info(f"Заменен alias '{alias}' на кошелек '{wallet}' (воркер '{worker}')")
-                        else:
-                            pool_writer.write(data)
-                            logger.info(f"Alias '{alias}' не найден в конфиге; отправляем без изменений")
-                        await pool_writer.drain()
-                        continue
-                pool_writer.write(data)
-                await pool_writer.drain()
-        except Exception as e:
-            logger.error(f"Ошибка перенаправления к пулу для {addr}: {e}")
-        finally:
-            pool_writer.close()
-            try:
-                await pool_writer.wait_closed()
-            except ConnectionResetError:
-                logger.warning(f"Pool connection reset by peer for {addr} (safe to ignore)")
-            except Exception as e:
-                logger.error(f"Error while closing pool_writer for {addr}: {e}")
-
-    async def forward_to_miner():
-        try:
-            while not pool_reader.at_eof():
-                data = await pool_reader.readline()
-                if not data:
-                    break
-                miner_writer.write(data)
-                await miner_writer.drain()
-        except Exception as e:
-            logger.error(f"Ошибка перенаправления к майнеру для {addr}: {e}")
-        finally:
-            miner_writer.close()
-            try:
-                await miner_writer.wait_closed()
-            except ConnectionResetError:
-                logger.warning(f"Miner connection reset by peer for {addr} (safe to ignore)")
-            except Exception as e:
-                logger.error(f"Error while closing miner_writer for {addr}: {e}")
+    def on_pool_eof():
+        # Пул закрыл соединение сам (а не мы после ухода майнера): пусть майнер сразу переподключится
+        if not pool_writer.is_closing() and not miner_writer.is_closing():
+            logger.warning(f"Пул {host}:{port} закрыл соединение {addr}, отправляем client.reconnect")
+            miner_writer.write(RECONNECT_MESSAGE)
 
+    # При aggregate сессия нужна и без share_metrics: по её authorize запоминаем кошелёк IP
+    session = client.session = SessionMetrics(current_mode) if SHARE_METRICS or AGGREGATE else None
+    share_filter = ShareFilter(current_mode, reply=miner_writer.write) if SHARE_FILTER else None
+    # Пул -> майнер в отдельной задаче, майнер -> пул в задаче самого handle_client: на сессию одна лишняя задача
+    to_miner = asyncio.create_task(forward_to_miner(
+        pool_reader, miner_writer, addr,
+        buffered=BUFFERED_FORWARDING, limits=TO_MINER_LIMITS, session=session, on_pool_eof=on_pool_eof,
+        share_filter=share_filter,
+    ))
     try:
-        await asyncio.gather(forward_to_pool(), forward_to_miner())
+        await forward_to_pool(
+            miner_reader, pool_writer, alias_map, addr,
+            fast_path=FAST_PATH, buffered=BUFFERED_FORWARDING, limits=TO_POOL_LIMITS, session=session, client=client,
+            share_filter=share_filter,
+        )
+        await to_miner
     finally:
-        logger.info(f"Соединение закрыто для {addr}")
-        active_clients.discard(client_task)
+        to_miner.cancel()
+        logger.info("Соединение закрыто для %s", addr)
+        active_clients.remove(client_task)
+        if session is not None:
+            if AGGREGATE and session.worker != "unknown":
+                aggregator.learn(addr[0], session.worker.split(".", 1)[0])
+            session.close()
+
+async def sweep_clients():
+    """Раз в CLIENT_SWEEP_INTERVAL закрывает сессии, молчащие дольше LOGIN_TIMEOUT/IDLE_TIMEOUT."""
+    if not LOGIN_TIMEOUT and not IDLE_TIMEOUT:
+        return
+    while True:
+        await asyncio.sleep(CLIENT_SWEEP_INTERVAL)
+        expired, reasons = expired_clients(active_clients, LOGIN_TIMEOUT, IDLE_TIMEOUT)
+        if not expired:
+            continue
+        for reason, count in reasons.items():
+            CLIENT_STATS[reason] += count
+        logger.info(
+            f"Закрываем {len(expired)} молчащих сессий: {reasons['login']} без данных за {LOGIN_TIMEOUT} с "
+            f"после подключения, {reasons['idle']} без данных дольше {IDLE_TIMEOUT} с"
+        )
+        # Рвём сокет, а не отменяем задачу: сессия завершается обычным путём, как при уходе майнера
+        for client in expired:
+            client.writer.transport.abort()
 
-async def manage_server(current_mode, server_task):
+async def manage_server(current_mode, server_task, watch=True, reuse_port=False):
+    """Следит за режимом. watch=False — режим присылает супервизор, сокет и файл не слушаем."""
+    global migration_task
+    mode_changed = asyncio.Event()
+    unsubscribe = mode_state.subscribe(lambda mode: mode_changed.set())
+    watch_task = None
+    if watch:
+        watch_task = asyncio.create_task(mode_state.watch(listen=True, poll_interval=MODE_POLL_INTERVAL))
     while True:
         try:
+            mode_changed.clear()
             new_mode = get_current_mode()
             if new_mode != current_mode[0]:
                 logger.info(f"Режим изменен: {current_mode[0]} -> {new_mode}")
                 current_mode[0] = new_mode
 
-                if server_task:
-                    logger.info("Закрываем текущий сервер и все клиентские соединения")
-                    for client_task in active_clients.copy():
-                        client_task.cancel()
+                await rebuild_upstream_pool(new_mode)
+
+                # Запускаем до закрытия сервера: wait_closed() может ждать завершения старых сессий
+                if GRACEFUL_SWITCH:
+                    if migration_task and not migration_task.done():
+                        migration_task.cancel()
+                    migration_task = asyncio.create_task(migrate_clients(new_mode))
+
+                if GRACEFUL_SWITCH and server_task and new_mode != "сон":
+                    # Слушатель не трогаем: handle_client берёт current_mode[0] в момент подключения
+                    logger.info(f"Слушатель остаётся на порту {conport}, новые подключения идут в режим '{new_mode}'")
+                elif server_task:
+                    if GRACEFUL_SWITCH:
+                        logger.info("Закрываем текущий сервер, клиентские соединения закрываются пачками")
+                    else:
+                        logger.info("Закрываем текущий сервер и все клиентские соединения")
+                        for client_task in list(active_clients):
+                            client_task.cancel()
+                        active_clients.clear()
                     server_task.cancel()
                     try:
                         await server_task
                     except asyncio.CancelledError:
                         pass
                     server_task = None
-                    active_clients.clear()
-
-                if new_mode != "сон":
-                    server = await asyncio.start_server(
-                        lambda r, w: handle_client(r, w, current_mode[0]), '0.0.0.0', conport
-                    )
-                    addr = server.sockets[0].getsockname()
-                    logger.info(f"Слушаем на {addr} в режиме '{new_mode}'")
-                    server_task = asyncio.create_task(server.serve_forever())
-                else:
+
+                if new_mode != "сон" and not server_task:
+                    server_task = await start_listener(current_mode, reuse_port=reuse_port)
+                elif new_mode == "сон":
                     logger.info("Режим 'сон' - не принимаем новые подключения")
 
-            await asyncio.sleep(5)
+            await mode_changed.wait()
         except asyncio.CancelledError:
             logger.info("Задача manage_server отменена")
+            unsubscribe()
+            if watch_task:
+                watch_task.cancel()
             if server_task:
                 server_task.cancel()
                 try:
@@ -165,11 +599,13 @@ async def manage_server(current_mode, server_task):
             logger.error(f"Ошибка в manage_server: {e}")
             await asyncio.sleep(5)
 
-async def shutdown(loop, server_task):
+async def shutdown(loop, server_task, background=()):
+    """background — фоновые задачи main: отменяются вместе с остальными, их завершения ждём до закрытия пулов."""
     logger.info("Остановка прокси...")
     tasks = [task for task in asyncio.all_tasks(loop) if task is not asyncio.current_task()]
     for task in tasks:
         task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
     if server_task:
         server_task.cancel()
         try:
@@ -177,41 +613,68 @@ async def shutdown(loop, server_task):
         except asyncio.CancelledError:
             pass
     await asyncio.sleep(0.5)
-    # Remove these lines:
-    # loop.stop()
-    # loop.run_until_complete(loop.shutdown_asyncgens())
-    # loop.close()
-    await loop.shutdown_asyncgens()  # <-- Just await this
+    if upstream_health is not None:
+        await upstream_health.close()
+    if upstream_pool is not None:
+        await upstream_pool.close()
+    if aggregator is not None:
+        await aggregator.close()
+    await loop.shutdown_asyncgens()
     logger.info("Прокси успешно остановлен")
 
 async def main():
-    setup_logging()
+    setup_logging(LOG_QUEUE_SIZE, LOG_REPEAT_BURST, LOG_REPEAT_INTERVAL)
+    if AGGREGATE_REQUESTED and not AGGREGATE:
+        logger.error("aggregate выключен: общим сессиям нужны share_metrics и hashrate_publish_interval > 0, иначе бот не увидит статистику ригов")
+    if WORKERS > 1:
+        from .supervisor import run_supervisor, reuse_port_supported
+        if reuse_port_supported():
+            loop = asyncio.get_running_loop()
+            supervisor_task = asyncio.current_task()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, supervisor_task.cancel)
+            try:
+                await run_supervisor(WORKERS)
+            except asyncio.CancelledError:
+                logger.info("Супервизор остановлен")
+            return
+        logger.warning("SO_REUSEPORT недоступен на этой платформе, прокси работает в одном процессе")
+
     current_mode = [get_current_mode()]
     logger.info(f"Запуск Stratum-прокси в режиме '{current_mode[0]}'")
 
     loop = asyncio.get_running_loop()
     server_task = None
 
+    await rebuild_upstream_pool(current_mode[0])
     if current_mode[0] != "сон":
-        server = await asyncio.start_server(
-            lambda r, w: handle_client(r, w, current_mode[0]), '0.0.0.0', conport
-        )
-        addr = server.sockets[0].getsockname()
-        logger.info(f"Слушаем на {addr} в режиме '{current_mode[0]}'")
-        server_task = asyncio.create_task(server.serve_forever())
+        server_task = await start_listener(current_mode)
+    if METRICS_PORT:
+        await serve_metrics(METRICS_HOST, METRICS_PORT, stats_snapshot)
+    if ADMIN_API:
+        await serve_admin(ADMIN_SOCKET_PATH, handle_admin)
+    # Фоновые задачи: ссылки держим до остановки, shutdown их отменяет
+    background = []
+    if SHARE_METRICS and HASHRATE_PUBLISH_INTERVAL:
+        background.append(asyncio.create_task(publish_hashrate(worker_feed, hashrate.snapshot, HASHRATE_PUBLISH_INTERVAL)))
+    if CONFIG_RELOAD_INTERVAL:
+        background.append(asyncio.create_task(watch_config(apply_config, CONFIG_RELOAD_INTERVAL, config_reload_requested)))
+    background.append(asyncio.create_task(sweep_clients()))
 
     def handle_shutdown():
-        asyncio.create_task(shutdown(loop, server_task))
+        asyncio.create_task(shutdown(loop, server_task, background))
 
     for sig in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(sig, handle_shutdown)
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, config_reload_requested.set)
 
     try:
         await manage_server(current_mode, server_task)
     except asyncio.CancelledError:
         logger.info("Основные задачи отменены")
     finally:
-        await shutdown(loop, server_task)
+        await shutdown(loop, server_task, background)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
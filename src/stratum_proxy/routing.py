@@ -0,0 +1,61 @@
+import logging
+from types import MappingProxyType
+from .upstream_health import mode_endpoints
+
+logger = logging.getLogger(__name__)
+
+class ModeRoute:
+    """Скомпилированный режим: alias -> кошелёк, эндпоинты, алгоритм и множитель хэшрейта. Не меняется."""
+    __slots__ = ("name", "alias", "endpoints", "algorithm", "share_multiplier")
+
+    def __init__(self, name, info):
+        self.name = name
+        self.alias = MappingProxyType(dict(info.get("alias", {})))
+        self.endpoints = tuple(mode_endpoints(info))
+        self.algorithm = info.get("algorithm")
+        self.share_multiplier = info.get("share_multiplier")
+
+    def __eq__(self, other):
+        return isinstance(other, ModeRoute) and (self.alias, self.endpoints, self.algorithm, self.share_multiplier) == (
+            other.alias, other.endpoints, other.algorithm, other.share_multiplier,
+        )
+
+    def __hash__(self):
+        return hash((self.name, self.endpoints))
+
+class RoutingTable:
+    """Все режимы конфига; заменяется целиком при перезагрузке config.json."""
+    __slots__ = ("modes", "version")
+
+    def __init__(self, modes, version):
+        self.modes = MappingProxyType(modes)
+        self.version = version
+
+    def get(self, mode):
+        return self.modes.get(mode)
+
+def compile_routes(config, version=1):
+    return RoutingTable({mode: ModeRoute(mode, info) for mode, info in config.get("modes", {}).items()}, version)
+
+class LiveAliases:
+    """alias -> кошелёк режима mode по текущей таблице маршрутов.
+
+    Передаётся в forward_to_pool вместо словаря: сессия, открытая до перезагрузки конфига, берёт
+    новые alias при следующем mining.authorize. Обращение идёт только на authorize, submit его не трогает.
+    """
+    __slots__ = ("mode", "get_table")
+
+    def __init__(self, mode, get_table):
+        self.mode = mode
+        self.get_table = get_table
+
+    def get(self, alias, default=None):
+        route = self.get_table().get(self.mode)
+        return route.alias.get(alias, default) if route is not None else default
+
+def diff_routes(old, new):
+    """(добавленные, удалённые, изменённые) режимы между двумя таблицами."""
+    added = [mode for mode in new.modes if mode not in old.modes]
+    removed = [mode for mode in old.modes if mode not in new.modes]
+    changed = [mode for mode in new.modes if mode in old.modes and new.modes[mode] != old.modes[mode]]
+    return added, removed, changed
@@ -0,0 +1,141 @@
+import json
+import logging
+import re
+from .metrics import SUBMIT_MARKER, metrics
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_MARKER = b'"mining.notify"'
+# Стандартные ошибки stratum, которыми MiningCore отвечает на такие шары
+ERRORS = {"stale": [21, "Job not found", None], "duplicate": [22, "Duplicate share", None]}
+# Заданий, отменённых clean_jobs, помним не больше этого; более старые уходят в пул как есть
+MAX_STALE_JOBS = 256
+# Заданий с последнего clean_jobs; при переполнении самые старые забываются (не считаются устаревшими)
+MAX_ACTIVE_JOBS = 64
+# Неполная строка пула длиннее этого не копится
+MAX_TAIL = 64 * 1024
+# params submit (воркер, задание, extranonce2, ntime, nonce и version) регуляркой по байтам: json.loads — только отсеянным
+_STRING = rb'"([^"\\]*)"'
+_SUBMIT_PARAMS_RE = re.compile(rb'"params"\s*:\s*\[\s*' + rb'\s*,\s*'.join([_STRING] * 5) + rb'(?:\s*,\s*' + _STRING + rb')?\s*\]')
+
+class ShareFilter:
+    """Задания одной сессии к пулу по mining.notify и недавние submit — для ответа на заведомо плохие шары без пула.
+
+    Устаревшая — шара по заданию, которое пул отменил clean_jobs: MiningCore ответит на неё
+    «Job not found». Повтор — submit с теми же заданием, extranonce2, ntime, nonce (и version),
+    что уже ушёл в пул после последнего clean_jobs. Шары по заданиям, которых фильтр не видел,
+    отправляются в пул: решать за него, когда не уверены, не будем. Недавние submit хранятся
+    хэшами, не больше max_recent на сессию.
+
+    Ответы майнеру из filter_submits делят сокет с потоком пула: пока майнеру отправлена только
+    часть строки пула, они копятся и уходят через pending_replies после её конца.
+    """
+    __slots__ = ("mode", "reply", "max_recent", "active", "stale", "recent", "replies", "mid_line", "_tail")
+
+    def __init__(self, mode, reply=None, max_recent=1024):
+        self.mode = mode
+        self.reply = reply  # reply(bytes) — ответ майнеру; нужен только filter_submits
+        self.max_recent = max_recent
+        self.active = {}  # job_id -> None: задания с последнего clean_jobs, по порядку
+        self.stale = {}  # job_id -> None: задания, отменённые clean_jobs
+        self.recent = {}  # hash(задание, extranonce2, ntime, nonce, version) -> None
+        self.replies = []  # ответы, ждущие конца строки пула
+        self.mid_line = False  # последний кусок пула, отданный майнеру, оборвался посреди строки
+        self._tail = b""
+
+    def observe(self, chunk):
+        """chunk — данные пула в произвольных границах, как они уходят майнеру; неполная строка доживает до следующего куска."""
+        self.mid_line = not chunk.endswith(b"\n")
+        data = self._tail + chunk if self._tail else chunk
+        end = data.rfind(b"\n") + 1
+        self._tail = data[end:] if len(data) - end <= MAX_TAIL else b""
+        if NOTIFY_MARKER not in data[:end]:
+            return
+        for line in data[:end].split(b"\n"):
+            if NOTIFY_MARKER in line:
+                self.notify(line)
+
+    def notify(self, line):
+        try:
+            params = json.loads(line)["params"]
+            job_id = params[0]
+            clean = len(params) > 8 and bool(params[8])
+        except (ValueError, KeyError, IndexError, TypeError):
+            logger.debug(f"Не удалось разобрать mining.notify: {line[:200]!r}")
+            return
+        if clean:
+            self.stale.update(self.active)
+            self.active.clear()
+            self.recent.clear()
+            while len(self.stale) > MAX_STALE_JOBS:
+                del self.stale[next(iter(self.stale))]
+        self.stale.pop(job_id, None)
+        self.active[job_id] = None
+        if len(self.active) > MAX_ACTIVE_JOBS:
+            del self.active[next(iter(self.active))]
+
+    def check(self, params):
+        """'stale', 'duplicate' или None (шару нужно отправить в пул; тогда она запоминается)."""
+        if len(params) < 5 or not all(isinstance(value, str) for value in params[1:6]):
+            return None
+        if params[1] in self.stale:
+            return "stale"
+        key = hash(tuple(params[1:6]))
+        if key in self.recent:
+            return "duplicate"
+        self.recent[key] = None
+        if len(self.recent) > self.max_recent:
+            del self.recent[next(iter(self.recent))]
+        return None
+
+    def reject(self, msg_id, params, worker=None):
+        """Строка-ответ майнеру, если шару не нужно отправлять в пул, иначе None.
+
+        worker — имя для счётчика отсеянных шар; None — имя из самого submit.
+        """
+        reason = self.check(params)
+        if reason is None:
+            return None
+        return self._response(msg_id, params, worker, reason)
+
+    def _response(self, msg_id, params, worker, reason):
+        metrics.observe_filtered(self.mode, worker if worker is not None else str(params[0]), reason)
+        return (json.dumps({"id": msg_id, "result": None, "error": ERRORS[reason]}) + "\n").encode()
+
+    def filter_submits(self, batch, worker=None):
+        """Убирает из пачки строк майнера отсеянные submit и отвечает на них через reply; возвращает остаток."""
+        kept = []
+        for line in batch.splitlines(keepends=True):
+            if SUBMIT_MARKER in line:
+                response = self._reject_line(line, worker)
+                if response is not None:
+                    if self.mid_line:
+                        self.replies.append(response)
+                    else:
+                        self.reply(response)
+                    continue
+            kept.append(line)
+        return b"".join(kept)
+
+    def _reject_line(self, line, worker):
+        match = _SUBMIT_PARAMS_RE.search(line)
+        try:
+            if match is None:
+                # Параметры не строками или с экранированием: разбираем целиком
+                msg = json.loads(line)
+                return self.reject(msg.get("id"), msg.get("params") or [], worker)
+            params = [value.decode() for value in match.groups() if value is not None]
+            reason = self.check(params)
+            if reason is None:
+                return None
+            return self._response(json.loads(line).get("id"), params, worker, reason)
+        except (ValueError, AttributeError):
+            return None
+
+    def pending_replies(self):
+        """Отложенные ответы майнеру, если поток пула сейчас на границе строки, иначе b""."""
+        if self.mid_line or not self.replies:
+            return b""
+        data = b"".join(self.replies)
+        self.replies.clear()
+        return data
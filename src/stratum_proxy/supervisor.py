@@ -0,0 +1,285 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import signal
+import socket
+import time
+from ..proxy_admin import serve_admin
+from . import proxy
+from .config import ADMIN_SOCKET_PATH, get_current_mode, mode_state, watch_config, worker_feed
+from .admission import merge_admission
+from .hashrate import merge_hashrate, publish_hashrate
+from .metrics import merge_metrics, serve_metrics
+from .utils import setup_logging
+
+logger = logging.getLogger(__name__)
+# Как часто воркер присылает счётчики и как часто супервизор пишет сводку в лог
+WORKER_STATS_INTERVAL = proxy.PROXY_SETTINGS.get("worker_stats_interval", 10)
+STATS_LOG_INTERVAL = proxy.PROXY_SETTINGS.get("stats_log_interval", 60)
+WORKER_STOP_TIMEOUT = proxy.PROXY_SETTINGS.get("worker_stop_timeout", 10)
+# Сколько супервизор ждёт ответов воркеров на запрос admin API
+ADMIN_TIMEOUT = 5.0
+# index -> последний снимок proxy.stats_snapshot() воркера
+worker_stats = {}
+
+def reuse_port_supported():
+    return hasattr(socket, "SO_REUSEPORT")
+
+def combined_stats():
+    """Сводка по всем воркерам: суммы соединений, строк, байт и попаданий в пул соединений."""
+    total = {
+        "workers": len(worker_stats),
+        "connections": 0,
+        "forward": {},
+        "upstream_pool": {"hits": 0, "misses": 0},
+        "upstreams": {},
+        "aggregate": {"upstreams": 0, "miners": 0},
+        "logging": {},
+        "clients": {},
+    }
+    for snapshot in worker_stats.values():
+        total["connections"] += snapshot["connections"]
+        for direction, counters in snapshot["forward"].items():
+            summed = total["forward"].setdefault(direction, {})
+            for key, value in counters.items():
+                summed[key] = summed.get(key, 0) + value
+        for key, value in snapshot["upstream_pool"].items():
+            total["upstream_pool"][key] += value
+        # Каждый воркер пробует те же пулы сам; показываем последнее, что видел любой из них
+        total["upstreams"].update(snapshot.get("upstreams", {}))
+        for key, value in snapshot.get("aggregate", {}).items():
+            total["aggregate"][key] += value
+        for key, value in snapshot.get("logging", {}).items():
+            total["logging"][key] = total["logging"].get(key, 0) + value
+        for key, value in snapshot.get("clients", {}).items():
+            total["clients"][key] = total["clients"].get(key, 0) + value
+    total["metrics"] = merge_metrics(snapshot.get("metrics", {}) for snapshot in worker_stats.values())
+    total["hashrate"] = merge_hashrate(snapshot.get("hashrate", {}) for snapshot in worker_stats.values())
+    total["admission"] = merge_admission(snapshot.get("admission") for snapshot in worker_stats.values())
+    return total
+
+def merge_admin(responses, request):
+    """Ответы воркеров на запрос admin API в один: сессии подряд (не больше limit), числа складываются."""
+    for response in responses:
+        if "error" in response:
+            return response
+    if request.get("command", "sessions") == "sessions":
+        sessions = [session for response in responses for session in response["sessions"]]
+        return {
+            "total": sum(response["total"] for response in responses),
+            "sessions": sessions[:proxy.admin_limit(request)],
+            "workers": len(responses),
+        }
+    return {"matched": sum(response["matched"] for response in responses), "workers": len(responses)}
+
+def run_worker(index, conn):
+    """Точка входа воркер-процесса: свой цикл событий, свой handle_client, тот же conport."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C обрабатывает супервизор
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)  # перезагрузку конфига тоже
+    setup_logging(proxy.LOG_QUEUE_SIZE, proxy.LOG_REPEAT_BURST, proxy.LOG_REPEAT_INTERVAL)
+    asyncio.run(worker_main(index, conn))
+
+async def worker_main(index, conn):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    def on_message():
+        try:
+            while conn.poll():
+                message = conn.recv()
+                if message[0] == "mode":
+                    mode_state.apply(message[1])
+                elif message[0] == "config":
+                    proxy.apply_config(message[1])
+                elif message[0] == "admin":
+                    try:
+                        response = proxy.admin_command(message[2])
+                    except ValueError as e:
+                        response = {"error": str(e)}
+                    conn.send(("admin", index, message[1], response))
+                elif message[0] == "stop":
+                    stop.set()
+        except (EOFError, OSError):
+            logger.warning(f"Воркер {index}: канал к супервизору закрыт, останавливаемся")
+            loop.remove_reader(conn.fileno())
+            stop.set()
+
+    loop.add_reader(conn.fileno(), on_message)
+
+    async def report_stats():
+        while True:
+            conn.send(("stats", index, proxy.stats_snapshot()))
+            await asyncio.sleep(WORKER_STATS_INTERVAL)
+
+    # id сессий вида "<номер воркера>-<n>": супервизор сводит списки всех воркеров
+    proxy.active_clients.prefix = f"{index}-"
+    current_mode = [get_current_mode()]
+    logger.info(f"Воркер {index} запущен в режиме '{current_mode[0]}'")
+    await proxy.rebuild_upstream_pool(current_mode[0])
+    server_task = None
+    if current_mode[0] != "сон":
+        server_task = await proxy.start_listener(current_mode, reuse_port=True)
+    manager_task = asyncio.create_task(proxy.manage_server(current_mode, server_task, watch=False, reuse_port=True))
+    stats_task = asyncio.create_task(report_stats())
+    sweep_task = asyncio.create_task(proxy.sweep_clients())
+
+    await stop.wait()
+    logger.info(f"Воркер {index}: остановка, закрываем {len(proxy.active_clients)} соединений")
+    manager_task.cancel()
+    stats_task.cancel()
+    sweep_task.cancel()
+    for client_task in list(proxy.active_clients):
+        client_task.cancel()
+    await asyncio.gather(manager_task, stats_task, sweep_task, *proxy.active_clients, return_exceptions=True)
+    if proxy.upstream_health is not None:
+        await proxy.upstream_health.close()
+    if proxy.upstream_pool is not None:
+        await proxy.upstream_pool.close()
+    if proxy.aggregator is not None:
+        await proxy.aggregator.close()
+    try:
+        conn.send(("stats", index, proxy.stats_snapshot()))
+    except OSError:
+        pass
+
+async def run_supervisor(count):
+    """Запускает count воркеров, пересылает им смену режима, перезапускает упавших и сводит счётчики."""
+    loop = asyncio.get_running_loop()
+    ctx = multiprocessing.get_context("spawn")
+    workers = {}
+    stopping = False
+    admin_pending = {}  # номер запроса -> (future, {index: ответ воркера}, сколько ответов ждём)
+    admin_ids = itertools.count(1)
+
+    def on_message(index):
+        conn = workers[index]["conn"]
+        try:
+            while conn.poll():
+                message = conn.recv()
+                if message[0] == "stats":
+                    worker_stats[message[1]] = message[2]
+                elif message[0] == "admin" and message[2] in admin_pending:
+                    future, responses, expected = admin_pending[message[2]]
+                    responses[message[1]] = message[3]
+                    if len(responses) == expected and not future.done():
+                        future.set_result(None)
+        except (EOFError, OSError):
+            loop.remove_reader(conn.fileno())
+
+    def spawn(index):
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=run_worker, args=(index, child_conn), name=f"stratum-worker-{index}", daemon=True)
+        process.start()
+        child_conn.close()
+        workers[index] = {"process": process, "conn": parent_conn}
+        loop.add_reader(parent_conn.fileno(), on_message, index)
+        logger.info(f"Запущен воркер {index} (pid {process.pid})")
+
+    def broadcast(message):
+        for worker in workers.values():
+            try:
+                worker["conn"].send(message)
+            except OSError:
+                pass
+
+    async def handle_admin(request):
+        """Запрос admin API уходит всем воркерам; ответы сводятся, не ответившие за ADMIN_TIMEOUT пропускаются."""
+        proxy.admin_limit(request)  # неверный limit — ошибка сразу, без рассылки воркерам
+        request_id = next(admin_ids)
+        future, responses = loop.create_future(), {}
+        sent = 0
+        for worker in workers.values():
+            try:
+                worker["conn"].send(("admin", request_id, request))
+                sent += 1
+            except OSError:
+                pass
+        admin_pending[request_id] = (future, responses, sent)
+        try:
+            if sent:
+                await asyncio.wait_for(future, ADMIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Admin API: ответили {len(responses)} из {sent} воркеров за {ADMIN_TIMEOUT} с")
+        finally:
+            del admin_pending[request_id]
+        return merge_admin(list(responses.values()), request)
+
+    logger.info(f"Запуск Stratum-прокси: супервизор и {count} воркеров на порту {proxy.conport} (SO_REUSEPORT)")
+    for index in range(count):
+        spawn(index)
+
+    unsubscribe = mode_state.subscribe(lambda mode: broadcast(("mode", mode)))
+    metrics_server = None
+    if proxy.METRICS_PORT:
+        metrics_server = await serve_metrics(proxy.METRICS_HOST, proxy.METRICS_PORT, combined_stats)
+    admin_server = None
+    if proxy.ADMIN_API:
+        admin_server = await serve_admin(ADMIN_SOCKET_PATH, handle_admin)
+    watch_task = asyncio.create_task(mode_state.watch(listen=True, poll_interval=proxy.MODE_POLL_INTERVAL))
+    # config.json читает только супервизор; воркеры получают уже проверенную версию
+    config_task = None
+    if proxy.CONFIG_RELOAD_INTERVAL:
+        config_task = asyncio.create_task(watch_config(
+            lambda config: broadcast(("config", config)), proxy.CONFIG_RELOAD_INTERVAL, proxy.config_reload_requested,
+        ))
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, proxy.config_reload_requested.set)
+    publish_task = None
+    if proxy.SHARE_METRICS and proxy.HASHRATE_PUBLISH_INTERVAL:
+        publish_task = asyncio.create_task(publish_hashrate(
+            worker_feed,
+            lambda: combined_stats()["hashrate"],
+            proxy.HASHRATE_PUBLISH_INTERVAL,
+        ))
+    last_log = time.monotonic()
+    previous = combined_stats()
+    try:
+        while True:
+            await asyncio.sleep(1)
+            for index, worker in list(workers.items()):
+                if stopping or worker["process"].is_alive():
+                    continue
+                logger.error(f"Воркер {index} завершился с кодом {worker['process'].exitcode}, перезапускаем")
+                loop.remove_reader(worker["conn"].fileno())
+                worker["conn"].close()
+                spawn(index)
+            if time.monotonic() - last_log >= STATS_LOG_INTERVAL:
+                current = combined_stats()
+                elapsed = time.monotonic() - last_log
+                to_pool = current["forward"].get("to_pool", {}).get("lines", 0) - previous["forward"].get("to_pool", {}).get("lines", 0)
+                to_miner = current["forward"].get("to_miner", {}).get("lines", 0) - previous["forward"].get("to_miner", {}).get("lines", 0)
+                logger.info(
+                    f"Воркеров {current['workers']}/{count}, соединений {current['connections']}, "
+                    f"строк к пулу {to_pool / elapsed:.1f}/с, к майнерам {to_miner / elapsed:.1f}/с; "
+                    + ", ".join(f"#{i}: {s['connections']}" for i, s in sorted(worker_stats.items()))
+                )
+                previous = current
+                last_log = time.monotonic()
+    finally:
+        stopping = True
+        unsubscribe()
+        if metrics_server is not None:
+            metrics_server.close()
+        if admin_server is not None:
+            admin_server.close()
+        watch_task.cancel()
+        if config_task is not None:
+            config_task.cancel()
+        if publish_task is not None:
+            publish_task.cancel()
+        logger.info("Останавливаем воркеры...")
+        broadcast(("stop",))
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        while any(w["process"].is_alive() for w in workers.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for index, worker in workers.items():
+            if worker["process"].is_alive():
+                logger.warning(f"Воркер {index} не остановился за {WORKER_STOP_TIMEOUT} с, завершаем принудительно")
+                worker["process"].terminate()
+            worker["process"].join(1)
+            loop.remove_reader(worker["conn"].fileno())
+            worker["conn"].close()
+        logger.info("Все воркеры остановлены")
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+# Задержки живых эндпоинтов, различающиеся меньше чем на шаг, считаются равными: тогда решает порядок
+# из конфига, и новые сессии не перескакивают между пулами из-за шума измерений. Живой быстрейший
+# эндпоинт уступает место другому, только если тот быстрее на целый шаг: задержки у границы шага
+# не гоняют резерв соединений туда и обратно
+LATENCY_STEP = 0.005
+
+def mode_endpoints(mode_info):
+    """Упорядоченный список (host, port) режима: upstreams или, как раньше, одиночные host/port."""
+    upstreams = mode_info.get("upstreams")
+    if upstreams:
+        return [(upstream.get("host", "127.0.0.1"), upstream["port"]) for upstream in upstreams]
+    if mode_info.get("port") is None:
+        return []
+    return [(mode_info.get("host", "127.0.0.1"), mode_info["port"])]
+
+def _faster(endpoint, current):
+    if endpoint.latency is None:
+        return False
+    return current.latency is None or endpoint.latency <= current.latency - LATENCY_STEP
+
+class UpstreamEndpoint:
+    __slots__ = ("host", "port", "alive", "failures", "latency", "last_error")
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.alive = True  # до первой пробы считаем живым, чтобы не задерживать старт
+        self.failures = 0  # подряд
+        self.latency = None  # сглаженное время TCP-подключения, секунды
+        self.last_error = None
+
+    @property
+    def key(self):
+        return (self.host, self.port)
+
+class UpstreamHealth:
+    """Пробы stratum-портов одного режима и выбор эндпоинта для новых сессий.
+
+    Раз в interval секунд к каждому эндпоинту открывается TCP-соединение и сразу закрывается:
+    stratum-сессии не заводим, чтобы проба не выглядела для пула клиентом. Подключились за timeout
+    секунд — эндпоинт жив, время подключения сглаживается в latency. После fail_threshold неудачных
+    проб подряд (или сразу, если к нему не смогла подключиться сессия) эндпоинт считается мёртвым.
+    on_change(endpoint) вызывается при каждой смене alive и когда после пробы сменился preferred().
+    """
+
+    def __init__(self, mode, endpoints, interval=10.0, timeout=3.0, fail_threshold=2, on_change=None):
+        self.mode = mode
+        self.endpoints = [UpstreamEndpoint(host, port) for host, port in endpoints]
+        self.interval = interval
+        self.timeout = timeout
+        self.fail_threshold = fail_threshold
+        self.on_change = on_change
+        self._preferred = None
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.endpoints:
+            self._task = asyncio.create_task(self._probe_loop())
+        return self
+
+    def candidates(self):
+        """Эндпоинты в порядке попыток: живые по задержке (с шагом LATENCY_STEP, при равенстве — по порядку
+        из конфига; ещё не измеренные — после измеренных), затем мёртвые с меньшим числом неудач.
+        Прежний быстрейший, пока жив, остаётся первым, если новый не быстрее его на LATENCY_STEP."""
+        alive = sorted(
+            (endpoint for endpoint in self.endpoints if endpoint.alive),
+            key=lambda e: (e.latency is None, int(e.latency / LATENCY_STEP) if e.latency is not None else 0),
+        )
+        current = self._preferred
+        if current is not None and current.alive and alive[0] is not current and not _faster(alive[0], current):
+            alive.remove(current)
+            alive.insert(0, current)
+        dead = sorted((endpoint for endpoint in self.endpoints if not endpoint.alive), key=lambda e: e.failures)
+        return alive + dead
+
+    def preferred(self):
+        candidates = self.candidates()
+        return candidates[0] if candidates else None
+
+    def mark_success(self, endpoint, latency):
+        endpoint.failures = 0
+        endpoint.last_error = None
+        endpoint.latency = latency if endpoint.latency is None else endpoint.latency * 0.7 + latency * 0.3
+        if not endpoint.alive:
+            endpoint.alive = True
+            logger.info(f"Пул {endpoint.host}:{endpoint.port} режима '{self.mode}' снова доступен ({latency * 1000:.1f} мс)")
+            self._notify(endpoint)
+
+    def mark_failure(self, endpoint, error, immediate=False):
+        endpoint.failures += 1
+        endpoint.last_error = str(error) or type(error).__name__
+        if endpoint.alive and (immediate or endpoint.failures >= self.fail_threshold):
+            endpoint.alive = False
+            logger.warning(f"Пул {endpoint.host}:{endpoint.port} режима '{self.mode}' недоступен: {endpoint.last_error}")
+            self._notify(endpoint)
+
+    def _notify(self, endpoint):
+        if self.on_change is not None:
+            try:
+                self.on_change(endpoint)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика смены состояния пула {endpoint.host}:{endpoint.port}: {e}")
+
+    async def _probe(self, endpoint):
+        started = time.perf_counter()
+        writer = None
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(endpoint.host, endpoint.port), self.timeout)
+            self.mark_success(endpoint, time.perf_counter() - started)
+        except asyncio.TimeoutError:
+            self.mark_failure(endpoint, TimeoutError(f"не подключились за {self.timeout} с"))
+        except OSError as e:
+            self.mark_failure(endpoint, e)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.gather(*(self._probe(endpoint) for endpoint in self.endpoints))
+            preferred = self.preferred()
+            if self._preferred is not None and preferred is not self._preferred and preferred.latency is not None:
+                logger.info(
+                    f"Быстрейший пул режима '{self.mode}' теперь {preferred.host}:{preferred.port} "
+                    f"({preferred.latency * 1000:.1f} мс)"
+                )
+                self._notify(preferred)
+            self._preferred = preferred
+            await asyncio.sleep(self.interval)
+
+    def snapshot(self):
+        return {
+            f"{endpoint.host}:{endpoint.port}": {
+                "mode": self.mode,
+                "alive": endpoint.alive,
+                "latency": endpoint.latency,
+                "failures": endpoint.failures,
+            }
+            for endpoint in self.endpoints
+        }
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
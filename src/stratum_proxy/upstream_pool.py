@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class UpstreamPool:
+    """Пул заранее открытых TCP-соединений к stratum-порту MiningCore для одного режима.
+
+    Новый майнер получает готовое соединение из пула (hit) и не ждёт TCP-рукопожатия с пулом;
+    если пул пуст, соединение открывается как раньше (miss). Фоновая задача доливает пул до size
+    и закрывает соединения, пролежавшие без дела дольше max_idle секунд.
+    """
+
+    def __init__(self, mode, host, port, size=4, max_idle=30.0, refill_interval=1.0, stats_interval=60.0, limit=2 ** 16):
+        self.mode = mode
+        self.host = host
+        self.port = port
+        self.limit = limit  # limit StreamReader: предел строки от пула
+        self.size = size
+        self.max_idle = max_idle
+        self.refill_interval = refill_interval
+        self.stats_interval = stats_interval
+        self._idle = []  # (reader, writer, opened_at)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.connects = 0
+        self.connect_time_total = 0.0
+        self.connect_time_max = 0.0
+
+    def start(self):
+        if self._task is None and self.size > 0:
+            self._task = asyncio.create_task(self._refill_loop())
+        return self
+
+    async def _connect(self):
+        started = time.perf_counter()
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=self.limit)
+        elapsed = time.perf_counter() - started
+        self.connects += 1
+        self.connect_time_total += elapsed
+        self.connect_time_max = max(self.connect_time_max, elapsed)
+        logger.debug(f"Соединение с пулом {self.host}:{self.port} открыто за {elapsed * 1000:.1f} мс")
+        return reader, writer
+
+    @staticmethod
+    def _is_alive(reader, writer):
+        return not reader.at_eof() and not writer.is_closing()
+
+    async def acquire(self):
+        """Возвращает (reader, writer) к пулу: из резерва, если есть живое соединение, иначе открывает новое."""
+        while self._idle:
+            reader, writer, _ = self._idle.pop()
+            self._wakeup.set()
+            if self._is_alive(reader, writer):
+                self.hits += 1
+                return reader, writer
+            writer.close()
+        self.misses += 1
+        self._wakeup.set()
+        return await self._connect()
+
+    def _expire_idle(self):
+        now = time.monotonic()
+        alive = []
+        for reader, writer, opened_at in self._idle:
+            if self._is_alive(reader, writer) and now - opened_at < self.max_idle:
+                alive.append((reader, writer, opened_at))
+            else:
+                writer.close()
+        self._idle = alive
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0.0
+        avg_ms = self.connect_time_total / self.connects * 1000 if self.connects else 0.0
+        logger.info(
+            f"Пул соединений '{self.mode}' ({self.host}:{self.port}): резерв {len(self._idle)}/{self.size}, "
+            f"попаданий {self.hits}/{total} ({hit_rate:.1f}%), "
+            f"подключение к пулу: среднее {avg_ms:.1f} мс, макс {self.connect_time_max * 1000:.1f} мс"
+        )
+
+    async def _refill_loop(self):
+        last_stats = time.monotonic()
+        while True:
+            try:
+                self._expire_idle()
+                while len(self._idle) < self.size:
+                    reader, writer = await self._connect()
+                    self._idle.append((reader, writer, time.monotonic()))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Не удалось пополнить пул соединений {self.host}:{self.port}: {e}")
+            if time.monotonic() - last_stats >= self.stats_interval:
+                self.log_stats()
+                last_stats = time.monotonic()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _, writer, _ in self._idle:
+            writer.close()
+        self._idle = []
+        self.log_stats()
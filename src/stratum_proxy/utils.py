@@ -1,6 +1,8 @@
 import logging
+from ..log_queue import setup_queue_logging
 
 logger = logging.getLogger(__name__)
 
-def setup_logging():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
\ No newline at end of file
+def setup_logging(queue_size=10000, burst=20, interval=10.0):
+    """Логи через ограниченную очередь и поток записи: вызов logger.* в цикле событий не ждёт диска."""
+    setup_queue_logging(logging.INFO, queue_size, burst, interval)
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+class BlockCounter:
+    """Блоки пула в минутных корзинах за retention секунд и по суткам (UTC) за history_days дней.
+
+    Корзины хранятся только для минут, в которые были блоки, вместе с накопленной суммой,
+    поэтому добавление блока по порядку времени и устаревание — O(1), а число блоков за любое
+    окно — два поиска делением пополам. Границы окна округляются до минуты. Блок с уже учтённой высотой
+    (повтор строки лога, история плюс перечитанный лог) не считается второй раз.
+    """
+
+    __slots__ = ("bucket", "retention", "history_days", "starts", "cumulative", "head", "removed", "heights", "days", "last", "last_height")
+
+    def __init__(self, retention=48 * 3600, history_days=365, bucket=60):
+        self.bucket = bucket
+        self.retention = retention
+        self.history_days = history_days
+        self.starts = []  # начало корзины, unix-секунды, по возрастанию
+        self.cumulative = []  # блоков во всех корзинах до этой включительно
+        self.head = 0  # первая неустаревшая корзина
+        self.removed = 0  # блоков в устаревших корзинах до head
+        self.heights = {}  # высота -> unix-время блока, за retention
+        self.days = {}  # "YYYY-MM-DD" -> блоков за сутки
+        self.last = None
+        self.last_height = None
+
+    def __len__(self):
+        """Блоков за retention."""
+        return (self.cumulative[-1] if self.cumulative else 0) - self.removed
+
+    def add(self, timestamp, height=None, now=None):
+        """Учитывает блок; False — повтор или блок из уже устаревшей корзины."""
+        moment = timestamp.timestamp()
+        now = (now or datetime.now(timezone.utc)).timestamp()
+        start = int(moment // self.bucket * self.bucket)
+        if start + self.bucket <= now - self.retention:
+            return False
+        if height is not None:
+            height = int(height)
+            if height in self.heights:
+                return False
+            self.heights[height] = moment
+        starts, cumulative = self.starts, self.cumulative
+        if not starts or start > starts[-1]:
+            starts.append(start)
+            cumulative.append((cumulative[-1] if cumulative else 0) + 1)
+        elif start == starts[-1]:
+            cumulative[-1] += 1
+        else:
+            # Блок из прошлого (история, перечитанный лог): редкий случай, вставка со сдвигом сумм
+            index = bisect_left(starts, start, self.head)
+            if index < len(starts) and starts[index] == start:
+                first = index
+            else:
+                starts.insert(index, start)
+                cumulative.insert(index, cumulative[index - 1] if index > 0 else self.removed)
+                first = index
+            for i in range(first, len(cumulative)):
+                cumulative[i] += 1
+        day = timestamp.astimezone(timezone.utc).strftime("%Y-%m-%d")
+        self.days[day] = self.days.get(day, 0) + 1
+        if self.last is None or timestamp > self.last:
+            self.last, self.last_height = timestamp, height
+        self.expire(now)
+        return True
+
+    def expire(self, now):
+        """Сдвигает начало окна на now - retention (unix-секунды)."""
+        cutoff = now - self.retention
+        starts = self.starts
+        while self.head < len(starts) and starts[self.head] + self.bucket <= cutoff:
+            self.removed = self.cumulative[self.head]
+            self.head += 1
+        if self.head > 64 and self.head * 2 > len(starts):
+            # Устаревшие корзины и высоты вычищаются разом, когда их набралось больше половины
+            del starts[:self.head], self.cumulative[:self.head]
+            self.head = 0
+            self.heights = {height: moment for height, moment in self.heights.items() if moment // self.bucket * self.bucket + self.bucket > cutoff}
+        if len(self.days) > self.history_days:
+            for day in sorted(self.days)[:len(self.days) - self.history_days]:
+                del self.days[day]
+
+    def count(self, since, until=None):
+        """Блоков с since (datetime) до until (по умолчанию — до сейчас), с точностью до минуты."""
+        return self._before(until.timestamp() if until is not None else None) - self._before(since.timestamp())
+
+    def rate(self, seconds, now=None):
+        """Блоков в час за последние seconds секунд."""
+        now = now or datetime.now(timezone.utc)
+        return self.count(now - timedelta(seconds=seconds), now) * 3600 / seconds if seconds > 0 else 0
+
+    def recent_days(self, count, now=None):
+        """Блоков за последние count суток UTC, включая сегодняшние."""
+        today = (now or datetime.now(timezone.utc)).date()
+        return sum(self.days.get((today - timedelta(days=offset)).isoformat(), 0) for offset in range(count))
+
+    def _before(self, moment):
+        """Блоков в корзинах, начавшихся раньше moment (None — во всех)."""
+        if moment is None:
+            index = len(self.starts)
+        else:
+            index = bisect_left(self.starts, int(moment // self.bucket * self.bucket), self.head)
+        return (self.cumulative[index - 1] if index > self.head else self.removed) - self.removed
+
+    def state(self):
+        """Для сохранения: блоки за retention (время и высота) и суточные итоги.
+
+        Блоки без высоты считаются, но не сохраняются: в строке лога высота есть всегда.
+        """
+        blocks = []
+        if self.heights:
+            blocks = sorted([moment, height] for height, moment in self.heights.items())
+        return {
+            "blocks": blocks,
+            "days": dict(self.days),
+            "last": self.last.isoformat() if self.last is not None else None,
+            "last_height": self.last_height,
+        }
+
+    def restore(self, state, now=None):
+        """Обратное state(): суточные итоги берутся как есть, блоки — заново через add()."""
+        days = dict(self.days)
+        for moment, height in state.get("blocks", []):
+            self.add(datetime.fromtimestamp(moment, tz=timezone.utc), height, now)
+        for day, count in state.get("days", {}).items():
+            days[day] = days.get(day, 0) + count
+        self.days = days
+        if state.get("last"):
+            last = datetime.fromisoformat(state["last"])
+            if self.last is None or last > self.last:
+                self.last, self.last_height = last, state.get("last_height")
+        self.expire((now or datetime.now(timezone.utc)).timestamp())
+
+def load_history(path, pools):
+    """Восстанавливает счётчики блоков пулов из path; пулы, которых больше нет в конфиге, пропускаются."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            history = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        logger.error(f"Ошибка при чтении {path}: {e}")
+        return 0
+    restored = 0
+    for pool_id, state in history.get("pools", {}).items():
+        pool = pools.get(pool_id)
+        if pool is not None:
+            pool.blocks.restore(state)
+            restored += len(pool.blocks)
+    return restored
+
+def save_history(path, pools):
+    """Пишет через временный файл: при падении на диске остаётся предыдущая версия целиком."""
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"pools": {pool.pool_id: pool.blocks.state() for pool in pools}}, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except Exception as e:
+        logger.error(f"Ошибка при записи в {path}: {e}")
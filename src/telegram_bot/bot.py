@@ -1,7 +1,8 @@
 import asyncio
 import csv
 import logging
-from datetime import datetime, timezone, timedelta
+import time
+from datetime import datetime, timezone
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
@@ -9,15 +10,28 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramBadRequest
 import aiohttp
-from .config import CONFIG, load_user_settings, save_user_settings, get_current_mode, set_current_mode, get_last_mode_change_time, TIMEZONES
-from .utils import format_hashrate, format_timestamp, get_worker_short_name, format_uptime
+from .config import ADMIN_SOCKET_PATH, CONFIG, load_user_settings, save_user_settings, get_current_mode, set_current_mode, get_last_mode_change_time, TIMEZONES, mode_state, worker_feed
+from .utils import format_hashrate, format_timestamp, format_uptime
 from .log_parser import LogParser
+from .pool_state import PoolStates
+from .telegram_outbox import Outbox, PRIORITY_ALERT, PRIORITY_REPLY
+from ..proxy_admin import admin_request
 from pathlib import Path
 import os
 
 logger = logging.getLogger(__name__)
 bot = Bot(token="Ytokeeeen")  
 dp = Dispatcher()
+# Все сообщения бота идут через очередь с лимитами Telegram
+outbox_settings = CONFIG.get("telegram_outbox", {})
+outbox = Outbox(
+    bot,
+    rate=outbox_settings.get("rate", 25.0),
+    burst=outbox_settings.get("burst", 30),
+    chat_rate=outbox_settings.get("chat_rate", 1.0),
+    chat_burst=outbox_settings.get("chat_burst", 3),
+    max_queue=outbox_settings.get("max_queue", 10000),
+)
 modes = CONFIG["modes"]
 users = CONFIG["users"]
 nodes = CONFIG["nodes"]
@@ -28,49 +42,31 @@ last_worker_stats_message_ids = {}
 last_summary_message_ids = {}
 last_detailed_stats_message_ids = {}
 last_hashrates = {}
-worker_stats = {}
-worker_id_to_name = {}
 last_hashrate_reports = {}
 last_worker_stats_reports = {}
 last_summary_reports = {}
 last_detailed_stats_reports = {}
-block_timestamps = {}
+# Воркеры, имена по id подключения и блоки всех пулов из режимов, а не только текущего
+pool_settings = CONFIG.get("log_parser", {})
+pools = PoolStates(
+    {info.get("pool_id", f"{mode}-sha256-1") for mode, info in modes.items()},
+    max_workers=pool_settings.get("max_pool_workers", 10000),
+    max_names=pool_settings.get("max_pool_names", 50000),
+    history_days=pool_settings.get("block_history_days", 365),
+)
 user_settings = load_user_settings()
 
-async def delete_message_later(chat_id: int, message_id: int, delay: int = 600):
-    await asyncio.sleep(delay)
-    try:
-        await bot.delete_message(chat_id=chat_id, message_id=message_id)
-        logger.debug(f"Удалено сообщение {message_id} в чате {chat_id}")
-    except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение {message_id} в чате {chat_id}: {e}")
+def clear_previous_worker_stats(chat_id: int):
+    for message_id in last_worker_stats_message_ids.pop(chat_id, []):
+        outbox.delete_message(chat_id, message_id)
 
-async def clear_previous_worker_stats(chat_id: int):
-    if chat_id in last_worker_stats_message_ids:
-        for message_id in last_worker_stats_message_ids[chat_id]:
-            try:
-                await bot.delete_message(chat_id=chat_id, message_id=message_id)
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение воркеров {message_id}: {e}")
-        last_worker_stats_message_ids[chat_id] = []
-
-async def clear_previous_summary(chat_id: int):
-    if chat_id in last_summary_message_ids:
-        for message_id in last_summary_message_ids[chat_id]:
-            try:
-                await bot.delete_message(chat_id=chat_id, message_id=message_id)
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение сводного отчета {message_id}: {e}")
-        last_summary_message_ids[chat_id] = []
+def clear_previous_summary(chat_id: int):
+    for message_id in last_summary_message_ids.pop(chat_id, []):
+        outbox.delete_message(chat_id, message_id)
 
-async def clear_previous_detailed_stats(chat_id: int):
-    if chat_id in last_detailed_stats_message_ids:
-        for message_id in last_detailed_stats_message_ids[chat_id]:
-            try:
-                await bot.delete_message(chat_id=chat_id, message_id=message_id)
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение детализированной статистики {message_id}: {e}")
-        last_detailed_stats_message_ids[chat_id] = []
+def clear_previous_detailed_stats(chat_id: int):
+    for message_id in last_detailed_stats_message_ids.pop(chat_id, []):
+        outbox.delete_message(chat_id, message_id)
 
 def build_mode_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
@@ -95,7 +91,7 @@ def build_settings_keyboard() -> InlineKeyboardMarkup:
 def calculate_block_stats(pool_id: str):
     current_time = datetime.now(timezone.utc)
     start_of_day = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
-    blocks_today = sum(1 for ts in block_timestamps.get(pool_id, []) if ts >= start_of_day)
+    blocks_today = pools[pool_id].blocks.count(start_of_day)
     hours_elapsed = (current_time - start_of_day).total_seconds() / 3600
     blocks_per_hour = blocks_today / hours_elapsed if hours_elapsed > 0 and blocks_today > 0 else 0
     return blocks_today, blocks_per_hour
@@ -104,25 +100,59 @@ def calculate_block_stats(pool_id: str):
 async def cmd_start(message: types.Message):
     parts = message.text.strip().split()
     if len(parts) != 2:
-        await message.answer("Используйте: /start <alias>")
+        await outbox.send_message(message.chat.id, "Используйте: /start <alias>", priority=PRIORITY_REPLY)
         return
     alias = parts[1]
     chat_id = message.chat.id
     if alias in users and users[alias] == chat_id:
         authorized_chats.add(chat_id)
-        await clear_previous_worker_stats(chat_id)
-        await clear_previous_summary(chat_id)
-        await clear_previous_detailed_stats(chat_id)
-        await message.answer(
+        clear_previous_worker_stats(chat_id)
+        clear_previous_summary(chat_id)
+        clear_previous_detailed_stats(chat_id)
+        await outbox.send_message(
+            chat_id,
             f"✅ Добро пожаловать, {alias}!\nТекущий режим: *{get_current_mode()}*",
+            priority=PRIORITY_REPLY,
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=build_mode_keyboard()
         )
         await send_summary_report(chat_id)
     else:
-        await message.answer("❌ Доступ запрещён.")
+        await outbox.send_message(chat_id, "❌ Доступ запрещён.", priority=PRIORITY_REPLY)
         logger.warning(f"Неавторизованная попытка: alias={alias}, chat_id={chat_id}")
 
+@dp.message(Command("sessions"))
+async def cmd_sessions(message: types.Message):
+    """Подключённые к прокси майнеры: /sessions [воркер или кошелёк]. Не суперадмин видит только свой alias."""
+    chat_id = message.chat.id
+    if chat_id not in authorized_chats:
+        await outbox.send_message(chat_id, "❌ Доступ запрещён.", priority=PRIORITY_REPLY)
+        return
+    parts = message.text.strip().split()
+    request = {"command": "sessions", "limit": 30}
+    if len(parts) > 1:
+        request["worker"] = parts[1]
+    if chat_id != 1146015328:
+        request["alias"] = next((alias for alias, user_chat in users.items() if user_chat == chat_id), None)
+    try:
+        response = await admin_request(ADMIN_SOCKET_PATH, request)
+    except (ConnectionError, ValueError) as e:
+        await outbox.send_message(chat_id, f"⚠️ Прокси не отвечает: {e}", priority=PRIORITY_REPLY)
+        return
+    if "error" in response:
+        await outbox.send_message(chat_id, f"⚠️ {response['error']}", priority=PRIORITY_REPLY)
+        return
+    lines = [f"🔌 *Сессии прокси:* {response['total']}"]
+    for session in response["sessions"]:
+        shares = f", шары {session['accepted']}/{session['rejected']}" if session["accepted"] is not None else ""
+        lines.append(
+            f"`{session['worker'] or session['addr']}` → `{session['upstream'] or '-'}`, "
+            f"{int(session['connected'] // 60)} мин{shares}"
+        )
+    if response["total"] > len(response["sessions"]):
+        lines.append(f"… и ещё {response['total'] - len(response['sessions'])}")
+    await outbox.send_message(chat_id, "\n".join(lines), priority=PRIORITY_REPLY, parse_mode=ParseMode.MARKDOWN)
+
 @dp.callback_query(lambda c: c.data.startswith("set_mode:"))
 async def mode_switch_callback(callback: types.CallbackQuery):
     mode = callback.data.split(":", 1)[1]
@@ -134,11 +164,11 @@ async def mode_switch_callback(callback: types.CallbackQuery):
         await callback.answer("Этот режим уже активен.")
         return
     set_current_mode(mode)
-    global worker_stats, worker_id_to_name
-    worker_stats = {}
-    worker_id_to_name = {}
-    await callback.message.edit_text(
+    await outbox.edit_message_text(
         f"✅ Режим переключён на *{mode}*",
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id,
+        priority=PRIORITY_REPLY,
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=build_mode_keyboard()
     )
@@ -187,8 +217,11 @@ async def settings_callback(callback: types.CallbackQuery):
     if chat_id not in authorized_chats:
         await callback.answer("❌ Доступ запрещён.")
         return
-    await callback.message.edit_text(
+    await outbox.edit_message_text(
         "⚙️ *Настройки*\nВыберите часовой пояс:",
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id,
+        priority=PRIORITY_REPLY,
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=build_settings_keyboard()
     )
@@ -202,8 +235,11 @@ async def set_timezone_callback(callback: types.CallbackQuery):
     user_settings[str(chat_id)] = {"timezone": timezone}
     save_user_settings(user_settings)
     await callback.answer(f"Часовой пояс установлен: {timezone}")
-    await callback.message.edit_text(
+    await outbox.edit_message_text(
         "✅ Часовой пояс обновлён.",
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id,
+        priority=PRIORITY_REPLY,
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=build_settings_keyboard()
     )
@@ -215,8 +251,11 @@ async def back_to_main_callback(callback: types.CallbackQuery):
     if chat_id not in authorized_chats:
         await callback.answer("❌ Доступ запрещён.")
         return
-    await callback.message.edit_text(
+    await outbox.edit_message_text(
         f"Текущий режим: *{get_current_mode()}*",
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id,
+        priority=PRIORITY_REPLY,
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=build_mode_keyboard()
     )
@@ -279,14 +318,16 @@ async def send_hashrate_report(chat_id: int):
                 continue
             last_hashrate = last_hashrates.get(name)
             if last_hashrate and hashrate < last_hashrate * 0.7:
-                message = await bot.send_message(
+                # Тревога уходит раньше отчётов и не ждёт отправки
+                outbox.send_message(
                     chat_id,
                     f"⚠️ *Внимание!* Хэшрейт сети *{name}* упал на {((last_hashrate - hashrate) / last_hashrate * 100):.2f}%!\n"
                     f"Текущий: `{format_hashrate(hashrate)}` | Предыдущий: `{format_hashrate(last_hashrate)}`",
+                    priority=PRIORITY_ALERT,
+                    delete_after=600,
                     parse_mode=ParseMode.MARKDOWN,
                     reply_markup=build_mode_keyboard()
                 )
-                asyncio.create_task(delete_message_later(chat_id, message.message_id))
         last_hashrates.update(hashrates)
         report = f"📊 *Хэшрейт всех сетей:*\n" + "\n".join(report_lines)
         if chat_id in last_hashrate_reports and last_hashrate_reports[chat_id] == report:
@@ -294,16 +335,17 @@ async def send_hashrate_report(chat_id: int):
         last_hashrate_reports[chat_id] = report
         if chat_id in last_message_ids:
             try:
-                await bot.edit_message_text(
+                await outbox.edit_message_text(
                     report,
                     chat_id=chat_id,
                     message_id=last_message_ids[chat_id],
+                    log_errors=False,
                     parse_mode=ParseMode.MARKDOWN,
                     reply_markup=build_mode_keyboard()
                 )
             except Exception as e:
                 if "message is not modified" not in str(e):
-                    message = await bot.send_message(
+                    message = await outbox.send_message(
                         chat_id,
                         report,
                         parse_mode=ParseMode.MARKDOWN,
@@ -311,7 +353,7 @@ async def send_hashrate_report(chat_id: int):
                     )
                     last_message_ids[chat_id] = message.message_id
         else:
-            message = await bot.send_message(
+            message = await outbox.send_message(
                 chat_id,
                 report,
                 parse_mode=ParseMode.MARKDOWN,
@@ -320,19 +362,16 @@ async def send_hashrate_report(chat_id: int):
             last_message_ids[chat_id] = message.message_id
 
 async def send_summary_report(chat_id: int):
-    await clear_previous_summary(chat_id)
+    clear_previous_summary(chat_id)
     current_mode = get_current_mode()
     pool_id = modes.get(current_mode, {"pool_id": f"{current_mode}-sha256-1"})["pool_id"]
-    real_workers = {
-        worker_name: stats for worker_name, stats in worker_stats.items()
-        if not worker_name.startswith("0HNCEBF7") and stats["hashrate"] > 0 and stats["pool_id"] == pool_id
-    }
     coin = modes.get(current_mode, {"coin": "Unknown"})["coin"]
     algorithm = modes.get(current_mode, {"algorithm": "Unknown"})["algorithm"]
-    total_hashrate = sum(stats["hashrate"] for stats in real_workers.values()) if real_workers else 0
-    worker_count = len(real_workers)
+    # Сумма и число воркеров с хэшрейтом ведутся реестром при каждом обновлении
+    total_hashrate, worker_count = pools[pool_id].workers.totals()
     blocks_today, blocks_per_hour = calculate_block_stats(pool_id)
-    last_block_time = format_timestamp(block_timestamps[pool_id][-1], chat_id) if pool_id in block_timestamps and block_timestamps[pool_id] else "Блоков не найдено"
+    last_block = pools[pool_id].blocks.last
+    last_block_time = format_timestamp(last_block, chat_id) if last_block else "Блоков не найдено"
     report = (
         f"📊 *Сводная статистика:*\n"
         f"Общий хэшрейт: `{format_hashrate(total_hashrate)}`\n"
@@ -344,9 +383,10 @@ async def send_summary_report(chat_id: int):
         f"Время последнего блока: `{last_block_time}`"
     )
     try:
-        message = await bot.send_message(
+        message = await outbox.send_message(
             chat_id,
             report,
+            log_errors=False,
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=build_mode_keyboard()
         )
@@ -356,17 +396,21 @@ async def send_summary_report(chat_id: int):
         logger.error(f"Ошибка при отправке сводного отчета: {e}")
 
 async def send_detailed_stats_report(chat_id: int):
-    await clear_previous_detailed_stats(chat_id)
+    clear_previous_detailed_stats(chat_id)
     report_lines = []
     for mode, info in modes.items():
         pool_id = info.get("pool_id", f"{mode}-sha256-1")
         coin = info["coin"]
         blocks_today, blocks_per_hour = calculate_block_stats(pool_id)
-        last_block_time = format_timestamp(block_timestamps[pool_id][-1], chat_id) if pool_id in block_timestamps and block_timestamps[pool_id] else "Блоков не найдено"
+        blocks = pools[pool_id].blocks
+        last_block_time = format_timestamp(blocks.last, chat_id) if blocks.last else "Блоков не найдено"
+        total_hashrate, worker_count = pools[pool_id].workers.totals()
         report_lines.append(
             f"*{coin}*:\n"
+            f"  Хэшрейт: `{format_hashrate(total_hashrate)}`, машин: `{worker_count}`\n"
             f"  Блоков за сутки: `{blocks_today}`\n"
-            f"  Блоков в час: `{blocks_per_hour:.2f}`\n"
+            f"  Блоков в час: `{blocks_per_hour:.2f}`, за последние 24 ч: `{blocks.rate(24 * 3600):.2f}`\n"
+            f"  Блоков за 7 дней: `{blocks.recent_days(7)}`, за 30 дней: `{blocks.recent_days(30)}`\n"
             f"  Последний блок: `{last_block_time}`"
         )
     report = f"📉 *Детализированная статистика блоков:*\n" + "\n".join(report_lines)
@@ -374,9 +418,10 @@ async def send_detailed_stats_report(chat_id: int):
         return
     last_detailed_stats_reports[chat_id] = report
     try:
-        message = await bot.send_message(
+        message = await outbox.send_message(
             chat_id,
             report,
+            log_errors=False,
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=build_mode_keyboard()
         )
@@ -385,7 +430,7 @@ async def send_detailed_stats_report(chat_id: int):
         logger.error(f"Ошибка при отправке детализированной статистики: {e}")
 
 async def send_worker_stats_report(chat_id: int):
-    await clear_previous_worker_stats(chat_id)
+    clear_previous_worker_stats(chat_id)
     current_mode = get_current_mode()
     pool_id = modes.get(current_mode, {"pool_id": f"{current_mode}-sha256-1"})["pool_id"]
 
@@ -399,32 +444,19 @@ async def send_worker_stats_report(chat_id: int):
     if alias and "alias" in modes[current_mode]:
         user_wallet = modes[current_mode]["alias"].get(alias)
 
+    workers = pools[pool_id].workers
+    # If superadmin, show all workers; otherwise only the user's wallet, via the wallet index
+    records = workers if chat_id == 1146015328 or not user_wallet else workers.wallet(user_wallet)
     real_workers = {}
-    for worker_name, stats in worker_stats.items():
-        # If superadmin, show all workers
-        if chat_id == 1146015328:
-            show = (
-                not worker_name.startswith("0HNCEBF7")
-                and stats["hashrate"] > 0
-                and stats["hashrate"] <= 500_000_000_000_000
-                and stats["pool_id"] == pool_id
-            )
-        else:
-            show = (
-                not worker_name.startswith("0HNCEBF7")
-                and stats["hashrate"] > 0
-                and stats["hashrate"] <= 500_000_000_000_000
-                and stats["pool_id"] == pool_id
-                and (not user_wallet or worker_name.startswith(user_wallet))
-            )
-        if show:
-            short_name = get_worker_short_name(worker_name)
-            if short_name not in real_workers or stats["last_seen"] > real_workers[short_name]["last_seen"]:
-                real_workers[short_name] = stats
+    for record in records:
+        if record.hashrate > 0:
+            current = real_workers.get(record.short_name)
+            if current is None or record.seen > current.seen:
+                real_workers[record.short_name] = record
 
     if not real_workers:
         report = f"📈 *Статистика воркеров ({pool_id}):*\nНет активных воркеров."
-        message = await bot.send_message(
+        message = await outbox.send_message(
             chat_id,
             report,
             parse_mode=ParseMode.MARKDOWN,
@@ -435,10 +467,10 @@ async def send_worker_stats_report(chat_id: int):
         return
     report_lines = []
     current_time = datetime.now(timezone.utc)
-    for worker_name, stats in sorted(real_workers.items()):
-        hashrate = stats["hashrate"]
-        last_seen = stats["last_seen"]
-        shares = stats["shares"]
+    for worker_name, record in sorted(real_workers.items()):
+        hashrate = record.hashrate
+        last_seen = record.last_seen
+        shares = record.shares
         time_diff = (current_time - last_seen).total_seconds()
         status = "✅ Активен" if time_diff < 600 else "⚠️ Неактивен"
         worker_report = (
@@ -466,59 +498,41 @@ async def send_worker_stats_report(chat_id: int):
         header = f"📈 *Статистика воркеров ({pool_id}, часть {part_number}):*\n" if part_number > 1 else f"📈 *Статистика воркеров ({pool_id}):*\n"
         messages.append(header + "\n".join(current_lines))
     full_report = "\n".join(messages)
-    new_message_ids = []
-    for i, message_text in enumerate(messages):
-        message = await bot.send_message(
+    # Части ставятся в очередь разом: в одном чате они уходят по порядку
+    sent = await asyncio.gather(*(
+        outbox.send_message(
             chat_id,
             message_text,
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=build_mode_keyboard() if i == len(messages) - 1 else None
         )
-        new_message_ids.append(message.message_id)
-    last_worker_stats_message_ids[chat_id] = new_message_ids
+        for i, message_text in enumerate(messages)
+    ))
+    last_worker_stats_message_ids[chat_id] = [message.message_id for message in sent]
     last_worker_stats_reports[chat_id] = full_report
     logger.info(f"Отправлена статистика воркеров для пула {pool_id}: {len(real_workers)} воркеров")
 
 async def monitor_workers():
     while True:
-        current_time = datetime.now(timezone.utc)
-        current_mode = get_current_mode()
-        current_pool_id = modes.get(current_mode, {"pool_id": f"{current_mode}-sha256-1"})["pool_id"]
-        # logger.info(f"monitor_workers: Checking workers, current_pool_id={current_pool_id}")
-        workers_to_remove = []
-        for worker_name, stats in list(worker_stats.items()):
-            last_seen = stats["last_seen"]
-            hashrate = stats["hashrate"]
-            pool_id = stats.get("pool_id", "unknown")
-            # --- STEP 3: Restore worker removal ---
-            if pool_id != current_pool_id:
-                # logger.info(f"Removing worker {worker_name}: pool_id mismatch ({pool_id} != {current_pool_id})")
-                workers_to_remove.append(worker_name)
-                continue
-            if (current_time - last_seen).total_seconds() > 600:
-                # logger.info(f"Removing worker {worker_name}: inactive for {(current_time - last_seen).total_seconds()} seconds")
-                workers_to_remove.append(worker_name)
-                continue
-            if hashrate > 500_000_000_000_000:
-                # logger.info(f"Removing worker {worker_name}: unrealistic hashrate {hashrate}")
-                workers_to_remove.append(worker_name)
-                continue
-        for worker_name in workers_to_remove:
-            if worker_name in worker_stats:
-                del worker_stats[worker_name]
-        unique_workers = {}
-        for worker_name, stats in list(worker_stats.items()):
-            short_name = get_worker_short_name(worker_name)
-            if short_name not in unique_workers or stats["last_seen"] > unique_workers[short_name]["last_seen"]:
-                unique_workers[short_name] = (worker_name, stats)
-                if short_name in unique_workers and unique_workers[short_name][0] != worker_name:
-                    logger.info(f"Удален дубликат воркера {unique_workers[short_name][0]} в пользу {worker_name}")
-                    del worker_stats[unique_workers[short_name][0]]
-        worker_stats.clear()
-        for worker_name, stats in unique_workers.values():
-            worker_stats[worker_name] = stats
+        # Молчащие воркеры убираются во всех пулах; воркеры других пулов остаются до возврата режима
+        pools.expire()
         await asyncio.sleep(60)
 
+def apply_worker_feed(entries):
+    """Хэшрейт и шары воркеров от прокси: (mode, wallet.worker, stats) -> воркеры пула режима."""
+    now = time.monotonic()
+    for mode, worker_name, stats in entries:
+        if worker_name.startswith("0HNCEBF7") or stats["hashrate"] > 500_000_000_000_000:
+            continue
+        state = pools.get(modes.get(mode, {"pool_id": f"{mode}-sha256-1"})["pool_id"])
+        if state is None:
+            continue
+        state.workers.set(worker_name, stats["hashrate"], stats["shares"], now - stats["last_share_age"])
+
+async def start_worker_feed():
+    worker_feed.subscribe(apply_worker_feed)
+    await worker_feed.listen()
+
 async def start_log_monitoring():
     from .log_parser import LogParser
     from watchdog.observers import Observer
@@ -533,13 +547,14 @@ async def start_log_monitoring():
         file_stat = os.stat(log_file_path)
         mtime = datetime.fromtimestamp(file_stat.st_mtime, tz=timezone.utc)
         logger.info(f"Log file {log_file_path} last modified: {mtime}")
+    # История до запуска — до наблюдателя: процессы пула не наследуют его поток
+    await event_handler.backfill()
     observer = Observer()
     observer.schedule(event_handler, path=log_dir, recursive=False)
     observer.start()
     logger.info(f"Watchdog observer started for {log_dir}")
     try:
-        while True:
-            await asyncio.sleep(1)
+        await event_handler.run()
     except asyncio.CancelledError:
         observer.stop()
         raise
@@ -555,6 +570,7 @@ async def shutdown():
         await asyncio.gather(*tasks, return_exceptions=True)
     except asyncio.CancelledError:
         pass
+    await outbox.close()
     await bot.session.close()
     logger.info("Сессия бота закрыта")
     loop = asyncio.get_running_loop()
@@ -565,11 +581,17 @@ async def main():
     from .utils import setup_logging
     setup_logging()
     logger.info("Запуск Telegram-бота...")
+    # Запросы к Telegram из очереди отправляет одна задача
+    outbox_task = asyncio.create_task(outbox.run())
     bot_task = asyncio.create_task(dp.start_polling(bot))
     log_task = asyncio.create_task(start_log_monitoring())
     worker_task = asyncio.create_task(monitor_workers())
+    # Хэшрейт воркеров считает прокси по принятым шарам; mcpool.log остаётся запасным источником
+    feed_task = asyncio.create_task(start_worker_feed())
+    # Режим берётся из памяти; опрос файла нужен только на случай правки current_mode.txt вручную
+    mode_task = asyncio.create_task(mode_state.watch())
     try:
-        await asyncio.gather(bot_task, log_task, worker_task)
+        await asyncio.gather(outbox_task, bot_task, log_task, worker_task, mode_task, feed_task)
     except asyncio.CancelledError:
         await shutdown()
         raise
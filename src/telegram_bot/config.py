@@ -2,12 +2,26 @@ import json
 import logging
 import os
 from datetime import datetime, timezone
+from ..mode_state import DEFAULT_MODE, get_mode_state
+from ..worker_feed import get_worker_feed
 
 logger = logging.getLogger(__name__)
 CONFIG_PATH = "/home/simple1/bot/config/config.json"
 USER_SETTINGS_PATH = "/home/simple1/bot/config/user_settings.json"
 CURRENT_MODE_PATH = "/home/simple1/bot/data/current_mode.txt"
 LAST_MODE_CHANGE_PATH = "/home/simple1/bot/data/last_mode_change.json"
+MODE_SOCKET_PATH = "/home/simple1/bot/data/mode.sock"
+WORKER_SOCKET_PATH = "/home/simple1/bot/data/workers.sock"
+ADMIN_SOCKET_PATH = "/home/simple1/bot/data/admin.sock"
+# Место, до которого разобран mcpool.log, и блоки/имена воркеров на тот момент: после перезапуска лог не перечитывается
+LOG_CHECKPOINT_PATH = "/home/simple1/bot/data/log_checkpoint.json"
+# Блоки пулов за двое суток и по дням: счётчики блоков переживают перезапуск бота
+BLOCK_HISTORY_PATH = "/home/simple1/bot/data/block_history.json"
+# Пока прокси присылает хэшрейт воркеров чаще, чем раз в WORKER_FEED_MAX_AGE секунд, строки
+# StatsRecorder и Share accepted из mcpool.log для worker_stats не используются
+WORKER_FEED_MAX_AGE = 120
+mode_state = get_mode_state(CURRENT_MODE_PATH, MODE_SOCKET_PATH)
+worker_feed = get_worker_feed(WORKER_SOCKET_PATH)
 
 def validate_config(config):
     required_fields = ["modes", "users", "nodes", "hashrate_log_path", "current_mode_path"]
@@ -92,20 +106,16 @@ def get_user_timezone(chat_id: int) -> str:
         return "Europe/Moscow"
 
 def get_current_mode():
-    try:
-        with open(CURRENT_MODE_PATH, "r", encoding="utf-8") as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        return "digi"
+    return mode_state.get()
 
 def set_current_mode(mode):
-    with open(CURRENT_MODE_PATH, "w", encoding="utf-8") as f:
-        f.write(mode)
+    # Пишет файл и сразу оповещает прокси: в памяти (один процесс) или через unix-сокет
+    mode_state.set(mode)
     set_last_mode_change_time(mode)
 
 def get_last_mode_change_time():
     default_time = datetime.now(timezone.utc)
-    default_mode = "digi"
+    default_mode = DEFAULT_MODE
     default_data = {"timestamp": default_time.isoformat(), "mode": default_mode}
     try:
         if not os.path.exists(LAST_MODE_CHANGE_PATH):
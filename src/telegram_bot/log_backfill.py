@@ -0,0 +1,230 @@
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from .log_lines import match_line
+
+logger = logging.getLogger(__name__)
+
+def rotated_files(path):
+    """Лог и его ротированные копии (path.1, path.2.gz, ...) от старых к новым; path — последний."""
+    directory, name = os.path.split(path)
+    pattern = re.compile(re.escape(name) + r"\.(\d+)(\.gz)?")
+    siblings = []
+    try:
+        entries = os.listdir(directory or ".")
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        match = pattern.fullmatch(entry)
+        if match:
+            siblings.append((int(match.group(1)), os.path.join(directory, entry)))
+    return [sibling for _, sibling in sorted(siblings, reverse=True)] + [path]
+
+def _line_end(f, offset, limit):
+    """Смещение начала первой строки не раньше offset (offset, если он уже на границе строки)."""
+    if offset == 0:
+        return 0
+    # Строка начинается с offset, если перед ним перевод строки: ищем первый, начиная с offset - 1
+    position = offset - 1
+    f.seek(position)
+    while position < limit:
+        block = f.read(64 << 10)
+        if not block:
+            break
+        newline = block.find(b"\n")
+        if newline >= 0:
+            return min(position + newline + 1, limit)
+        position += len(block)
+    return limit
+
+def _last_line_end(f, size):
+    """Смещение сразу после последнего перевода строки: незаконченную строку дочитает LogTail."""
+    end = size
+    while end > 0:
+        start = max(0, end - (64 << 10))
+        f.seek(start)
+        newline = f.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+def plan(path, chunk_size, since=None, inode=None, position=0):
+    """Задания для parse_range: (файл, начало, конец) в хронологическом порядке.
+
+    Файлы, не менявшиеся с since (unix time), пропускаются. Если inode найден среди несжатых
+    файлов, чтение начинается с position в нём, а более старые файлы не читаются (resumed=True).
+    Текущий лог читается до последнего перевода строки; возвращается и его (inode, конец) —
+    отсюда продолжает LogTail. .gz не делится и читается одним заданием.
+    """
+    files = []
+    for name in rotated_files(path):
+        try:
+            files.append((name, os.stat(name)))
+        except FileNotFoundError:
+            continue
+    resumed = False
+    if inode is not None:
+        for index, (name, stat) in enumerate(files):
+            if stat.st_ino == inode and not name.endswith(".gz") and stat.st_size >= position:
+                files, resumed = files[index:], True
+                break
+    tasks = []
+    current = (None, 0)
+    for index, (name, stat) in enumerate(files):
+        start = position if resumed and index == 0 else 0
+        if name.endswith(".gz"):
+            if since is None or stat.st_mtime >= since:
+                tasks.append((name, 0, None))
+            continue
+        if not resumed and since is not None and stat.st_mtime < since and name != path:
+            continue
+        with open(name, "rb") as f:
+            end = _last_line_end(f, stat.st_size) if name == path else stat.st_size
+            if name == path:
+                current = (stat.st_ino, end)
+            boundaries = [start]
+            offset = start + chunk_size
+            while offset < end:
+                aligned = _line_end(f, offset, end)
+                if aligned > boundaries[-1]:
+                    boundaries.append(aligned)
+                offset = aligned + chunk_size
+        boundaries.append(end)
+        tasks.extend((name, a, b) for a, b in zip(boundaries, boundaries[1:]) if b > a)
+    return tasks, resumed, current
+
+def parse_range(task):
+    """Разбор куска лога в процессе пула; в общее состояние результат сливает merge_results.
+
+    task — (файл, начало, конец, block_since, worker_since); since — строки времени в формате лога,
+    сравниваются со временем строки как строки. Возвращает блоки, последние имена воркеров
+    по (пул, id), шары и хэшрейт, найденные после worker_since.
+    """
+    path, start, end, block_since, worker_since = task
+    result = {"lines": 0, "bytes": 0, "blocks": [], "names": {}, "shares": {}, "hashrates": {}}
+    blocks, names, shares, hashrates = result["blocks"], result["names"], result["shares"], result["hashrates"]
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        if start:
+            f.seek(start)
+        remaining = end - start if end is not None else None
+        for raw in f:
+            if remaining is not None:
+                remaining -= len(raw)
+                if remaining < 0:
+                    break
+            result["lines"] += 1
+            result["bytes"] += len(raw)
+            if b"] [I] [" not in raw:
+                continue
+            event = match_line(raw.decode("utf-8", errors="replace"))
+            if event is None:
+                continue
+            kind, groups = event
+            stamp = groups[0]
+            if kind == "share":
+                _, pool_id, worker_id, _ = groups
+                if (worker_since is None or stamp >= worker_since) and not worker_id.startswith("0HNCEBF7"):
+                    entry = shares.get((pool_id, worker_id))
+                    if entry is None:
+                        shares[(pool_id, worker_id)] = [1, stamp]
+                    else:
+                        entry[0] += 1
+                        entry[1] = stamp
+            elif kind == "stats":
+                _, pool_id, worker_name, hashrate, unit, _ = groups
+                if (worker_since is None or stamp >= worker_since) and not worker_name.startswith("0HNCEBF7"):
+                    hashrate = float(hashrate) * {"T": 1e12, "P": 1e15, "G": 1e9}.get(unit, 1)
+                    if hashrate <= 500_000_000_000_000:
+                        hashrates[(pool_id, worker_name)] = (hashrate, stamp)
+            elif kind == "authorize":
+                _, pool_id, worker_id, worker_name = groups
+                if not worker_id.startswith("0HNCEBF7"):
+                    names[(pool_id, worker_id)] = (worker_name, stamp)
+            elif kind == "block":
+                if block_since is None or stamp >= block_since:
+                    blocks.append(groups)
+    return result
+
+def merge_results(results, worker_since=None):
+    """Сливает результаты parse_range в порядке заданий: более поздние куски важнее.
+
+    Возвращает lines, bytes, blocks (группы строки блока по порядку), names (пул -> id -> имя) и
+    workers: пул -> имя -> {hashrate, shares, last_seen (строка времени)}.
+    """
+    merged = {"lines": 0, "bytes": 0, "blocks": [], "names": {}, "workers": {}}
+    authorized = {}
+    shares = {}
+    hashrates = {}
+    for result in results:
+        merged["lines"] += result["lines"]
+        merged["bytes"] += result["bytes"]
+        merged["blocks"].extend(result["blocks"])
+        authorized.update(result["names"])
+        for key, (count, stamp) in result["shares"].items():
+            entry = shares.setdefault(key, [0, stamp])
+            entry[0] += count
+            entry[1] = stamp
+        hashrates.update(result["hashrates"])
+    names = merged["names"]
+    for (pool_id, worker_id), (name, _) in authorized.items():
+        names.setdefault(pool_id, {})[worker_id] = name
+    workers = merged["workers"]
+
+    def worker(name, pool_id, stamp):
+        pool_workers = workers.setdefault(pool_id, {})
+        entry = pool_workers.get(name)
+        if entry is None:
+            entry = pool_workers[name] = {"hashrate": 0, "shares": 0, "last_seen": stamp}
+        elif stamp > entry["last_seen"]:
+            entry["last_seen"] = stamp
+        return entry
+
+    for (pool_id, worker_id), (name, stamp) in authorized.items():
+        if worker_since is None or stamp >= worker_since:
+            worker(name, pool_id, stamp)
+    for (pool_id, worker_id), (count, stamp) in shares.items():
+        worker(names.get(pool_id, {}).get(worker_id, worker_id), pool_id, stamp)["shares"] += count
+    for (pool_id, name), (hashrate, stamp) in hashrates.items():
+        worker(name, pool_id, stamp)["hashrate"] = hashrate
+    return merged
+
+def backfill(tasks, processes, block_since=None, worker_since=None):
+    """Разбирает задания plan() в пуле из processes процессов (1 — в текущем) и сливает результат."""
+    tasks = [(path, start, end, block_since, worker_since) for path, start, end in tasks]
+    if processes <= 1 or len(tasks) <= 1:
+        results = [parse_range(task) for task in tasks]
+    else:
+        # spawn, а не fork: у бота уже работают поток записи логов и цикл событий, их замки в дочерний процесс не копируем
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks)), mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(parse_range, tasks))
+    return merge_results(results, worker_since)
+
+def load_checkpoint(path):
+    """Сохранённое место чтения лога и состояние на тот момент; None, если файла нет или он испорчен."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        int(checkpoint["inode"]), int(checkpoint["position"])
+        return checkpoint
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка при чтении {path}: {e}")
+        return None
+
+def save_checkpoint(path, checkpoint):
+    """Пишет через временный файл: при падении на диске остаётся предыдущая версия целиком."""
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except Exception as e:
+        logger.error(f"Ошибка при записи в {path}: {e}")
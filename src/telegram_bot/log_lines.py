@@ -0,0 +1,38 @@
+import re
+from datetime import datetime, timezone
+
+# Начало строки MiningCore: время и уровень. Время берётся как есть и разбирается только там,
+# где оно нужно (parse_timestamp); [^\]]+ вместо \S+? не даёт регулярке откатываться
+_PREFIX = r"\[([^\]]+)\] \[I\] "
+# (событие, метка, выражение) в порядке частоты: метка ищется обычным `in`, выражение запускается
+# только для строки с меткой. Строки без меток (а их в логе большинство) обходятся без регулярок
+LINE_PATTERNS = (
+    ("share", "] Share accepted: D=", re.compile(_PREFIX + r"\[([^\]\s]+)\] \[([A-Z0-9]+)\] Share accepted: D=([\d.]+)")),
+    ("stats", "[StatsRecorder] [", re.compile(
+        _PREFIX + r"\[StatsRecorder\] \[([^\]\s]+)\] Worker (\S+): ([\d.]+) ([TPG])H/s, ([\d.]+) shares/sec"
+    )),
+    ("authorize", "] Authorized worker ", re.compile(_PREFIX + r"\[([^\]\s]+)\] \[([A-Z0-9]+)\] Authorized worker (\S+)")),
+    ("block", "] Daemon accepted block ", re.compile(
+        _PREFIX + r"\[([^\]\s]+)\] Daemon accepted block (\d+) \[([0-9a-f]+)\] submitted by (\S+)"
+    )),
+)
+
+def match_line(line):
+    """(событие, группы) для строки лога, которую бот обрабатывает, иначе None.
+
+    Группы — как в LINE_PATTERNS; первая всегда время строки, ещё не разобранное.
+    """
+    for kind, tag, pattern in LINE_PATTERNS:
+        if tag in line:
+            match = pattern.search(line)
+            return (kind, match.groups()) if match else None
+    return None
+
+def parse_timestamp(text):
+    """Время из строки лога (UTC); None, если не разбирается."""
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(text, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    return None
@@ -1,23 +1,55 @@
 import asyncio
-import re
 import os
+import time
 from datetime import datetime, timezone, timedelta
 import logging
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from aiogram import Bot
 from aiogram.enums import ParseMode
-from .config import CONFIG, get_current_mode, modes
-from .utils import format_hashrate, format_timestamp, get_worker_short_name
+from .block_history import load_history, save_history
+from .config import BLOCK_HISTORY_PATH, CONFIG, LOG_CHECKPOINT_PATH, get_current_mode, modes, worker_feed, WORKER_FEED_MAX_AGE
+from .log_backfill import backfill, load_checkpoint, plan, save_checkpoint
+from .log_lines import match_line, parse_timestamp
+from .log_tail import LogTail
+from .telegram_outbox import PRIORITY_BLOCK, PRIORITY_NOTICE
+from .utils import format_hashrate, format_timestamp
+from .worker_registry import seen_at
 
 logger = logging.getLogger(__name__)
 LOG_FILE_PATH = "/home/simple1/bot/mcpool.log"
+# Чтение mcpool.log: кусками по chunk_size байт, отставание от mmap_threshold байт — через mmap
+LOG_SETTINGS = CONFIG.get("log_parser", {})
+# События watchdog за max_latency секунд сливаются в один разбор; без событий лог проверяется раз в poll_interval
+MAX_LATENCY = LOG_SETTINGS.get("max_latency", 0.5)
+POLL_INTERVAL = LOG_SETTINGS.get("poll_interval", 5.0)
+# Раз в столько строк разбор отдаёт управление циклу событий; раз в STATS_INTERVAL секунд — сводка в лог
+YIELD_EVERY = 5000
+STATS_INTERVAL = 60
+# При запуске блоки за backfill_hours часов и воркеры за WORKER_WINDOW секунд восстанавливаются из лога
+# и его ротированных копий: кусками по backfill_chunk байт в backfill_workers процессах; 0 часов — выключено
+BACKFILL_HOURS = LOG_SETTINGS.get("backfill_hours", 24)
+BACKFILL_CHUNK = LOG_SETTINGS.get("backfill_chunk", 32 << 20)
+BACKFILL_WORKERS = LOG_SETTINGS.get("backfill_workers", os.cpu_count() or 1)
+WORKER_WINDOW = 600
+# Место чтения сохраняется не реже раза в checkpoint_interval секунд и при остановке
+CHECKPOINT_INTERVAL = LOG_SETTINGS.get("checkpoint_interval", 60)
+LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Уведомление о подключении майнера, не ушедшее за столько секунд (очередь забита), уже не нужно
+NOTICE_TTL = CONFIG.get("telegram_outbox", {}).get("notice_ttl", 300)
 
 class LogParser(FileSystemEventHandler):
     def __init__(self, loop):
-        self.last_position = 0
-        self.active_workers = set()
+        self.tail = LogTail(
+            LOG_FILE_PATH, chunk_size=LOG_SETTINGS.get("chunk_size", 1 << 20),
+            mmap_threshold=LOG_SETTINGS.get("mmap_threshold", 64 << 20), use_mmap=LOG_SETTINGS.get("mmap", True),
+        )
         self.loop = loop
+        self.wakeup = asyncio.Event()
+        self.event_time = None  # monotonic() первого события watchdog, ещё не разобранного
+        self.missing = False
+        # Счётчики за окно сводки: события, разборы, строки, время разбора, задержка событие -> конец разбора
+        self.stats = {"events": 0, "drains": 0, "lines": 0, "parse_seconds": 0.0, "latency_total": 0.0, "latency_max": 0.0, "latency_count": 0}
         # logger.info(f"LogParser initialized with LOG_FILE_PATH: {LOG_FILE_PATH}")
 
     def on_modified(self, event):
@@ -25,146 +57,253 @@ class LogParser(FileSystemEventHandler):
         if event.src_path != LOG_FILE_PATH:
             # logger.info(f"Ignoring event for {event.src_path}, expected {LOG_FILE_PATH}")
             return
-        asyncio.run_coroutine_threadsafe(self.parse_log(), self.loop)
+        self.notify()
 
-    async def parse_log(self):
-        from .bot import bot, authorized_chats, build_mode_keyboard, delete_message_later, worker_stats, worker_id_to_name, block_timestamps
-        if not os.path.exists(LOG_FILE_PATH):
-            logger.error(f"Log file {LOG_FILE_PATH} does not exist.")
+    on_created = on_modified
+
+    def notify(self):
+        """Из потока watchdog: будит разбор. Пока разбор не начался, новые события ничего не добавляют."""
+        self.stats["events"] += 1
+        if self.event_time is None:
+            self.event_time = time.monotonic()
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        """Единственный потребитель лога: parse_log никогда не идёт в два потока.
+
+        Первое событие ждёт остальных не дольше MAX_LATENCY, затем один разбор забирает всё
+        дописанное. Без событий (например, watchdog пропустил ротацию) лог проверяется раз в POLL_INTERVAL.
+        """
+        next_report = time.monotonic() + STATS_INTERVAL
+        next_checkpoint = time.monotonic() + CHECKPOINT_INTERVAL
+        try:
+            while True:
+                finished = await self.drain()
+                if finished >= next_report:
+                    self.report_stats(finished - next_report + STATS_INTERVAL)
+                    next_report = finished + STATS_INTERVAL
+                if finished >= next_checkpoint:
+                    self.save_checkpoint()
+                    next_checkpoint = finished + CHECKPOINT_INTERVAL
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    continue
+                if self.event_time is not None:
+                    await asyncio.sleep(max(0.0, self.event_time + MAX_LATENCY - time.monotonic()))
+        finally:
+            self.save_checkpoint()
+
+    async def drain(self):
+        """Один разбор всего дописанного; возвращает monotonic() его окончания."""
+        self.wakeup.clear()
+        event_time, self.event_time = self.event_time, None
+        started = time.monotonic()
+        lines = await self.parse_log()
+        finished = time.monotonic()
+        stats = self.stats
+        stats["drains"] += 1
+        stats["lines"] += lines
+        stats["parse_seconds"] += finished - started
+        if event_time is not None:
+            stats["latency_total"] += finished - event_time
+            stats["latency_max"] = max(stats["latency_max"], finished - event_time)
+            stats["latency_count"] += 1
+        return finished
+
+    async def backfill(self):
+        """Восстанавливает блоки и воркеров всех пулов из уже записанного лога; LogTail продолжает с конца разобранного.
+
+        Блоки сначала берутся из BLOCK_HISTORY_PATH. Если есть контрольная точка и её файл ещё
+        не сжат, читается только дописанное после неё, а имена воркеров берутся из неё. Иначе —
+        все файлы, менявшиеся за BACKFILL_HOURS часов; блоки, уже учтённые в истории, по высоте
+        не считаются второй раз.
+        """
+        from .bot import pools
+        restored = load_history(BLOCK_HISTORY_PATH, pools)
+        if restored:
+            logger.info(f"История блоков: восстановлено блоков за двое суток: {restored}")
+        checkpoint = load_checkpoint(LOG_CHECKPOINT_PATH) or {}
+        if BACKFILL_HOURS <= 0:
+            # Без разбора истории — только продолжить с контрольной точки, если лог с тех пор не ротирован
+            if checkpoint:
+                self.tail.position, self.tail.inode = checkpoint["position"], checkpoint["inode"]
             return
+        now = datetime.now(timezone.utc)
+        since = now - timedelta(hours=BACKFILL_HOURS)
+        started = time.monotonic()
+        try:
+            tasks, resumed, (inode, end) = await asyncio.to_thread(
+                plan, LOG_FILE_PATH, BACKFILL_CHUNK, since.timestamp(), checkpoint.get("inode"), checkpoint.get("position", 0)
+            )
+            result = await asyncio.to_thread(
+                backfill, tasks, BACKFILL_WORKERS, since.strftime(LOG_TIME_FORMAT),
+                (now - timedelta(seconds=WORKER_WINDOW)).strftime(LOG_TIME_FORMAT)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при разборе истории лога: {e}")
+            return
+        names = [checkpoint.get("names", {}), result["names"]] if resumed else [result["names"]]
+        for pool_names in names:
+            for pool_id, worker_names in pool_names.items():
+                state = pools.get(pool_id)
+                if state is not None:
+                    for worker_id, worker_name in worker_names.items():
+                        pools.set_name(state, worker_id, worker_name)
+        blocks = 0
+        for timestamp_str, pool_id, block_height, *_ in result["blocks"]:
+            state = pools.get(pool_id)
+            timestamp = parse_timestamp(timestamp_str)
+            if state is not None and timestamp is not None and state.blocks.add(timestamp, block_height):
+                blocks += 1
+        workers = 0
+        for pool_id, pool_workers in result["workers"].items():
+            state = pools.get(pool_id)
+            if state is None:
+                continue
+            for worker_name, entry in pool_workers.items():
+                last_seen = parse_timestamp(entry["last_seen"])
+                if last_seen is None or worker_name in state.workers:
+                    continue
+                state.workers.set(worker_name, entry["hashrate"], entry["shares"], seen_at(last_seen))
+                workers += 1
+        if inode is not None:
+            self.tail.position, self.tail.inode = end, inode
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"История лога{' после контрольной точки' if resumed else ''}: кусков {len(tasks)}, строк {result['lines']}, "
+            f"{result['bytes'] / 2 ** 20:.0f} МБ за {elapsed:.1f} с; новых блоков {blocks}, воркеров {workers}"
+        )
+        self.save_checkpoint()
+
+    def save_checkpoint(self):
+        """Место чтения LogTail и имена воркеров всех пулов — в LOG_CHECKPOINT_PATH, блоки — в BLOCK_HISTORY_PATH."""
+        from .bot import pools
+        save_history(BLOCK_HISTORY_PATH, pools)
+        if self.tail.inode is None:
+            return
+        save_checkpoint(LOG_CHECKPOINT_PATH, {
+            "inode": self.tail.inode,
+            "position": self.tail.position,
+            "saved": datetime.now(timezone.utc).isoformat(),
+            "names": {state.pool_id: dict(state.names) for state in pools},
+        })
+
+    def report_stats(self, elapsed):
+        stats = self.stats
+        if stats["lines"] or stats["events"]:
+            latency = stats["latency_total"] / stats["latency_count"] if stats["latency_count"] else 0.0
+            logger.info(
+                f"Лог пула: {stats['lines']} строк за {elapsed:.0f} с ({stats['lines'] / elapsed:.0f} строк/с), "
+                f"событий {stats['events']}, разборов {stats['drains']}, разбор {stats['parse_seconds']:.2f} с, "
+                f"задержка событие -> разбор {latency * 1000:.0f} мс (макс. {stats['latency_max'] * 1000:.0f} мс)"
+            )
+        for key in stats:
+            stats[key] = 0 if isinstance(stats[key], int) else 0.0
+
+    async def parse_log(self):
+        """Разбирает всё, что дописано в лог с прошлого раза; возвращает число прочитанных строк.
+
+        Состояние ведётся для всех пулов из режимов; уведомления — только по пулу текущего режима.
+        """
+        from .bot import outbox, authorized_chats, build_mode_keyboard, pools
+        if self.tail.file is None and not os.path.exists(LOG_FILE_PATH):
+            if not self.missing:
+                logger.error(f"Log file {LOG_FILE_PATH} does not exist.")
+            self.missing = True
+            return 0
+        self.missing = False
+        count = 0
         try:
-            file_stat = os.stat(LOG_FILE_PATH)
-            mtime = datetime.fromtimestamp(file_stat.st_mtime, tz=timezone.utc)
             current_mode = get_current_mode()
             current_pool_id = modes.get(current_mode, {"pool_id": f"{current_mode}-sha256-1"})["pool_id"]
-            with open(LOG_FILE_PATH, "r", encoding="utf-8") as f:
-                f.seek(self.last_position)
-                lines = f.readlines()
-                self.last_position = f.tell()
-                if not lines:
-                    return
-                for line in lines:
-                    logger.debug(f"Processing log line: {line.strip()}")
-                    if f"[{current_pool_id}]" not in line:
+            # Хэшрейт и шары воркеров текущего пула присылает прокси; из лога берём их, только если прокси молчит
+            proxy_feed = worker_feed.active(WORKER_FEED_MAX_AGE)
+            # Одна отметка на разбор: строки одного разбора пришли почти одновременно
+            seen = time.monotonic()
+            for line in self.tail.lines():
+                count += 1
+                if count % YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+                event = match_line(line)
+                if event is None:
+                    continue
+                kind, groups = event
+                state = pools.get(groups[1])
+                if state is None:
+                    continue
+                pool_id = state.pool_id
+                if kind == "share":
+                    if proxy_feed and pool_id == current_pool_id:
                         continue
-                    if "[StatsRecorder]" in line and not re.search(r"Worker \S+: [\d.]+ [TPG]H/s", line):
-                        # logger.warning(f"StatsRecorder line not matched by hashrate regex: {line.strip()}")
-                        pass
-                    worker_connect = re.search(r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{1,6})\] \[I\] \[(\S+?)\] \[([A-Z0-9]+)\] Authorized worker (\S+)", line)
-                    if worker_connect:
-                        timestamp, pool_id, worker_id, worker_name = worker_connect.groups()
-                        if pool_id != current_pool_id:
-                            # logger.info(f"Skipping worker_connect due to pool_id mismatch: pool_id={pool_id}, expected={current_pool_id}")
-                            continue
-                        if worker_id.startswith("0HNCEBF7"):
-                            # logger.info(f"Skipping worker_connect: worker_id={worker_id} starts with 0HNCEBF7")
-                            continue
-                        worker_id_to_name[worker_id] = worker_name
-                        # logger.info(f"Mapped worker_id {worker_id} to worker_name {worker_name}")
-                        self.active_workers.add(worker_name)
-                        short_name = get_worker_short_name(worker_name)
-                        if worker_name not in worker_stats or (worker_stats[worker_name]["last_seen"] < datetime.now(timezone.utc) - timedelta(seconds=600)):
-                            worker_stats[worker_name] = {
-                                "hashrate": 0,
-                                "last_seen": datetime.now(timezone.utc),
-                                "shares": 0,
-                                "pool_id": pool_id
-                            }
-                            # logger.info(f"Worker connected: {short_name}, pool: {pool_id}")
-                            for chat_id in authorized_chats:
-                                message = await bot.send_message(
-                                    chat_id,
-                                    f"✅ *Майнер подключился!*\n"
-                                    f"ID: `{short_name}`\n"
-                                    f"Хэшрейт: `{format_hashrate(worker_stats[worker_name]['hashrate'])}`\n"
-                                    f"Шары приняты: `{worker_stats[worker_name]['shares']}`\n"
-                                    f"Время: `{format_timestamp(datetime.now(timezone.utc), chat_id)}`",
-                                    parse_mode=ParseMode.MARKDOWN,
-                                    reply_markup=build_mode_keyboard()
-                                )
-                                asyncio.create_task(delete_message_later(chat_id, message.message_id))
+                    _, _, worker_id, difficulty = groups
+                    if worker_id.startswith("0HNCEBF7"):
                         continue
-                    worker_stats_match = re.search(r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{1,6})\] \[I\] \[StatsRecorder\] \[(\S+?)\] Worker (\S+): ([\d.]+) ([TPG])H/s, ([\d.]+) shares/sec", line)
-                    if worker_stats_match:
-                        timestamp, pool_id, worker_name, hashrate, unit, shares = worker_stats_match.groups()
-                        if pool_id != current_pool_id:
-                            # logger.info(f"Skipping worker_stats due to pool_id mismatch: pool_id={pool_id}, expected={current_pool_id}")
-                            continue
-                        if worker_name.startswith("0HNCEBF7"):
-                            # logger.info(f"Skipping worker_stats: worker_name={worker_name} starts with 0HNCEBF7")
-                            continue
-                        hashrate = float(hashrate) * {"T": 1e12, "P": 1e15, "G": 1e9}.get(unit, 1)
-                        if hashrate > 500_000_000_000_000:
-                            # logger.warning(f"Unrealistic hashrate {hashrate} for worker {worker_name}, ignoring")
-                            continue
-                        worker_stats[worker_name] = {
-                            "hashrate": hashrate,
-                            "last_seen": datetime.now(timezone.utc),
-                            "shares": worker_stats.get(worker_name, {}).get("shares", 0),
-                            "pool_id": pool_id
-                        }
-                        self.active_workers.add(worker_name)
-                        # logger.info(f"Updated worker stats for {worker_name}: hashrate {format_hashrate(hashrate)}, shares {shares}")
+                    state.workers.touch(state.names.get(worker_id, worker_id), seen, shares=1)
+                elif kind == "stats":
+                    if proxy_feed and pool_id == current_pool_id:
                         continue
-                    share_accepted = re.search(r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{1,6})\] \[I\] \[(\S+?)\] \[([A-Z0-9]+)\] Share accepted: D=([\d.]+)", line)
-                    if share_accepted:
-                        timestamp, pool_id, worker_id, difficulty = share_accepted.groups()
-                        if pool_id != current_pool_id:
-                            # logger.info(f"Skipping share_accepted due to pool_id mismatch: pool_id={pool_id}, expected={current_pool_id}")
-                            continue
-                        if worker_id.startswith("0HNCEBF7"):
-                            # logger.info(f"Skipping share_accepted: worker_id={worker_id} starts with 0HNCEBF7")
-                            continue
-                        worker_name = worker_id_to_name.get(worker_id, worker_id)
-                        self.active_workers.add(worker_name)
-                        shares = worker_stats.get(worker_name, {}).get("shares", 0) + 1
-                        worker_stats[worker_name] = {
-                            "hashrate": worker_stats.get(worker_name, {}).get("hashrate", 0),
-                            "last_seen": datetime.now(timezone.utc),
-                            "shares": shares,
-                            "pool_id": pool_id
-                        }
-                        # logger.info(f"Share accepted for worker {worker_name}, total shares: {shares}")
+                    _, _, worker_name, hashrate, unit, shares = groups
+                    if worker_name.startswith("0HNCEBF7"):
+                        continue
+                    hashrate = float(hashrate) * {"T": 1e12, "P": 1e15, "G": 1e9}.get(unit, 1)
+                    if hashrate > 500_000_000_000_000:
                         continue
-                    block_found = re.search(
-                        r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d{1,6})?)\] \[I\] \[(\S+?)\] Daemon accepted block (\d+) \[([0-9a-f]+)\] submitted by (\S+)",
-                        line
-                    )
-                    if block_found:
-                        logger.info(f"Block regex matched: {line.strip()}")
-                        timestamp_str, pool_id, block_height, block_hash, miner = block_found.groups()
+                    state.workers.touch(worker_name, seen, hashrate=hashrate)
+                elif kind == "authorize":
+                    _, _, worker_id, worker_name = groups
+                    if worker_id.startswith("0HNCEBF7"):
+                        continue
+                    pools.set_name(state, worker_id, worker_name)
+                    record = state.workers.get(worker_name)
+                    if record is None or record.seen < seen - 600:
+                        record = state.workers.set(worker_name, 0, 0, seen)
                         if pool_id != current_pool_id:
-                            logger.debug(f"Block pool_id mismatch: {pool_id} != {current_pool_id}")
                             continue
-                        try:
-                            timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S.%f").replace(tzinfo=timezone.utc)
-                        except ValueError:
-                            try:
-                                timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
-                            except Exception as e:
-                                logger.error(f"Error parsing block timestamp '{timestamp_str}': {e}")
-                                continue
-                        if pool_id not in block_timestamps:
-                            block_timestamps[pool_id] = []
-                        block_timestamps[pool_id].append(timestamp)
-                        block_timestamps[pool_id] = [ts for ts in block_timestamps[pool_id] if (datetime.now(timezone.utc) - ts).total_seconds() <= 24 * 3600]
-                        logger.info(f"Block found! Height: {block_height}, Hash: {block_hash}, Miner: {miner}, Time: {timestamp}")
+                        # Разбор лога не ждёт Telegram: сообщения только ставятся в очередь
                         for chat_id in authorized_chats:
-                            report = f"🎉 *Блок найден!*\n" \
-                                     f"Сеть: `{pool_id}`\n" \
-                                     f"Высота: `{block_height}`\n" \
-                                     f"Хэш: `{block_hash[:8]}...`\n" \
-                                     f"Майнер: `{miner}`\n" \
-                                     f"Время: `{format_timestamp(timestamp, chat_id)}`"
-                            message = await bot.send_message(
+                            outbox.send_message(
                                 chat_id,
-                                report,
+                                f"✅ *Майнер подключился!*\n"
+                                f"ID: `{record.short_name}`\n"
+                                f"Хэшрейт: `{format_hashrate(record.hashrate)}`\n"
+                                f"Шары приняты: `{record.shares}`\n"
+                                f"Время: `{format_timestamp(datetime.now(timezone.utc), chat_id)}`",
+                                priority=PRIORITY_NOTICE,
+                                ttl=NOTICE_TTL,
+                                delete_after=600,
                                 parse_mode=ParseMode.MARKDOWN,
                                 reply_markup=build_mode_keyboard()
                             )
-                            logger.info(f"Block notification sent to chat {chat_id}")
-                            asyncio.create_task(delete_message_later(chat_id, message.message_id))
+                elif kind == "block":
+                    logger.info(f"Block regex matched: {line.strip()}")
+                    timestamp_str, _, block_height, block_hash, miner = groups
+                    timestamp = parse_timestamp(timestamp_str)
+                    if timestamp is None:
+                        logger.error(f"Error parsing block timestamp '{timestamp_str}'")
+                        continue
+                    if not state.blocks.add(timestamp, block_height):
+                        logger.info(f"Block {block_height} in pool {pool_id} already counted")
+                        continue
+                    logger.info(f"Block found! Pool: {pool_id}, Height: {block_height}, Hash: {block_hash}, Miner: {miner}, Time: {timestamp}")
+                    if pool_id != current_pool_id:
                         continue
-                    # logger.info(f"Line not matched by any pattern: {line.strip()}")
+                    for chat_id in authorized_chats:
+                        report = f"🎉 *Блок найден!*\n" \
+                                 f"Сеть: `{pool_id}`\n" \
+                                 f"Высота: `{block_height}`\n" \
+                                 f"Хэш: `{block_hash[:8]}...`\n" \
+                                 f"Майнер: `{miner}`\n" \
+                                 f"Время: `{format_timestamp(timestamp, chat_id)}`"
+                        outbox.send_message(
+                            chat_id,
+                            report,
+                            priority=PRIORITY_BLOCK,
+                            delete_after=600,
+                            parse_mode=ParseMode.MARKDOWN,
+                            reply_markup=build_mode_keyboard()
+                        )
+                        logger.info(f"Block notification queued for chat {chat_id}")
         except Exception as e:
-            logger.error(f"Error parsing log: {e}")
\ No newline at end of file
+            logger.error(f"Error parsing log: {e}")
+        return count
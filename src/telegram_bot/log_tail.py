@@ -0,0 +1,116 @@
+import logging
+import mmap
+import os
+
+logger = logging.getLogger(__name__)
+
+class LogTail:
+    """Дочитывает дописываемый лог с места, где остановился, кусками не больше chunk_size.
+
+    Файл читается в двоичном режиме; незаконченная последняя строка остаётся в partial и
+    дописывается следующим чтением. Ротация (по пути уже другой inode) — старый файл дочитывается
+    до конца, затем новый с начала; усечение (файл стал короче прочитанного) — чтение с начала.
+    Отставание больше mmap_threshold байт читается через mmap окнами по mmap_threshold.
+    Строки длиннее max_line пропускаются. position — смещение первого байта, строка с которого
+    ещё не отдана; его можно сохранить и передать при следующем запуске вместе с inode.
+    """
+
+    def __init__(self, path, chunk_size=1 << 20, max_line=64 << 10, mmap_threshold=64 << 20, use_mmap=True, position=0, inode=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.max_line = max_line
+        self.mmap_threshold = mmap_threshold
+        self.use_mmap = use_mmap
+        self.position = position
+        self.inode = inode  # inode, к которому относится position; None — любой
+        self.partial = b""
+        self.skipping = False  # дочитываем хвост слишком длинной строки
+        self.file = None
+        self.stats = {"lines": 0, "bytes": 0, "rotations": 0, "truncations": 0, "dropped": 0}
+
+    def lines(self):
+        """Строки (str без перевода строки), дописанные с прошлого вызова; отдаются по одной."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None  # старый файл уже переименован, новый ещё не создан
+        if self.file is None:
+            if stat is None:
+                return
+            self._open(stat)
+        elif stat is not None and stat.st_ino != self.inode:
+            yield from self._drain()
+            if self.partial and not self.skipping:
+                line, self.partial = self.partial, b""
+                self.position += len(line)
+                self.stats["lines"] += 1
+                yield line.decode("utf-8", errors="replace")
+            logger.info(f"Лог {self.path} ротирован, читаем новый файл с начала")
+            self.stats["rotations"] += 1
+            self.file.close()
+            self.position, self.inode = 0, None
+            self._open(stat)
+        yield from self._drain()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _open(self, stat):
+        if self.inode is not None and self.inode != stat.st_ino:
+            # Сохранённое смещение относится к другому файлу (лог ротирован, пока нас не было)
+            self.position = 0
+        self.file = open(self.path, "rb")
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.partial, self.skipping = b"", False
+
+    def _drain(self):
+        size = os.fstat(self.file.fileno()).st_size
+        offset = self.position + len(self.partial)
+        if size < offset:
+            logger.warning(f"Лог {self.path} усечён ({size} < {offset} байт), читаем с начала")
+            self.stats["truncations"] += 1
+            self.position, self.partial, self.skipping = 0, b"", False
+            offset = 0
+        if self.use_mmap and size - offset >= self.mmap_threshold:
+            # Окнами по mmap_threshold: страницы прочитанного окна освобождаются, RSS не растёт с отставанием
+            granularity = mmap.ALLOCATIONGRANULARITY
+            window = max(granularity, self.mmap_threshold - self.mmap_threshold % granularity)
+            window_start = offset - offset % granularity
+            while window_start < size:
+                length = min(window, size - window_start)
+                with mmap.mmap(self.file.fileno(), length, access=mmap.ACCESS_READ, offset=window_start) as mm:
+                    for start in range(offset - window_start, length, self.chunk_size):
+                        yield from self._split(mm[start:start + self.chunk_size])
+                window_start += length
+                offset = window_start
+        self.file.seek(offset)
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                return
+            yield from self._split(chunk)
+
+    def _split(self, data):
+        """Строки из очередного куска; хвост без перевода строки уходит в partial."""
+        self.stats["bytes"] += len(data)
+        lines = data.split(b"\n")
+        tail = lines.pop()
+        if lines and self.partial:
+            lines[0], self.partial = self.partial + lines[0], b""
+        stats = self.stats
+        for line in lines:
+            self.position += len(line) + 1
+            if self.skipping:
+                self.skipping = False
+                stats["dropped"] += 1
+                continue
+            stats["lines"] += 1
+            yield line.decode("utf-8", errors="replace")
+        if len(self.partial) + len(tail) > self.max_line:
+            # Строку без конца не копим: пропускаем её до следующего перевода строки
+            self.position += len(self.partial) + len(tail)
+            self.partial, self.skipping = b"", True
+        elif tail:
+            self.partial += tail
@@ -0,0 +1,53 @@
+import time
+
+from .block_history import BlockCounter
+from .worker_registry import WorkerRegistry
+
+class PoolState:
+    """Воркеры (WorkerRegistry), имена по id подключения MiningCore и счётчик блоков (BlockCounter) одного пула."""
+
+    __slots__ = ("pool_id", "workers", "names", "blocks")
+
+    def __init__(self, pool_id, max_workers=10000, history_days=365):
+        self.pool_id = pool_id
+        self.workers = WorkerRegistry(pool_id, max_workers)
+        self.names = {}
+        self.blocks = BlockCounter(history_days=history_days)
+
+class PoolStates:
+    """Состояние всех пулов из режимов конфига сразу: переключение режима меняет только, какой пул показан.
+
+    Строки пулов, которых нет в конфиге, не хранятся. У пула не больше max_workers воркеров
+    (лишние — дольше всех молчавшие) и max_names имён по id подключения (лишние — давно не обновлявшиеся).
+    """
+
+    def __init__(self, pool_ids, max_workers=10000, max_names=50000, history_days=365):
+        self.pools = {pool_id: PoolState(pool_id, max_workers, history_days) for pool_id in pool_ids}
+        self.max_names = max_names
+
+    def get(self, pool_id):
+        """PoolState пула или None, если пул не отслеживается."""
+        return self.pools.get(pool_id)
+
+    def __getitem__(self, pool_id):
+        # Пул режима, которого нет в конфиге, показывается пустым
+        state = self.pools.get(pool_id)
+        return state if state is not None else PoolState(pool_id)
+
+    def __iter__(self):
+        return iter(self.pools.values())
+
+    def set_name(self, state, worker_id, worker_name):
+        names = state.names
+        # Переставляем в конец: порядок словаря — порядок обновления
+        names.pop(worker_id, None)
+        names[worker_id] = worker_name
+        if len(names) > self.max_names:
+            for worker_id in list(names)[:len(names) - self.max_names + self.max_names // 10]:
+                del names[worker_id]
+
+    def expire(self, max_idle=600):
+        """Убирает во всех пулах молчащих дольше max_idle секунд и дубликаты одного воркера под разными именами."""
+        now = time.monotonic()
+        for state in self.pools.values():
+            state.workers.expire(now, max_idle)
@@ -0,0 +1,228 @@
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше — раньше. Внутри класса и чата — в порядке постановки
+PRIORITY_BLOCK = 0  # найден блок
+PRIORITY_ALERT = 1  # падение хэшрейта
+PRIORITY_REPLY = 2  # ответы на команды и кнопки: пользователь ждёт
+PRIORITY_NOTICE = 3  # майнер подключился
+PRIORITY_REPORT = 4  # отчёты
+PRIORITY_CLEANUP = 5  # удаление старых сообщений
+PRIORITY_NAMES = {
+    PRIORITY_BLOCK: "блоки", PRIORITY_ALERT: "тревоги", PRIORITY_REPLY: "ответы",
+    PRIORITY_NOTICE: "подключения", PRIORITY_REPORT: "отчёты", PRIORITY_CLEANUP: "удаления",
+}
+STATS_INTERVAL = 60
+
+class TokenBucket:
+    """rate запросов в секунду, до burst подряд."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def delay(self, now):
+        """Сколько секунд ждать до следующего запроса; 0 — можно сейчас."""
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class _Request:
+    __slots__ = ("priority", "seq", "method", "args", "kwargs", "future", "queued", "expires", "delete_after", "log_errors")
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class _Chat:
+    __slots__ = ("queue", "bucket", "blocked_until", "busy")
+
+    def __init__(self, rate, burst):
+        self.queue = []
+        self.bucket = TokenBucket(rate, burst)
+        self.blocked_until = 0.0
+        self.busy = False
+
+class Outbox:
+    """Единственный путь сообщений бота в Telegram: отправка, правка и удаление идут через очередь.
+
+    Вызов ставит запрос в очередь и сразу возвращает Future с ответом Telegram: кто не ждёт
+    результата, не ждёт и сети. Запросы уходят по приоритету, в одном чате — строго по очереди
+    и не чаще chat_rate в секунду (до chat_burst подряд), во все чаты — не чаще rate в секунду.
+    На 429 чат замолкает на retry_after секунд, запрос повторяется первым. Запрос с ttl,
+    не ушедший за ttl секунд, отбрасывается; при max_queue запросов в очереди такие
+    запросы не принимаются. delete_after — удалить отправленное сообщение через столько секунд.
+    """
+
+    def __init__(self, bot, rate=25.0, burst=30, chat_rate=1.0, chat_burst=3, max_queue=10000):
+        self.bot = bot
+        self.bucket = TokenBucket(rate, burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.chats = {}
+        self.queued = 0
+        self.seq = 0
+        self.wakeup = asyncio.Event()
+        self.stats = {"sent": 0, "failed": 0, "retries": 0, "dropped": 0}
+        self.waits = {}  # приоритет -> [запросов, сумма ожидания, максимум]
+        # Запросы в полёте: ссылка держит задачу, пока она не завершится, close() их дожидается
+        self.calls = set()
+
+    def send_message(self, chat_id, text, *, priority=PRIORITY_REPORT, ttl=None, delete_after=None, log_errors=True, **kwargs):
+        return self.submit("send_message", chat_id, (chat_id, text), kwargs, priority, ttl, delete_after, log_errors)
+
+    def edit_message_text(self, text, *, chat_id, message_id, priority=PRIORITY_REPORT, log_errors=True, **kwargs):
+        kwargs.update(chat_id=chat_id, message_id=message_id)
+        return self.submit("edit_message_text", chat_id, (text,), kwargs, priority, None, None, log_errors)
+
+    def delete_message(self, chat_id, message_id, *, priority=PRIORITY_CLEANUP, log_errors=True):
+        return self.submit("delete_message", chat_id, (), {"chat_id": chat_id, "message_id": message_id}, priority, None, None, log_errors)
+
+    def submit(self, method, chat_id, args, kwargs, priority, ttl, delete_after, log_errors):
+        future = asyncio.get_running_loop().create_future()
+        # Ошибку забирает тот, кто ждёт Future; иначе asyncio жаловался бы на невостребованное исключение
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        now = time.monotonic()
+        if ttl is not None and self.queued >= self.max_queue:
+            self.stats["dropped"] += 1
+            future.cancel()
+            return future
+        self.seq += 1
+        request = _Request()
+        request.priority, request.seq = priority, self.seq
+        request.method, request.args, request.kwargs = method, args, kwargs
+        request.future, request.queued = future, now
+        request.expires = now + ttl if ttl is not None else None
+        request.delete_after, request.log_errors = delete_after, log_errors
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = self.chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+        heapq.heappush(chat.queue, request)
+        self.queued += 1
+        self.wakeup.set()
+        return future
+
+    async def run(self):
+        next_report = time.monotonic() + STATS_INTERVAL
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= next_report:
+                    self.report_stats()
+                    next_report = now + STATS_INTERVAL
+                chat_id, wait = self._next(now)
+                if chat_id is None:
+                    # Таймер вместо wait_for: тот может проглотить отмену, если событие пришло одновременно с ней
+                    self.wakeup.clear()
+                    timer = asyncio.get_running_loop().call_later(min(wait, next_report - now) if wait is not None else next_report - now, self.wakeup.set)
+                    try:
+                        await self.wakeup.wait()
+                    finally:
+                        timer.cancel()
+                    continue
+                chat = self.chats[chat_id]
+                request = heapq.heappop(chat.queue)
+                self.queued -= 1
+                if request.future.done():
+                    continue
+                if request.expires is not None and now > request.expires:
+                    self.stats["dropped"] += 1
+                    request.future.cancel()
+                    continue
+                chat.bucket.take()
+                self.bucket.take()
+                chat.busy = True
+                waits = self.waits.setdefault(request.priority, [0, 0.0, 0.0])
+                wait = now - request.queued
+                waits[0] += 1
+                waits[1] += wait
+                waits[2] = max(waits[2], wait)
+                call = asyncio.create_task(self._call(chat_id, chat, request))
+                self.calls.add(call)
+                call.add_done_callback(self.calls.discard)
+        finally:
+            for chat in self.chats.values():
+                for request in chat.queue:
+                    request.future.cancel()
+                chat.queue.clear()
+            self.queued = 0
+
+    async def close(self):
+        """Отменяет запросы в полёте и дожидается их задач: вызывать до закрытия сессии бота."""
+        calls = list(self.calls)
+        for call in calls:
+            call.cancel()
+        await asyncio.gather(*calls, return_exceptions=True)
+
+    def _next(self, now):
+        """(чат, None) — чат, чей запрос уходит следующим; (None, секунд) — раньше ничего не уйдёт."""
+        global_delay = self.bucket.delay(now)
+        best = None
+        wait = None
+        for chat_id, chat in self.chats.items():
+            if chat.busy or not chat.queue:
+                continue
+            ready = max(chat.blocked_until - now, chat.bucket.delay(now), global_delay)
+            if ready > 0:
+                wait = ready if wait is None else min(wait, ready)
+            elif best is None or chat.queue[0] < self.chats[best].queue[0]:
+                best = chat_id
+        return (best, None) if best is not None else (None, wait)
+
+    async def _call(self, chat_id, chat, request):
+        try:
+            result = await getattr(self.bot, request.method)(*request.args, **request.kwargs)
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                # Запрос остаётся первым в своём классе: номер в очереди прежний
+                logger.warning(f"Telegram: лимит запросов в чате {chat_id}, пауза {retry_after} с")
+                chat.blocked_until = time.monotonic() + retry_after
+                heapq.heappush(chat.queue, request)
+                self.queued += 1
+                self.stats["retries"] += 1
+            else:
+                self.stats["failed"] += 1
+                if request.log_errors:
+                    logger.warning(f"Telegram {request.method} в чате {chat_id} не выполнен: {e}")
+                if not request.future.done():
+                    request.future.set_exception(e)
+        else:
+            self.stats["sent"] += 1
+            if not request.future.done():
+                request.future.set_result(result)
+            if request.delete_after is not None:
+                asyncio.get_running_loop().call_later(request.delete_after, self.delete_message, chat_id, result.message_id)
+        finally:
+            chat.busy = False
+            self.wakeup.set()
+
+    def report_stats(self):
+        stats = self.stats
+        if not any(stats.values()) and not self.waits:
+            return
+        waits = ", ".join(
+            f"{PRIORITY_NAMES.get(priority, priority)} {count} (ожидание {total / count:.2f} с, макс. {peak:.2f} с)"
+            for priority, (count, total, peak) in sorted(self.waits.items())
+        )
+        logger.info(
+            f"Очередь Telegram: отправлено {stats['sent']}, ошибок {stats['failed']}, повторов после 429 {stats['retries']}, "
+            f"отброшено {stats['dropped']}, в очереди {self.queued}; {waits or 'запросов не было'}"
+        )
+        for key in stats:
+            stats[key] = 0
+        self.waits.clear()
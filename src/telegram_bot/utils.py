@@ -1,12 +1,14 @@
 import logging
 from datetime import datetime, timezone
 import pytz
+from ..log_queue import setup_queue_logging
 from .config import TIMEZONES, get_user_timezone
 
 logger = logging.getLogger(__name__)
 
 def setup_logging():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Как у прокси: запись логов в отдельном потоке, повторы с одной строки кода ограничены
+    setup_queue_logging(logging.INFO)
 
 def format_timestamp(dt: datetime, chat_id: int) -> str:
     tz_name = get_user_timezone(chat_id)
@@ -0,0 +1,181 @@
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from .utils import get_worker_short_name
+
+logger = logging.getLogger(__name__)
+
+def seen_at(moment):
+    """monotonic() для времени moment (datetime с часовым поясом)."""
+    return time.monotonic() - (datetime.now(timezone.utc) - moment).total_seconds()
+
+def seen_datetime(seen):
+    """Время UTC для отметки monotonic(); для отчётов."""
+    return datetime.now(timezone.utc) - timedelta(seconds=time.monotonic() - seen)
+
+class WorkerRecord:
+    """Воркер пула; обновляется на месте. seen — monotonic() последней строки или шары."""
+
+    __slots__ = ("name", "short_name", "wallet", "hashrate", "shares", "seen", "_seq")
+
+    def __init__(self, name, seen):
+        self.name = name
+        self.short_name = get_worker_short_name(name)
+        self.wallet = name.rsplit(".", 1)[0]
+        self.hashrate = 0
+        self.shares = 0
+        self.seen = seen
+        self._seq = 0
+
+    @property
+    def last_seen(self):
+        return seen_datetime(self.seen)
+
+class WorkerRegistry:
+    """Воркеры одного пула: по имени, по короткому имени (get_worker_short_name) и по кошельку.
+
+    Молчащие находятся по куче (seen, номер, запись) без обхода всех воркеров: обновление
+    записи кучу не трогает, устаревший элемент при извлечении просто кладётся обратно со свежим
+    seen. Сумма хэшрейта и число воркеров с хэшрейтом ведутся при каждом изменении.
+    Больше max_workers воркеров не хранится: лишние — дольше всех молчавшие.
+    """
+
+    def __init__(self, pool_id, max_workers=10000):
+        self.pool_id = pool_id
+        self.max_workers = max_workers
+        self.records = {}
+        self.by_short = {}
+        self.by_wallet = {}
+        self.duplicates = set()  # короткие имена, под которыми больше одного воркера
+        self.heap = []
+        self.seq = 0
+        self.hashrate = 0.0
+        self.hashing = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def get(self, name):
+        return self.records.get(name)
+
+    def wallet(self, wallet):
+        """Воркеры кошелька (имя до последней точки)."""
+        return list(self.by_wallet.get(wallet, {}).values())
+
+    def totals(self):
+        """(суммарный хэшрейт, число воркеров с ненулевым хэшрейтом)."""
+        return (self.hashrate if self.hashing else 0.0), self.hashing
+
+    def touch(self, name, seen, hashrate=None, shares=0):
+        """Строка воркера: seen, при hashrate — новый хэшрейт, shares — сколько шар прибавить."""
+        record = self.records.get(name)
+        if record is None:
+            record = self._add(name, seen)
+        elif seen > record.seen:
+            record.seen = seen
+        if hashrate is not None:
+            self._set_hashrate(record, hashrate)
+        record.shares += shares
+        return record
+
+    def set(self, name, hashrate, shares, seen):
+        """Задаёт воркера целиком (подключение, данные прокси, разбор истории)."""
+        record = self.records.get(name)
+        if record is None:
+            record = self._add(name, seen)
+        elif seen < record.seen:
+            # Элемент кучи стал бы позже срока: кладём новый, старый пропустится при извлечении
+            record.seen = seen
+            self._push(record)
+        record.seen = seen
+        record.shares = shares
+        self._set_hashrate(record, hashrate)
+        return record
+
+    def remove(self, name):
+        record = self.records.pop(name, None)
+        if record is None:
+            return
+        self._set_hashrate(record, 0)
+        names = self.by_short[record.short_name]
+        del names[name]
+        if not names:
+            del self.by_short[record.short_name]
+        names = self.by_wallet[record.wallet]
+        del names[name]
+        if not names:
+            del self.by_wallet[record.wallet]
+
+    def expire(self, now, max_idle=600):
+        """Убирает молчащих дольше max_idle секунд (now — monotonic()) и дубликаты коротких имён."""
+        self._pop(lambda seen: seen < now - max_idle, None)
+        for short_name in self.duplicates:
+            names = self.by_short.get(short_name, {})
+            if len(names) < 2:
+                continue
+            latest = max(names.values(), key=lambda record: record.seen)
+            for record in list(names.values()):
+                if record is not latest:
+                    logger.info(f"Удален дубликат воркера {record.name} в пользу {latest.name}")
+                    self.remove(record.name)
+        self.duplicates.clear()
+
+    def _add(self, name, seen):
+        record = WorkerRecord(name, seen)
+        self.records[name] = record
+        names = self.by_short.setdefault(record.short_name, {})
+        names[name] = record
+        if len(names) > 1:
+            self.duplicates.add(record.short_name)
+        self.by_wallet.setdefault(record.wallet, {})[name] = record
+        self._push(record)
+        if len(self.records) > self.max_workers:
+            # Вытесняем сразу десятую часть: поиск самых старых не повторяется на каждой строке
+            count = len(self.records) - self.max_workers + self.max_workers // 10
+            self._pop(lambda seen: True, count, keep=record)
+            logger.warning(f"Пул {self.pool_id}: больше {self.max_workers} воркеров, вытеснено {count} давно молчавших")
+        return record
+
+    def _push(self, record):
+        self.seq += 1
+        record._seq = self.seq
+        heapq.heappush(self.heap, (record.seen, self.seq, record))
+
+    def _pop(self, due, count, keep=None):
+        """Снимает с кучи записи, пока due(seen) истинно; не больше count удалений (None — без предела)."""
+        heap = self.heap
+        kept = False
+        while heap and (count is None or count > 0) and due(heap[0][0]):
+            seen, seq, record = heapq.heappop(heap)
+            if self.records.get(record.name) is not record or record._seq != seq:
+                continue  # запись уже удалена или в куче есть её более свежий элемент
+            if record is keep:
+                kept = True
+                continue
+            if record.seen > seen:
+                self._push(record)
+                continue
+            self.remove(record.name)
+            if count is not None:
+                count -= 1
+        if kept:
+            self._push(keep)
+
+    def _set_hashrate(self, record, hashrate):
+        if record.hashrate > 0:
+            self.hashrate -= record.hashrate
+            self.hashing -= 1
+        record.hashrate = hashrate
+        if hashrate > 0:
+            self.hashrate += hashrate
+            self.hashing += 1
+        elif not self.hashing:
+            self.hashrate = 0.0  # без накопленной ошибки округления
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+# Записи режут на датаграммы не больше этого размера, чтобы не упереться в лимит unix-сокета
+MAX_DATAGRAM = 32 * 1024
+
+class WorkerFeed:
+    """Канал статистики воркеров от прокси к боту.
+
+    Прокси вызывает publish(entries), где entries — список (mode, worker, stats). Если в этом же
+    процессе есть подписчики (main.py запускает прокси и бота вместе), они получают записи сразу.
+    Иначе записи уходят JSON-датаграммами в unix-сокет socket_path, который слушает listen() у бота.
+    """
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path
+        self.last_update = None  # monotonic() последних полученных данных
+        self._subscribers = []  # (loop, callback)
+
+    def subscribe(self, callback):
+        """callback(entries) вызывается в цикле подписчика на каждую порцию записей. Возвращает функцию отписки."""
+        entry = (asyncio.get_running_loop(), callback)
+        self._subscribers.append(entry)
+
+        def unsubscribe():
+            if entry in self._subscribers:
+                self._subscribers.remove(entry)
+        return unsubscribe
+
+    def active(self, max_age):
+        """True, если данные приходили не позже max_age секунд назад."""
+        return self.last_update is not None and time.monotonic() - self.last_update <= max_age
+
+    def publish(self, entries):
+        if self._subscribers:
+            self._deliver(entries)
+            return
+        if not self.socket_path or not hasattr(socket, "AF_UNIX"):
+            return
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+                sock.setblocking(False)
+                for payload in self._encode(entries):
+                    sock.sendto(payload, self.socket_path)
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+            # Бот не запущен или не успевает читать — следующая публикация всё равно перезапишет данные
+            pass
+        except OSError as e:
+            logger.warning(f"Не удалось отправить статистику воркеров в {self.socket_path}: {e}")
+
+    def _encode(self, entries):
+        # Размер датаграммы считаем в байтах UTF-8: кириллица в имени воркера — два байта на символ
+        chunk, size = [], 2
+        for entry in entries:
+            encoded = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+            if chunk and size + len(encoded) + 1 > MAX_DATAGRAM:
+                yield b"[" + b",".join(chunk) + b"]"
+                chunk, size = [], 2
+            chunk.append(encoded)
+            size += len(encoded) + 1
+        if chunk:
+            yield b"[" + b",".join(chunk) + b"]"
+
+    def _deliver(self, entries):
+        self.last_update = time.monotonic()
+        for loop, callback in list(self._subscribers):
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(callback, entries)
+
+    async def listen(self):
+        """Принимает датаграммы прокси до отмены задачи."""
+        if not self.socket_path or not hasattr(socket, "AF_UNIX"):
+            return
+        feed = self
+
+        class _Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                try:
+                    entries = json.loads(data)
+                except ValueError as e:
+                    logger.warning(f"Некорректная датаграмма статистики воркеров: {e}")
+                    return
+                feed._deliver([tuple(entry) for entry in entries])
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(_Protocol, local_addr=self.socket_path, family=socket.AF_UNIX)
+        logger.info(f"Слушаем статистику воркеров от прокси на {self.socket_path}")
+        try:
+            await asyncio.Future()
+        finally:
+            transport.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+_feeds = {}
+
+def get_worker_feed(socket_path):
+    """Один WorkerFeed на сокет, чтобы прокси и бот в одном процессе делили подписчиков."""
+    if socket_path not in _feeds:
+        _feeds[socket_path] = WorkerFeed(socket_path)
+    return _feeds[socket_path]
@@ -0,0 +1,202 @@
+"""Своя сложность майнеров общей сессии: сложность шары по заголовку sha256d и решение, куда шара идёт."""
+import asyncio
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts", "loadtest"))
+
+from fake_pool import FakePool  # noqa: E402
+from src.stratum_proxy.aggregator import Aggregator, AuthorizationError  # noqa: E402
+from src.stratum_proxy.difficulty import DIFF1, Job, MinerDifficulty  # noqa: E402
+from src.stratum_proxy.metrics import SessionMetrics, metrics  # noqa: E402
+
+# Генезис-блок Bitcoin: coinbase целиком, заголовок и его хэш
+GENESIS_COINBASE = (
+    "01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff4d04ffff001d0104455468652054696d"
+    "65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420666f72"
+    "2062616e6b73ffffffff0100f2052a01000000434104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6"
+    "bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000"
+)
+GENESIS_HASH = 0x000000000019D6689C085AE165831E934FF763AE46A2A6C172B3F1B60A8CE26F
+
+def test_share_difficulty_of_genesis_header():
+    # extranonce1 и extranonce2 — 8 байт из середины scriptSig, остальное — coinb1 и coinb2
+    coinb1, extranonce1, extranonce2, coinb2 = (
+        GENESIS_COINBASE[:100], GENESIS_COINBASE[100:108], GENESIS_COINBASE[108:116], GENESIS_COINBASE[116:],
+    )
+    job = Job(["1", "00" * 32, coinb1, coinb2, [], "00000001", "1d00ffff", "495fab29", True])
+    difficulty = job.share_difficulty(extranonce1, extranonce2, f"{1231006505:08x}", f"{2083236893:08x}")
+    assert difficulty == DIFF1 / GENESIS_HASH
+
+def test_version_rolling_only_changes_masked_bits():
+    coinb1, coinb2 = GENESIS_COINBASE[:100], GENESIS_COINBASE[116:]
+    job = Job(["1", "00" * 32, coinb1, coinb2, [], "00000001", "1d00ffff", "495fab29", True])
+    share = (GENESIS_COINBASE[100:108], GENESIS_COINBASE[108:116], f"{1231006505:08x}", f"{2083236893:08x}")
+    assert job.share_difficulty(*share, "1fffe000", 0) == DIFF1 / GENESIS_HASH
+    assert job.share_difficulty(*share, "00002000", 0x1fffe000) != DIFF1 / GENESIS_HASH
+
+def test_vardiff_raises_difficulty_of_a_fast_miner_up_to_pool():
+    state = MinerDifficulty(100.0, 10.0, 1.0, now=0.0)
+    retargets = [state.record(True, i * 0.1, 250.0) for i in range(1, 17)]
+    assert retargets[:-1] == [None] * 15
+    assert retargets[-1] == 250.0
+
+def test_previous_difficulty_holds_until_next_job():
+    state = MinerDifficulty(100.0, 10.0, 1.0, now=0.0)
+    state.set(400.0)
+    assert state.accepts(150.0)
+    state.new_job()
+    assert not state.accepts(150.0)
+
+def test_miner_failing_most_checks_is_unreliable():
+    state = MinerDifficulty(100.0, 10.0, 1.0, now=0.0)
+    for _ in range(40):
+        state.record(False, 1.0, 1000.0)
+    assert state.unreliable
+
+class _Client:
+    upstream = None
+
+    def touch(self):
+        pass
+
+    def authorize(self, alias, user):
+        pass
+
+async def _aggregate_session(pool, miners):
+    async def open_upstream(mode):
+        reader, writer = await asyncio.open_connection("127.0.0.1", pool.port)
+        return reader, writer, ("127.0.0.1", pool.port)
+
+    aggregator = Aggregator(open_upstream, share_interval=10.0, min_difficulty=1e-12, algorithm=lambda mode: "sha256d")
+
+    async def handle(reader, writer):
+        lines, wallet = await aggregator.peek_wallet(reader, {"check": "DCheckWallet"}, 0.5)
+        session = SessionMetrics("check")
+        await aggregator.serve(reader, writer, writer.get_extra_info("peername"), "check", wallet, {"check": "DCheckWallet"}, session, _Client(), lines=lines)
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    connections = []
+    for i in range(miners):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        writer.write(
+            b'{"id": 1, "method": "mining.subscribe", "params": []}\n'
+            + f'{{"id": 2, "method": "mining.authorize", "params": ["check.rig{i}", "x"]}}\n'.encode()
+        )
+        connections.append((reader, writer))
+    return aggregator, server, connections
+
+async def _read_until(reader, predicate):
+    while True:
+        msg = json.loads(await asyncio.wait_for(reader.readline(), 5))
+        if predicate(msg):
+            return msg
+
+def test_aggregate_session_forwards_only_shares_meeting_pool_difficulty():
+    async def scenario():
+        # Шара сложности пула находится примерно за 16 nonce: сценарий перебирает их сам
+        pool = await FakePool("check", notify_interval=0, difficulty=2 ** -28).start()
+        aggregator, server, connections = await _aggregate_session(pool, miners=2)
+        reader, writer = connections[1]
+        subscribe = await _read_until(reader, lambda msg: msg.get("id") == 1)
+        extranonce1, extranonce2_size = subscribe["result"][1], subscribe["result"][2]
+        difficulty = (await _read_until(reader, lambda msg: msg.get("method") == "mining.set_difficulty"))["params"][0]
+        notify = (await _read_until(reader, lambda msg: msg.get("method") == "mining.notify"))["params"]
+        job, extranonce2 = Job(notify), "00" * extranonce2_size
+        nonces, nonce = {}, 0
+        while len(nonces) < 3:
+            nonce += 1
+            share_difficulty = job.share_difficulty(extranonce1, extranonce2, notify[7], f"{nonce:08x}")
+            kind = "pool" if share_difficulty >= pool.difficulty else "local" if share_difficulty >= difficulty else "low"
+            nonces.setdefault(kind, nonce)
+        replies = {}
+        for msg_id, (kind, nonce) in enumerate(sorted(nonces.items()), 10):
+            params = ["check.rig1", notify[0], extranonce2, notify[7], f"{nonce:08x}"]
+            writer.write(json.dumps({"id": msg_id, "method": "mining.submit", "params": params}).encode() + b"\n")
+            reply = await _read_until(reader, lambda msg: msg.get("id") == msg_id)
+            replies[kind] = (reply["result"], reply["error"])
+        for _, miner_writer in connections:
+            miner_writer.close()
+        await aggregator.close()
+        server.close()
+        await pool.stop()
+        return difficulty, pool, replies
+
+    difficulty, pool, replies = asyncio.run(scenario())
+    # Два майнера в сессии: каждый начинает с половины сложности пула
+    assert difficulty == pool.difficulty / 2
+    assert replies == {"pool": (True, None), "local": (True, None), "low": (None, [23, "Low difficulty share", None])}
+    assert pool.submits == 1
+    assert metrics.shares[("check", "DCheckWallet.rig1", "accepted")] == 2
+    assert metrics.shares[("check", "DCheckWallet.rig1", "low_difficulty")] == 1
+
+def test_aggregate_session_answers_malformed_extranonce2_itself():
+    async def scenario():
+        pool = await FakePool("check", notify_interval=0).start()
+        aggregator, server, connections = await _aggregate_session(pool, miners=1)
+        reader, writer = connections[0]
+        extranonce2_size = (await _read_until(reader, lambda msg: msg.get("id") == 1))["result"][2]
+        job_id = (await _read_until(reader, lambda msg: msg.get("method") == "mining.notify"))["params"][0]
+        replies = []
+        for msg_id, extranonce2 in enumerate(["00" * (extranonce2_size + 1), "zz" * extranonce2_size, 7], 10):
+            params = ["check.rig0", job_id, extranonce2, "5f5e1000", "00000001"]
+            writer.write(json.dumps({"id": msg_id, "method": "mining.submit", "params": params}).encode() + b"\n")
+            replies.append((await _read_until(reader, lambda msg: msg.get("id") == msg_id))["error"])
+        writer.close()
+        await aggregator.close()
+        server.close()
+        await pool.stop()
+        return pool, replies
+
+    pool, replies = asyncio.run(scenario())
+    assert replies == [[20, "Invalid params", None]] * 3
+    assert pool.submits == 0
+
+def test_wallet_refused_by_pool_gets_pool_error_once_per_ttl():
+    connects = 0
+
+    async def refusing_pool(reader, writer):
+        nonlocal connects
+        connects += 1
+        while line := await reader.readline():
+            msg = json.loads(line)
+            if msg["id"] == 2:
+                writer.write(b'{"id": 2, "result": [[], "00000001", 4], "error": null}\n')
+            elif msg["id"] == 3:
+                writer.write(b'{"id": 3, "result": null, "error": [24, "Unauthorized worker", null]}\n')
+        writer.close()
+
+    class Writer:
+        def __init__(self):
+            self.data = b""
+
+        def write(self, data):
+            self.data += data
+
+    async def scenario():
+        server = await asyncio.start_server(refusing_pool, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def open_upstream(mode):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            return reader, writer, ("127.0.0.1", port)
+
+        aggregator = Aggregator(open_upstream)
+        replies = []
+        for _ in range(2):
+            writer = Writer()
+            lines = [b'{"id": 1, "method": "mining.subscribe", "params": []}\n', b'{"id": 7, "method": "mining.authorize", "params": ["bad.rig"]}\n']
+            try:
+                await aggregator.serve(None, writer, ("127.0.0.1", 1), "check", "bad", {}, None, _Client(), lines=lines)
+            except AuthorizationError:
+                pass
+            replies.append(json.loads(writer.data))
+        server.close()
+        return replies
+
+    replies = asyncio.run(scenario())
+    assert replies == [{"id": 7, "result": None, "error": [24, "Unauthorized worker", None]}] * 2
+    assert connects == 1
@@ -0,0 +1,27 @@
+"""Учёт шар сессии: сопоставление submit с ответами пула."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.stratum_proxy import metrics as metrics_module  # noqa: E402
+from src.stratum_proxy.metrics import MAX_PENDING_SUBMITS, SUBMIT_TIMEOUT, SessionMetrics, metrics  # noqa: E402
+
+def _submits(first, count):
+    return b"".join(b'{"id": %d, "method": "mining.submit", "params": []}\n' % i for i in range(first, first + count))
+
+def test_unanswered_submits_expire_and_tracking_resumes(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(metrics_module.time, "perf_counter", lambda: now[0])
+    session = SessionMetrics("check")
+    session.worker = "DCheckWallet.silent"
+    session.track_submits(_submits(0, MAX_PENDING_SUBMITS))
+    assert len(session.pending) == MAX_PENDING_SUBMITS
+    now[0] += SUBMIT_TIMEOUT
+    session.track_submits(_submits(MAX_PENDING_SUBMITS, 1))
+    assert list(session.pending) == [b"%d" % MAX_PENDING_SUBMITS]
+    session.match_responses(b'{"id": %d, "result": true, "error": null}\n' % MAX_PENDING_SUBMITS)
+    assert (session.unanswered, session.accepted) == (MAX_PENDING_SUBMITS, 1)
+    assert metrics.shares[("check", "DCheckWallet.silent", "unanswered")] == MAX_PENDING_SUBMITS
+    session.close()
@@ -0,0 +1,291 @@
+"""share_filter: ответы на устаревшие и повторные шары без пула.
+
+Сквозные тесты запускают прокси подпроцессом против поддельного пула из scripts/loadtest и гоняют
+одного майнера по сценарию из валидных, повторных и устаревших шар (в том числе две шары в одном
+пакете, шару по неизвестному заданию и по заданию, которое пул забыл без clean_jobs) на прямых и на
+общих (aggregate) сессиях, с share_filter и без. Ответы майнеру должны совпасть с ответами пула,
+до пула не должны доходить только отсеянные шары, и они видны в /metrics по воркеру.
+"""
+import asyncio
+import json
+import os
+import signal
+import sys
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts", "loadtest"))
+
+from fake_pool import FakePool  # noqa: E402
+from run import free_port, wait_for_port  # noqa: E402
+from src.mode_state import ModeState  # noqa: E402
+from src.stratum_proxy.forwarding import forward_to_miner  # noqa: E402
+from src.stratum_proxy.share_filter import ShareFilter  # noqa: E402
+
+WORKER = "DCheckWallet.rig1"
+STALE, DUPLICATE = 21, 22
+
+def _notify(job_id, clean):
+    return json.dumps({"id": None, "method": "mining.notify", "params": [job_id, "00" * 32, "", "", [], "20000000", "1d00ffff", "5f5e1000", clean]}).encode()
+
+def _share(job_id, nonce):
+    return [WORKER, job_id, f"{nonce:08x}", "5f5e1000", f"{nonce:08x}"]
+
+def test_filter_rejects_jobs_cancelled_by_clean_jobs():
+    share_filter = ShareFilter("check")
+    share_filter.notify(_notify("1", True))
+    share_filter.notify(_notify("2", False))
+    assert share_filter.check(_share("1", 1)) is None
+    share_filter.notify(_notify("3", True))
+    assert share_filter.check(_share("1", 2)) == "stale"
+    assert share_filter.check(_share("2", 3)) == "stale"
+    assert share_filter.check(_share("3", 4)) is None
+
+def test_filter_rejects_repeated_share_until_clean_jobs():
+    share_filter = ShareFilter("check")
+    share_filter.notify(_notify("1", True))
+    assert share_filter.check(_share("1", 1)) is None
+    assert share_filter.check(_share("1", 1)) == "duplicate"
+    share_filter.notify(_notify("2", False))
+    assert share_filter.check(_share("1", 1)) == "duplicate"
+    share_filter.notify(_notify("3", True))
+    assert share_filter.check(_share("3", 1)) is None
+
+def test_filter_passes_unknown_jobs_to_pool():
+    share_filter = ShareFilter("check")
+    share_filter.notify(_notify("1", True))
+    assert share_filter.check(_share("ffffff", 1)) is None
+    assert share_filter.check(["short"]) is None
+
+def test_filter_submits_answers_rejected_lines_and_keeps_the_rest():
+    replies = []
+    share_filter = ShareFilter("check", reply=replies.append)
+    share_filter.notify(_notify("1", True))
+    lines = [
+        json.dumps({"id": 10 + i, "method": "mining.submit", "params": _share("1", 1)}).encode() + b"\n" for i in range(2)
+    ]
+    kept = share_filter.filter_submits(b"".join(lines) + b'{"id": 20, "method": "mining.ping"}\n')
+    assert kept == lines[0] + b'{"id": 20, "method": "mining.ping"}\n'
+    assert [json.loads(reply) for reply in replies] == [{"id": 11, "result": None, "error": [DUPLICATE, "Duplicate share", None]}]
+
+def test_filter_parses_escaped_submit_as_json():
+    replies = []
+    share_filter = ShareFilter("check", reply=replies.append)
+    share_filter.notify(_notify("1", True))
+    line = json.dumps({"id": 10, "method": "mining.submit", "params": ['rig"1', "1", "00", "5f5e1000", "00000001"]}).encode() + b"\n"
+    assert share_filter.filter_submits(line) == line
+    assert share_filter.filter_submits(line) == b""
+    assert json.loads(replies[0])["error"][0] == DUPLICATE
+
+class _MinerWriter:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    def is_closing(self):
+        return False
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+def test_reply_waits_for_end_of_split_pool_line():
+    async def scenario():
+        pool_reader, miner_writer = asyncio.StreamReader(), _MinerWriter()
+        share_filter = ShareFilter("check", reply=miner_writer.write)
+        to_miner = asyncio.create_task(forward_to_miner(pool_reader, miner_writer, "miner", buffered=True, share_filter=share_filter))
+        submit, repeat = (json.dumps({"id": msg_id, "method": "mining.submit", "params": _share("1", 1)}).encode() + b"\n" for msg_id in (10, 11))
+        pool_reader.feed_data(_notify("1", True) + b"\n")
+        await asyncio.sleep(0.01)
+        assert share_filter.filter_submits(submit) == submit
+        # Пул прислал половину mining.notify, майнер тут же повторил шару
+        second = _notify("2", False) + b"\n"
+        pool_reader.feed_data(second[:40])
+        await asyncio.sleep(0.01)
+        assert share_filter.filter_submits(repeat) == b""
+        pool_reader.feed_data(second[40:])
+        pool_reader.feed_eof()
+        await to_miner
+        return miner_writer.data
+
+    data = asyncio.run(scenario())
+    messages = [json.loads(line) for line in data.splitlines()]
+    assert [msg.get("method") or msg["error"][0] for msg in messages] == ["mining.notify", "mining.notify", DUPLICATE]
+
+class CheckMiner:
+    """Майнер на StreamReader: ответы по id, задания из mining.notify по порядку."""
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.extranonce2_size = 0
+        self.jobs = []
+        self.notified = asyncio.Event()
+        self.waiting = {}
+        self.next_id = 10
+        self._task = None
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        self._task = asyncio.create_task(self._read_loop())
+        subscribe = self._request("mining.subscribe", ["check/1.0"])
+        authorize = self._request("mining.authorize", ["check.rig1", "x"])
+        self.extranonce2_size = (await asyncio.wait_for(subscribe, 5))["result"][2]
+        assert (await asyncio.wait_for(authorize, 5))["result"] is True
+        await self.wait_job(None)
+
+    def _request(self, method, params, send=True):
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.next_id] = future
+        line = (json.dumps({"id": self.next_id, "method": method, "params": params}) + "\n").encode()
+        if send:
+            self.writer.write(line)
+            return future
+        return future, line
+
+    async def _read_loop(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            msg = json.loads(line)
+            if msg.get("method") == "mining.notify":
+                self.jobs.append(msg["params"][0])
+                self.notified.set()
+            elif msg.get("id") in self.waiting:
+                self.waiting.pop(msg["id"]).set_result(msg)
+
+    async def wait_job(self, job_id):
+        """Ждёт mining.notify с заданием job_id (None — любое первое)."""
+        while not self.jobs or (job_id is not None and self.jobs[-1] != job_id):
+            self.notified.clear()
+            await asyncio.wait_for(self.notified.wait(), 5)
+
+    def share(self, job_id, nonce):
+        return [WORKER, job_id, f"{nonce:0{self.extranonce2_size * 2}x}", "5f5e1000", f"{nonce:08x}"]
+
+    async def submit(self, job_id, nonce):
+        return _code(await asyncio.wait_for(self._request("mining.submit", self.share(job_id, nonce)), 5))
+
+    async def submit_batch(self, shares):
+        """Несколько submit одним write: проверяет разбор пачки строк."""
+        futures, lines = zip(*(self._request("mining.submit", self.share(*share), send=False) for share in shares))
+        self.writer.write(b"".join(lines))
+        return [_code(await asyncio.wait_for(future, 5)) for future in futures]
+
+    def close(self):
+        self._task.cancel()
+        self.writer.close()
+
+def _code(response):
+    return True if response.get("result") is True else (response.get("error") or [None])[0]
+
+async def scenario(pool, miner):
+    """Коды ответов майнеру по шагам сценария."""
+    codes = []
+    first = miner.jobs[-1]
+    codes.append(await miner.submit(first, 1))  # валидная
+    codes.append(await miner.submit(first, 1))  # повтор
+    codes.append(await miner.submit(first, 2))  # валидная
+    pool.broadcast_job(clean=False)
+    await miner.wait_job(pool.jobs[-1])
+    second = miner.jobs[-1]
+    codes.append(await miner.submit(first, 3))  # старое задание без clean_jobs ещё действует
+    codes.append(await miner.submit(first, 1))  # повтор через notify
+    pool.broadcast_job(clean=True)
+    await miner.wait_job(pool.jobs[-1])
+    third = miner.jobs[-1]
+    codes.append(await miner.submit(first, 4))  # отменено clean_jobs
+    codes.append(await miner.submit(second, 5))  # отменено clean_jobs
+    codes.append(await miner.submit(third, 1))  # валидная
+    codes.append(await miner.submit(third, 1))  # повтор
+    codes.append(await miner.submit("ffffff", 6))  # задание, которого не было: решает пул
+    codes += await miner.submit_batch([(third, 7), (third, 7)])  # валидная и её повтор в одном пакете
+    for _ in range(pool.jobs_kept):
+        pool.broadcast_job(clean=False)
+    await miner.wait_job(pool.jobs[-1])
+    codes.append(await miner.submit(third, 8))  # пул забыл задание без clean_jobs: решает пул
+    return codes
+
+EXPECTED_CODES = [True, DUPLICATE, True, True, DUPLICATE, STALE, STALE, True, DUPLICATE, STALE, True, DUPLICATE, STALE]
+# Из них прокси с share_filter отвечает сам: 2 устаревшие и 4 повтора
+EXPECTED_FILTERED = {"stale": 2, "duplicate": 4}
+
+def scrape_filtered(metrics_port):
+    body = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5).read().decode()
+    counts = {}
+    for line in body.splitlines():
+        if line.startswith("stratum_proxy_shares_total{") and f'worker="{WORKER}"' in line:
+            for reason in ("stale", "duplicate"):
+                if f'result="{reason}"' in line:
+                    counts[reason] = counts.get(reason, 0) + int(line.rsplit(" ", 1)[1])
+    return counts
+
+async def run_scenario(tmp_path, aggregate, share_filter, buffered):
+    """(коды ответов, пул, отсеянные шары в /metrics) одного прогона сценария через прокси-подпроцесс."""
+    # Сложность пула ниже любой шары: поддельный пул хэши не проверяет, общая сессия проверяет
+    pool = await FakePool("check", notify_interval=0, difficulty=2 ** -33).start()
+    port, metrics_port = free_port(), free_port()
+    settings = {
+        "port": port, "metrics_port": metrics_port, "upstream_pool_size": 0, "upstream_probe_interval": 0,
+        "config_reload_interval": 0, "aggregate": aggregate, "share_filter": share_filter, "buffered_forwarding": buffered,
+    }
+    mode = {"host": "127.0.0.1", "port": pool.port, "alias": {"check": "DCheckWallet"}, "algorithm": "sha256d"}
+    paths = {
+        "STRATUM_PROXY_CONFIG": str(tmp_path / "config.json"),
+        "STRATUM_PROXY_MODE_FILE": str(tmp_path / "current_mode.txt"),
+        "STRATUM_PROXY_MODE_SOCKET": str(tmp_path / "mode.sock"),
+        "STRATUM_PROXY_WORKER_SOCKET": str(tmp_path / "workers.sock"),
+        "STRATUM_PROXY_ADMIN_SOCKET": str(tmp_path / "admin.sock"),
+    }
+    with open(paths["STRATUM_PROXY_CONFIG"], "w", encoding="utf-8") as f:
+        json.dump({"modes": {"check": mode}, "proxy": settings}, f)
+    ModeState(paths["STRATUM_PROXY_MODE_FILE"]).set("check")
+    log_file = open(tmp_path / "proxy.log", "wb")
+    proxy = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "src.stratum_proxy.proxy",
+        env={**os.environ, **paths}, stdout=log_file, stderr=log_file, cwd=ROOT,
+    )
+    miner = CheckMiner()
+    try:
+        assert await wait_for_port(port, 15), "прокси не запустился"
+        await miner.connect(port)
+        codes = await scenario(pool, miner)
+        counts = await asyncio.get_running_loop().run_in_executor(None, scrape_filtered, metrics_port)
+        return codes, pool, counts
+    finally:
+        if miner.writer is not None:
+            miner.close()
+        proxy.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proxy.wait(), 15)
+        except asyncio.TimeoutError:
+            proxy.kill()
+        await pool.stop()
+        log_file.close()
+
+@pytest.mark.parametrize("buffered", [True, False], ids=["buffered", "lines"])
+@pytest.mark.parametrize("aggregate", [False, True], ids=["direct", "aggregate"])
+@pytest.mark.parametrize("share_filter", [True, False], ids=["filter", "passthrough"])
+def test_proxy_answers_like_pool(tmp_path, aggregate, share_filter, buffered):
+    codes, pool, counts = asyncio.run(run_scenario(tmp_path, aggregate, share_filter, buffered))
+    assert codes == EXPECTED_CODES
+    # Общая сессия авторизуется у пула одним воркером на кошелёк, прямая — воркером майнера
+    assert list(pool.authorized_users) == (["DCheckWallet.proxy"] if aggregate else [WORKER])
+    if share_filter:
+        # До пула доходят только шары по неизвестному и забытому заданиям: их решает пул
+        assert pool.submits == len(codes) - sum(EXPECTED_FILTERED.values())
+        assert pool.rejected == {"stale": 2, "duplicate": 0}
+        assert counts == EXPECTED_FILTERED
+    else:
+        assert pool.submits == len(codes)
+        assert pool.rejected == {"stale": EXPECTED_CODES.count(STALE), "duplicate": EXPECTED_CODES.count(DUPLICATE)}
+        assert counts == {}
@@ -0,0 +1,32 @@
+"""Выбор эндпоинта для новых сессий по пробам пулов."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.stratum_proxy.upstream_health import LATENCY_STEP, UpstreamHealth  # noqa: E402
+
+def _health(*latencies):
+    health = UpstreamHealth("check", [("127.0.0.1", 3000 + i) for i in range(len(latencies))])
+    for endpoint, latency in zip(health.endpoints, latencies):
+        endpoint.latency = latency
+    return health
+
+def test_preferred_holds_until_another_is_faster_by_a_step():
+    health = _health(LATENCY_STEP * 1.02, LATENCY_STEP * 0.98)
+    first, second = health.endpoints
+    health._preferred = health.preferred()
+    assert health._preferred is second
+    # Задержки у границы шага поменялись местами: быстрейший остаётся прежним
+    first.latency, second.latency = LATENCY_STEP * 0.98, LATENCY_STEP * 1.02
+    assert health.preferred() is second
+    first.latency = second.latency - LATENCY_STEP
+    assert health.preferred() is first
+
+def test_dead_preferred_gives_way():
+    health = _health(0.001, 0.050)
+    first, second = health.endpoints
+    health._preferred = first
+    health.mark_failure(first, OSError("refused"), immediate=True)
+    assert health.preferred() is second